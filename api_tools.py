@@ -0,0 +1,310 @@
+"""
+外部 API 工具执行器
+api_url 工具在事件循环上异步调用：按工具主机复用连接池，超时和重试策略取自工具配置，
+并遵循工具 API 返回的 Cache-Control / ETag / Last-Modified（新鲜的响应直接复用，过期后条件请求，304 时沿用缓存结果）
+
+同步调用方（Flask 请求线程、MCP 工具线程）通过 call() 把请求提交到后台事件循环，所有并发的工具调用共享同一组连接；
+异步服务模式下直接 await acall()。未安装 httpx 时后台事件循环改用上游连接池（requests）发送请求
+"""
+
+import os
+import json
+import time
+import asyncio
+import threading
+import logging
+import weakref
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+import requests
+
+from http_pool import upstream_pool
+from tool_cache import canonical_arguments
+
+# 可选依赖：httpx（异步连接池）
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = float(os.environ.get('TOOL_API_TIMEOUT', '30'))
+RETRY_STATUSES = (429, 502, 503, 504)
+
+# 可重试的请求异常（超时 / 连接错误）
+_TIMEOUT_ERRORS = (asyncio.TimeoutError, requests.exceptions.Timeout) + ((httpx.TimeoutException,) if httpx else ())
+_TRANSPORT_ERRORS = (OSError, requests.exceptions.RequestException) + ((httpx.TransportError,) if httpx else ())
+
+
+def parse_cache_control(value: str) -> Dict[str, Optional[str]]:
+    """解析 Cache-Control 头，返回 {指令: 值或 None}"""
+    directives = {}
+    for part in (value or '').split(','):
+        name, _, argument = part.strip().partition('=')
+        if name:
+            directives[name.lower()] = argument.strip('"') or None
+    return directives
+
+
+def freshness_lifetime(headers) -> Tuple[bool, float]:
+    """
+    按响应头计算缓存策略
+
+    Returns:
+        (是否可以保存, 剩余新鲜时间秒数) - 新鲜时间为 0 表示每次使用前都要重新验证
+    """
+    directives = parse_cache_control(headers.get('cache-control', ''))
+    if 'no-store' in directives:
+        return False, 0.0
+    lifetime = 0.0
+    if 'no-cache' not in directives:
+        try:
+            if directives.get('max-age') is not None:
+                lifetime = float(directives['max-age']) - float(headers.get('age') or 0)
+            elif headers.get('expires'):
+                expires = parsedate_to_datetime(headers['expires'])
+                date = parsedate_to_datetime(headers['date']) if headers.get('date') else None
+                lifetime = expires.timestamp() - (date.timestamp() if date else time.time())
+        except (TypeError, ValueError):
+            lifetime = 0.0
+    return True, max(lifetime, 0.0)
+
+
+class _CacheEntry:
+    """保存的工具 API 响应"""
+
+    __slots__ = ('result', 'etag', 'last_modified', 'expires')
+
+    def __init__(self, result, etag, last_modified, expires):
+        self.result = result
+        self.etag = etag
+        self.last_modified = last_modified
+        self.expires = expires
+
+
+class _BackgroundLoop:
+    """供同步调用方使用的后台事件循环（fork 后自动重建）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loop = None
+        self._pid = None
+
+    def run(self, coro):
+        """在后台事件循环上执行协程并等待结果"""
+        return asyncio.run_coroutine_threadsafe(coro, self._get()).result()
+
+    def _get(self):
+        with self._lock:
+            if self._loop is None or self._pid != os.getpid():
+                self._loop = asyncio.new_event_loop()
+                self._pid = os.getpid()
+                threading.Thread(target=self._loop.run_forever, name='api-tools-loop', daemon=True).start()
+            return self._loop
+
+
+class ApiToolExecutor:
+    """
+    外部 API 工具执行器
+
+    - 每个事件循环、每个工具主机一个 httpx.AsyncClient（最多 host_connections 个连接）
+    - 工具配置: timeout（秒，默认 TOOL_API_TIMEOUT）、retries（重试次数，默认 0）、retry_backoff（首次重试等待秒数，默认 0.5，之后翻倍）；
+      连接错误、超时和 429/502/503/504 会重试。timeout 是整次调用（包括重试和等待）的截止时间，剩余时间不够时不再重试
+    - HTTP 缓存: GET 响应按 Cache-Control 保存，有 ETag / Last-Modified 时过期后发送条件请求；
+      POST 响应只在带有明确的 max-age / Expires 时保存。缓存键为 (方法, URL, 参数, 请求头)，超过 max_entries 时按 LRU 淘汰
+    """
+
+    def __init__(self, max_entries: int = 512, host_connections: int = 20):
+        self.max_entries = max_entries
+        self.host_connections = host_connections
+        self._lock = threading.Lock()
+        self._entries: 'OrderedDict[tuple, _CacheEntry]' = OrderedDict()
+        self._clients = weakref.WeakKeyDictionary()  # 事件循环 -> {主机: httpx.AsyncClient}
+        self._background = _BackgroundLoop()
+        self._counters = {'requests': 0, 'hits': 0, 'revalidated': 0, 'misses': 0, 'retries': 0, 'errors': 0}
+
+    # ==================== 对外接口 ====================
+
+    def call(self, tool_config: Dict, arguments, timeout: Optional[float] = None) -> Dict:
+        """同步执行（在后台事件循环上运行）"""
+        return self._background.run(self.acall(tool_config, arguments, timeout))
+
+    async def acall(self, tool_config: Dict, arguments, timeout: Optional[float] = None) -> Dict:
+        """
+        异步执行 api_url 工具，返回 {'success': ..., 'result'/'error': ...}
+
+        timeout: 调用方的时间上限（如隔离舱截止前的剩余时间），与工具配置的 timeout 取较小值
+        """
+        url = tool_config['api_url']
+        method = tool_config.get('api_method', 'POST').upper()
+        headers = dict(tool_config.get('api_headers') or {})
+        if method not in ('GET', 'POST'):
+            logger.error(f"   ❌ 不支持的HTTP方法: {method}")
+            return {'success': False, 'error': f'不支持的HTTP方法: {method}'}
+
+        key = (method, url, canonical_arguments(arguments), canonical_arguments(headers))
+        entry = self._lookup(key)
+        if entry is not None and entry.expires > time.monotonic():
+            self._count('hits')
+            logger.info(f"   ♻️ 命中工具API缓存: {method} {url}")
+            return {'success': True, 'result': entry.result, 'cached': True}
+        if entry is not None:
+            if entry.etag:
+                headers['If-None-Match'] = entry.etag
+            if entry.last_modified:
+                headers['If-Modified-Since'] = entry.last_modified
+
+        logger.info(f"   调用外部API: {method} {url}")
+        start_time = time.time()
+        tool_timeout = float(tool_config.get('timeout') or DEFAULT_TIMEOUT)
+        deadline = time.monotonic() + (tool_timeout if timeout is None else min(tool_timeout, timeout))
+        retries = max(0, int(tool_config.get('retries') or 0))
+        backoff = float(tool_config.get('retry_backoff') or 0.5)
+        error = f'工具API调用超时（{tool_timeout:g}s）'  # 截止时间在第一次请求前就已用完
+
+        for attempt in range(retries + 1):
+            if attempt:
+                delay = backoff * 2 ** (attempt - 1)
+                if deadline - time.monotonic() <= delay:
+                    logger.warning(f"   ⚠️ 剩余时间不足，不再重试 ({attempt}/{retries})")
+                    break
+                self._count('retries')
+                await asyncio.sleep(delay)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                error = f'工具API调用超时（{tool_timeout:g}s）'
+                break
+            self._count('requests')
+            try:
+                status, response_headers, body = await asyncio.wait_for(
+                    self._send(method, url, arguments, headers, remaining), remaining
+                )
+            except _TIMEOUT_ERRORS:
+                error = f'工具API调用超时（{tool_timeout:g}s）'
+            except _TRANSPORT_ERRORS as e:
+                error = f'工具执行错误: {e}'
+            else:
+                if status in RETRY_STATUSES and attempt < retries and deadline - time.monotonic() > backoff * 2 ** attempt:
+                    error = f'工具API调用失败: HTTP {status}'
+                    logger.warning(f"   ⚠️ API返回 HTTP {status}，重试 ({attempt + 1}/{retries})")
+                    continue
+                return self._complete(key, method, entry, status, response_headers, body, time.time() - start_time)
+            if attempt < retries:
+                logger.warning(f"   ⚠️ {error}，重试 ({attempt + 1}/{retries})")
+
+        self._count('errors')
+        logger.error(f"   ❌ {error} ({time.time() - start_time:.2f}s)")
+        return {'success': False, 'error': error}
+
+    # ==================== 请求 ====================
+
+    async def _send(self, method, url, arguments, headers, timeout):
+        """发送一次请求，返回 (状态码, 响应头, 响应体字节)"""
+        kwargs = {'params': arguments} if method == 'GET' else {'json': arguments}
+        if httpx is None:
+            loop = asyncio.get_running_loop()
+            response = await loop.run_in_executor(
+                None, lambda: upstream_pool.request(method, url, headers=headers, timeout=timeout, **kwargs)
+            )
+            return response.status_code, response.headers, response.content
+        response = await self._client(url).request(method, url, headers=headers, timeout=timeout, **kwargs)
+        return response.status_code, response.headers, response.content
+
+    def _client(self, url: str):
+        """当前事件循环中工具主机对应的客户端"""
+        parts = urlsplit(url)
+        host = (parts.scheme, parts.hostname or '', parts.port or (443 if parts.scheme == 'https' else 80))
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            clients = self._clients.setdefault(loop, {})
+            client = clients.get(host)
+            if client is None:
+                client = clients[host] = httpx.AsyncClient(limits=httpx.Limits(
+                    max_connections=self.host_connections,
+                    max_keepalive_connections=self.host_connections
+                ))
+                logger.debug(f"🔌 创建工具API连接池: {host[0]}://{host[1]}:{host[2]}")
+        return client
+
+    def _complete(self, key, method, entry, status, headers, body, elapsed) -> Dict:
+        """处理响应：304 沿用缓存结果，200/201 解析并按缓存策略保存"""
+        if status == 304 and entry is not None:
+            self._count('revalidated')
+            self._store(key, method, headers, entry.result, entry)
+            logger.info(f"   ✅ API结果未变化（304，{elapsed:.2f}s）")
+            return {'success': True, 'result': entry.result, 'cached': True}
+
+        self._count('misses')
+        if status not in (200, 201):
+            self._count('errors')
+            logger.error(f"   ❌ API调用失败: HTTP {status} ({elapsed:.2f}s)")
+            logger.debug(f"   响应: {body[:500]!r}")
+            return {'success': False, 'error': f'工具API调用失败: HTTP {status}'}
+
+        try:
+            result = json.loads(body)
+        except ValueError:
+            result = body.decode('utf-8', errors='replace')
+        if status == 200:
+            self._store(key, method, headers, result, None)
+        logger.info(f"   ✅ API调用成功 ({elapsed:.2f}s)")
+        logger.debug(f"   响应: {body[:500]!r}")
+        return {'success': True, 'result': result}
+
+    # ==================== 缓存 ====================
+
+    def _lookup(self, key) -> Optional[_CacheEntry]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def _store(self, key, method, headers, result, previous: Optional[_CacheEntry]):
+        storable, lifetime = freshness_lifetime(headers)
+        etag = headers.get('etag') or (previous.etag if previous else None)
+        last_modified = headers.get('last-modified') or (previous.last_modified if previous else None)
+        validators = method == 'GET' and (etag or last_modified)
+        with self._lock:
+            if not storable or not (lifetime > 0 or validators):
+                self._entries.pop(key, None)
+                return
+            self._entries[key] = _CacheEntry(
+                result, etag if validators else None, last_modified if validators else None,
+                time.monotonic() + lifetime
+            )
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _count(self, name: str):
+        with self._lock:
+            self._counters[name] += 1
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        """执行器统计，用于监控"""
+        with self._lock:
+            return {
+                'available': httpx is not None,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hosts': sum(len(clients) for clients in self._clients.values()),
+                **self._counters
+            }
+
+
+# 全局共享的外部 API 工具执行器
+api_executor = ApiToolExecutor(
+    max_entries=int(os.environ.get('TOOL_HTTP_CACHE_SIZE', '512')),
+    host_connections=int(os.environ.get('TOOL_HOST_CONNECTIONS', '20'))
+)
@@ -5,14 +5,29 @@
 import os
 import json
 import base64
+import hashlib
 import requests
 import time
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 from flask import Flask, request, jsonify, send_from_directory, Response, stream_with_context
 from flask_cors import CORS
 import traceback
 from mcp import MCPCoordinator, format_mcp_event_for_sse
+from registry import create_registry
+from http_pool import upstream_pool, async_upstream, model_timeouts, DEFAULT_CONNECT_TIMEOUT
+from tool_cache import tool_cache
+from tool_output import result_store
+from context_window import fit_context
+from request_body import encode_request_body, message_cache
+from providers import request_compiler, CompiledModel
+from tool_selector import tool_selector, query_text, DEFAULT_TOP_K as TOOL_SELECT_TOP_K
+from code_tools import code_cache, compile_code
+from sandbox import sandbox_pool, run_code_tool
+from api_tools import api_executor
+from bulkhead import tool_bulkheads
 
 # 配置日志
 logging.basicConfig(
@@ -66,6 +81,9 @@ def log_response(response):
 CONFIG_DIR = os.path.join(os.path.dirname(__file__), 'config')
 MODELS_CONFIG = os.path.join(CONFIG_DIR, 'models.json')
 TOOLS_CONFIG = os.path.join(CONFIG_DIR, 'tools.json')
+# 配置存储后端: json（默认）或 sqlite（多 worker 部署时使用，首次启动自动从 JSON 迁移）
+CONFIG_BACKEND = os.environ.get('CONFIG_BACKEND', 'json')
+CONFIG_DB = os.environ.get('CONFIG_DB', os.path.join(CONFIG_DIR, 'registry.db'))
 UPLOAD_DIR = os.path.join(os.path.dirname(__file__), 'uploads')
 
 # 确保目录存在
@@ -73,26 +91,50 @@ os.makedirs(CONFIG_DIR, exist_ok=True)
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
 
-def load_json_config(path, default=None):
-    """加载 JSON 配置文件"""
-    if os.path.exists(path):
-        try:
-            with open(path, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except Exception as e:
-            print(f"加载配置失败 {path}: {e}")
-    return default or []
+# 模型/工具注册表（进程内缓存，存储版本变化时自动重新加载）
+model_registry = create_registry('models', MODELS_CONFIG, CONFIG_BACKEND, CONFIG_DB)
+tool_registry = create_registry('tools', TOOLS_CONFIG, CONFIG_BACKEND, CONFIG_DB)
 
 
-def save_json_config(path, data):
-    """保存 JSON 配置文件"""
-    try:
-        with open(path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-        return True
-    except Exception as e:
-        print(f"保存配置失败 {path}: {e}")
-        return False
+def conditional_json(etag, build_payload, cache_control='no-cache'):
+    """
+    支持条件请求的 JSON 响应
+
+    If-None-Match 命中时直接返回 304，不再序列化响应体
+    """
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = jsonify(build_payload())
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+
+def get_active_tools(enabled_tools):
+    """根据前端勾选的工具 id 获取已启用的工具配置（保持注册顺序，工具定义顺序不随勾选顺序变化）"""
+    return [tool for tool in tool_registry.get_many(enabled_tools) if tool.get('enabled', True)]
+
+
+def select_tools(data, active_tools):
+    """
+    工具较多时按最新的用户消息筛选相关工具（请求的 tool_top_k 或 TOOL_SELECT_TOP_K 大于 0 时启用）
+
+    Returns:
+        (发给模型的工具, 筛选报告) - 没有筛选时报告为 None
+    """
+    top_k = int(data.get('tool_top_k') or TOOL_SELECT_TOP_K)
+    if top_k <= 0 or len(active_tools) <= top_k:
+        return active_tools, None
+    # 注册表有变化时增量更新索引
+    tools = tool_registry.all()
+    tool_selector.sync(tools, tool_registry.version)
+    return tool_selector.select(query_text(data.get('messages', [])), active_tools, top_k)
+
+
+def selection_event(selection):
+    """工具筛选报告事件（报告发给模型的工具定义减少了多少）"""
+    return {'type': 'tools_selected', 'timestamp': datetime.now().isoformat(), **selection}
 
 
 # ==================== 模型管理 ====================
@@ -100,8 +142,11 @@ def save_json_config(path, data):
 @app.route('/api/models', methods=['GET'])
 def get_models():
     """获取所有已注册的模型"""
-    models = load_json_config(MODELS_CONFIG, [])
-    return jsonify({'success': True, 'models': models})
+    return conditional_json(
+        model_registry.etag,
+        lambda: {'success': True, 'models': model_registry.all()},
+        cache_control='private, no-cache'
+    )
 
 
 @app.route('/api/models/test', methods=['POST'])
@@ -135,21 +180,18 @@ def register_model():
         url = data.get('url', '').strip()
         api_key = data.get('api_key', '').strip()
         model_type = data.get('model_type', 'openai')  # openai, claude, custom
+        context_window = data.get('context_window')  # 上下文窗口（tokens），不设置时使用默认值
         
         if not name or not url:
             return jsonify({'success': False, 'error': '模型名称和 URL 不能为空'})
         
-        # 加载现有模型
-        models = load_json_config(MODELS_CONFIG, [])
-        
         # 检查是否已存在
-        for model in models:
-            if model['name'] == name:
-                return jsonify({'success': False, 'error': '模型名称已存在'})
+        if model_registry.get_by_name(name):
+            return jsonify({'success': False, 'error': '模型名称已存在'})
         
         # 添加新模型
         new_model = {
-            'id': f"model_{len(models) + 1}_{int(datetime.now().timestamp())}",
+            'id': f"model_{len(model_registry) + 1}_{int(datetime.now().timestamp())}",
             'name': name,
             'actual_model_name': actual_model_name,
             'url': url,
@@ -158,10 +200,11 @@ def register_model():
             'created_at': datetime.now().isoformat(),
             'status': 'active'
         }
-        models.append(new_model)
+        if context_window:
+            new_model['context_window'] = int(context_window)
         
         # 保存配置
-        if save_json_config(MODELS_CONFIG, models):
+        if model_registry.add(new_model):
             return jsonify({'success': True, 'model': new_model})
         else:
             return jsonify({'success': False, 'error': '保存模型配置失败'})
@@ -177,15 +220,18 @@ def update_model(model_id):
         data = request.json
         system_prompt = data.get('system_prompt', '')
         
-        models = load_json_config(MODELS_CONFIG, [])
+        if not model_registry.get(model_id):
+            return jsonify({'success': False, 'error': '模型不存在'})
         
-        for model in models:
-            if model['id'] == model_id:
-                model['system_prompt'] = system_prompt
-                model['updated_at'] = datetime.now().isoformat()
-                break
+        updates = {
+            'system_prompt': system_prompt,
+            'updated_at': datetime.now().isoformat()
+        }
+        if data.get('context_window'):
+            updates['context_window'] = int(data['context_window'])
+        updated = model_registry.update(model_id, updates)
         
-        if save_json_config(MODELS_CONFIG, models):
+        if updated:
             return jsonify({'success': True})
         else:
             return jsonify({'success': False, 'error': '保存配置失败'})
@@ -197,10 +243,7 @@ def update_model(model_id):
 def delete_model(model_id):
     """删除模型"""
     try:
-        models = load_json_config(MODELS_CONFIG, [])
-        models = [m for m in models if m['id'] != model_id]
-        
-        if save_json_config(MODELS_CONFIG, models):
+        if model_registry.remove(model_id):
             return jsonify({'success': True})
         else:
             return jsonify({'success': False, 'error': '保存配置失败'})
@@ -211,42 +254,21 @@ def delete_model(model_id):
 def test_model_connection(url, api_key, model_type, actual_model_name='gpt-3.5-turbo'):
     """测试模型连接"""
     try:
-        headers = {
-            'Content-Type': 'application/json',
-        }
-        
-        if api_key:
-            if model_type == 'openai':
-                headers['Authorization'] = f'Bearer {api_key}'
-            elif model_type == 'claude':
-                headers['x-api-key'] = api_key
-                headers['anthropic-version'] = '2023-06-01'
+        compiled = CompiledModel({
+            'url': url,
+            'api_key': api_key,
+            'model_type': model_type,
+            'actual_model_name': actual_model_name
+        })
         
         # 构造测试请求
-        if model_type == 'openai':
-            test_data = {
-                'model': actual_model_name,
-                'messages': [{'role': 'user', 'content': 'test'}],
-                'max_tokens': 5
-            }
-            endpoint = url if url.endswith('/chat/completions') else f"{url.rstrip('/')}/chat/completions"
-        elif model_type == 'claude':
-            test_data = {
-                'model': actual_model_name,
-                'messages': [{'role': 'user', 'content': 'test'}],
-                'max_tokens': 5
-            }
-            endpoint = url if url.endswith('/messages') else f"{url.rstrip('/')}/messages"
-        else:
-            # 自定义类型，尝试 OpenAI 格式
-            test_data = {
-                'model': actual_model_name,
-                'messages': [{'role': 'user', 'content': 'test'}],
-                'max_tokens': 5
-            }
-            endpoint = url
+        test_data = {
+            'model': compiled.model_name,
+            'messages': [{'role': 'user', 'content': 'test'}],
+            'max_tokens': 5
+        }
         
-        response = requests.post(endpoint, json=test_data, headers=headers, timeout=10)
+        response = upstream_pool.post(compiled.url, json=test_data, headers=compiled.headers, timeout=(DEFAULT_CONNECT_TIMEOUT, 10))
         
         if response.status_code in [200, 201]:
             return {'success': True}
@@ -263,11 +285,88 @@ def test_model_connection(url, api_key, model_type, actual_model_name='gpt-3.5-t
 
 # ==================== 工具管理 ====================
 
+# 注册时保留的可选字段（工具类型、分类及执行方式相关配置）
+TOOL_OPTIONAL_FIELDS = ('tool_type', 'category', 'api_url', 'api_method', 'api_headers', 'code', 'max_parallel', 'cache_ttl', 'max_result_tokens', 'timeout',
+                        'retries', 'retry_backoff', 'max_concurrency', 'max_queue')
+
+# 工具列表分页参数
+TOOLS_PAGE_DEFAULT_LIMIT = 50
+TOOLS_PAGE_MAX_LIMIT = 500
+
+
+def build_tool_record(data, tool_id):
+    """
+    校验并构造工具配置记录
+
+    Returns:
+        (工具配置, 错误信息) - 校验失败时工具配置为 None
+    """
+    if not isinstance(data, dict):
+        return None, '工具定义必须是对象'
+    name = str(data.get('name', '')).strip()
+    description = str(data.get('description', '')).strip()
+    if not name or not description:
+        return None, '工具名称和描述不能为空'
+    
+    tool = {
+        'id': tool_id,
+        'name': name,
+        'description': description,
+        'parameters': data.get('parameters', {}),
+        'created_at': datetime.now().isoformat(),
+        'enabled': data.get('enabled', True)
+    }
+    for field in TOOL_OPTIONAL_FIELDS:
+        if field in data:
+            tool[field] = data[field]
+    # 代码工具在注册时编译一次，语法错误直接报告
+    if 'code' in tool:
+        _, error = compile_code(tool['code'], f"<tool:{name}>")
+        if error:
+            return None, error
+    return tool, None
+
+
 @app.route('/api/tools', methods=['GET'])
 def get_tools():
-    """获取所有已注册的工具"""
-    tools = load_json_config(TOOLS_CONFIG, [])
-    return jsonify({'success': True, 'tools': tools})
+    """
+    获取已注册的工具
+    
+    不带查询参数时返回全部工具；带 offset/limit/q/category 时返回分页结果
+    """
+    args = request.args
+    if not any(key in args for key in ('offset', 'limit', 'q', 'category')):
+        return conditional_json(
+            tool_registry.etag,
+            lambda: {'success': True, 'tools': tool_registry.all()},
+            cache_control='private, no-cache'
+        )
+    
+    try:
+        offset = max(int(args.get('offset', 0)), 0)
+        limit = min(max(int(args.get('limit', TOOLS_PAGE_DEFAULT_LIMIT)), 1), TOOLS_PAGE_MAX_LIMIT)
+    except ValueError:
+        return jsonify({'success': False, 'error': 'offset/limit 必须是整数'})
+    q = args.get('q', '').strip()
+    category = args.get('category') or None
+    
+    def build_page():
+        tools, total = tool_registry.query(q=q, category=category, offset=offset, limit=limit)
+        return {
+            'success': True,
+            'tools': tools,
+            'total': total,
+            'offset': offset,
+            'limit': limit,
+            'categories': tool_registry.categories()
+        }
+    
+    query_digest = hashlib.sha1(request.query_string).hexdigest()[:8]
+    return conditional_json(
+        f"{tool_registry.etag}-{query_digest}",
+        build_page,
+        cache_control='private, no-cache'
+    )
 
 
 @app.route('/api/tools/register', methods=['POST'])
@@ -275,34 +374,18 @@ def register_tool():
     """注册新工具"""
     try:
         data = request.json
-        name = data.get('name', '').strip()
-        description = data.get('description', '').strip()
-        parameters = data.get('parameters', {})
-        
-        if not name or not description:
-            return jsonify({'success': False, 'error': '工具名称和描述不能为空'})
-        
-        # 加载现有工具
-        tools = load_json_config(TOOLS_CONFIG, [])
+        new_tool, error = build_tool_record(
+            data, f"tool_{len(tool_registry) + 1}_{int(datetime.now().timestamp())}"
+        )
+        if error:
+            return jsonify({'success': False, 'error': error})
         
         # 检查是否已存在
-        for tool in tools:
-            if tool['name'] == name:
-                return jsonify({'success': False, 'error': '工具名称已存在'})
-        
-        # 添加新工具
-        new_tool = {
-            'id': f"tool_{len(tools) + 1}_{int(datetime.now().timestamp())}",
-            'name': name,
-            'description': description,
-            'parameters': parameters,
-            'created_at': datetime.now().isoformat(),
-            'enabled': True
-        }
-        tools.append(new_tool)
+        if tool_registry.get_by_name(new_tool['name']):
+            return jsonify({'success': False, 'error': '工具名称已存在'})
         
         # 保存配置
-        if save_json_config(TOOLS_CONFIG, tools):
+        if tool_registry.add(new_tool):
             return jsonify({'success': True, 'tool': new_tool})
         else:
             return jsonify({'success': False, 'error': '保存工具配置失败'})
@@ -311,14 +394,109 @@ def register_tool():
         return jsonify({'success': False, 'error': str(e)})
 
 
+@app.route('/api/tools/bulk', methods=['POST'])
+def bulk_register_tools():
+    """
+    批量注册工具
+    
+    请求体: {"tools": [...], "on_conflict": "skip" | "replace"}
+    也可直接提交 /api/tools/export 导出的 NDJSON（Content-Type: application/x-ndjson，
+    on_conflict 通过查询参数传入）
+    - skip（默认）: 名称已存在的工具跳过
+    - replace: 名称已存在的工具用新定义覆盖（保留原 id）
+    整批只写一次存储
+    """
+    try:
+        if request.mimetype == 'application/x-ndjson':
+            tool_defs = [
+                json.loads(line)
+                for line in request.get_data(as_text=True).splitlines()
+                if line.strip()
+            ]
+            on_conflict = request.args.get('on_conflict', 'skip')
+        else:
+            data = request.json or {}
+            tool_defs = data.get('tools', [])
+            on_conflict = data.get('on_conflict', 'skip')
+        
+        if not isinstance(tool_defs, list):
+            return jsonify({'success': False, 'error': 'tools 必须是数组'})
+        if on_conflict not in ('skip', 'replace'):
+            return jsonify({'success': False, 'error': f'不支持的 on_conflict: {on_conflict}'})
+        
+        timestamp = int(datetime.now().timestamp())
+        next_index = len(tool_registry) + 1
+        records = []
+        batch_names = set()
+        created, replaced, skipped, errors = 0, 0, [], []
+        
+        for index, tool_def in enumerate(tool_defs):
+            record, error = build_tool_record(tool_def, f"tool_{next_index}_{timestamp}")
+            if error:
+                errors.append({'index': index, 'error': error})
+                continue
+            
+            name = record['name']
+            if name in batch_names:
+                errors.append({'index': index, 'error': f'工具名称在本批次中重复: {name}'})
+                continue
+            batch_names.add(name)
+            
+            existing = tool_registry.get_by_name(name)
+            if existing:
+                if on_conflict == 'skip':
+                    skipped.append(name)
+                    continue
+                record['id'] = existing['id']
+                record['created_at'] = existing.get('created_at', record['created_at'])
+                record['updated_at'] = datetime.now().isoformat()
+                replaced += 1
+            else:
+                next_index += 1
+                created += 1
+            records.append(record)
+        
+        if records and not tool_registry.put_many(records):
+            return jsonify({'success': False, 'error': '保存工具配置失败'})
+        for record in records:
+            code_cache.invalidate(record['id'])
+        
+        logger.info(f"📦 批量注册工具: 新增 {created}, 覆盖 {replaced}, 跳过 {len(skipped)}, 失败 {len(errors)}")
+        return jsonify({
+            'success': True,
+            'created': created,
+            'replaced': replaced,
+            'skipped': skipped,
+            'errors': errors
+        })
+        
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({'success': False, 'error': str(e)})
+
+
+@app.route('/api/tools/export', methods=['GET'])
+def export_tools():
+    """导出所有工具（NDJSON 流，每行一个工具定义，可直接用于批量导入）"""
+    tools = tool_registry.all()
+    
+    def generate():
+        for tool in tools:
+            yield json.dumps(tool, ensure_ascii=False) + '\n'
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='application/x-ndjson',
+        headers={'Content-Disposition': 'attachment; filename=tools.ndjson'}
+    )
+
+
 @app.route('/api/tools/<tool_id>', methods=['DELETE'])
 def delete_tool(tool_id):
     """删除工具"""
     try:
-        tools = load_json_config(TOOLS_CONFIG, [])
-        tools = [t for t in tools if t['id'] != tool_id]
-        
-        if save_json_config(TOOLS_CONFIG, tools):
+        if tool_registry.remove(tool_id):
+            code_cache.invalidate(tool_id)
             return jsonify({'success': True})
         else:
             return jsonify({'success': False, 'error': '保存配置失败'})
@@ -330,14 +508,11 @@ def delete_tool(tool_id):
 def toggle_tool(tool_id):
     """启用/禁用工具"""
     try:
-        tools = load_json_config(TOOLS_CONFIG, [])
-        
-        for tool in tools:
-            if tool['id'] == tool_id:
-                tool['enabled'] = not tool.get('enabled', True)
-                break
+        tool = tool_registry.get(tool_id)
+        if not tool:
+            return jsonify({'success': False, 'error': '工具不存在'})
         
-        if save_json_config(TOOLS_CONFIG, tools):
+        if tool_registry.update(tool_id, {'enabled': not tool.get('enabled', True)}):
             return jsonify({'success': True})
         else:
             return jsonify({'success': False, 'error': '保存配置失败'})
@@ -432,73 +607,74 @@ def execute_tool():
         if not tool_name:
             return jsonify({'success': False, 'error': '工具名称不能为空'})
         
-        # 获取工具配置
-        tools = load_json_config(TOOLS_CONFIG, [])
-        tool_config = None
-        for tool in tools:
-            if tool['name'] == tool_name:
-                tool_config = tool
-                break
-        
-        if not tool_config:
-            return jsonify({'success': False, 'error': f'工具 {tool_name} 未注册'})
-        
-        # 执行工具
-        # 1. 优先使用内置工具
-        if tool_name in BUILTIN_TOOLS:
-            result = BUILTIN_TOOLS[tool_name](parameters)
-            return jsonify(result)
-        
-        # 2. 如果工具配置了外部API
-        if 'api_url' in tool_config:
-            try:
-                api_url = tool_config['api_url']
-                api_method = tool_config.get('api_method', 'POST').upper()
-                api_headers = tool_config.get('api_headers', {})
-                
-                if api_method == 'POST':
-                    response = requests.post(api_url, json=parameters, headers=api_headers, timeout=30)
-                elif api_method == 'GET':
-                    response = requests.get(api_url, params=parameters, headers=api_headers, timeout=30)
-                else:
-                    return jsonify({'success': False, 'error': f'不支持的HTTP方法: {api_method}'})
-                
-                if response.status_code in [200, 201]:
-                    return jsonify({
-                        'success': True,
-                        'result': response.json()
-                    })
-                else:
-                    return jsonify({
-                        'success': False,
-                        'error': f'工具API调用失败: HTTP {response.status_code}'
-                    })
-            except Exception as e:
-                return jsonify({'success': False, 'error': f'工具执行错误: {str(e)}'})
-        
-        # 3. 如果工具配置了Python代码
-        if 'code' in tool_config:
-            try:
-                # 安全执行自定义代码（生产环境需要更严格的沙箱）
-                local_vars = {'params': parameters, 'result': None}
-                exec(tool_config['code'], {"__builtins__": {}}, local_vars)
-                return jsonify({
-                    'success': True,
-                    'result': local_vars.get('result')
-                })
-            except Exception as e:
-                return jsonify({'success': False, 'error': f'代码执行错误: {str(e)}'})
-        
-        return jsonify({'success': False, 'error': '工具未配置执行方法（需要配置 api_url 或 code）'})
+        # 与对话中的工具调用走同一条执行路径（隔离舱、结果缓存）
+        return jsonify(execute_tool_call(tool_name, parameters))
         
     except Exception as e:
         traceback.print_exc()
         return jsonify({'success': False, 'error': str(e)})
 
 
-@app.route('/api/tools/builtin', methods=['GET'])
-def get_builtin_tools():
-    """获取内置工具列表"""
+# 批量执行工具：单批最大调用数和执行线程池
+TOOL_BATCH_MAX_CALLS = int(os.environ.get('TOOL_BATCH_MAX_CALLS', '32'))
+tool_batch_threads = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('TOOL_BATCH_THREADS', '16')),
+    thread_name_prefix='tool-batch'
+)
+
+
+def run_batch_call(index, call):
+    """执行批量请求中的一个调用，结果带上调用序号和耗时"""
+    start_time = time.time()
+    tool_name = call.get('tool_name') if isinstance(call, dict) else None
+    if not tool_name:
+        result = {'success': False, 'error': '工具名称不能为空'}
+    else:
+        result = execute_tool_call(tool_name, call.get('parameters') or {})
+    return {'index': index, 'tool_name': tool_name, **result, 'elapsed': round(time.time() - start_time, 3)}
+
+
+@app.route('/api/tools/execute/batch', methods=['POST'])
+def execute_tools_batch():
+    """
+    批量执行工具调用（并发执行，总耗时约等于最慢的一个）
+    
+    请求体: {"calls": [{"tool_name": "...", "parameters": {...}}, ...], "stream": false}
+    - stream 为 false: 返回 {"success": true, "results": [...]}，顺序与 calls 一致
+    - stream 为 true: SSE 流，每个调用完成时发送一个 tool_result 事件（带 index），全部完成后发送 done
+    """
+    data = request.json or {}
+    calls = data.get('calls')
+    if not isinstance(calls, list) or not calls:
+        return jsonify({'success': False, 'error': 'calls 必须是非空数组'})
+    if len(calls) > TOOL_BATCH_MAX_CALLS:
+        return jsonify({'success': False, 'error': f'单次最多执行 {TOOL_BATCH_MAX_CALLS} 个工具调用'})
+    
+    start_time = time.time()
+    futures = [tool_batch_threads.submit(run_batch_call, index, call) for index, call in enumerate(calls)]
+    logger.info(f"🔧 批量执行工具调用: {len(calls)} 个")
+    
+    if not data.get('stream'):
+        results = [future.result() for future in futures]
+        logger.info(f"   ✅ 批量执行完成 ({time.time() - start_time:.2f}s)")
+        return jsonify({'success': True, 'results': results})
+    
+    def generate():
+        try:
+            for future in as_completed(futures):
+                yield sse_event({'type': 'tool_result', **future.result()})
+            yield sse_event({'type': 'done', 'count': len(futures), 'elapsed': round(time.time() - start_time, 3)})
+            logger.info(f"   ✅ 批量执行完成 ({time.time() - start_time:.2f}s)")
+        finally:
+            # 客户端断开时取消还没开始的调用
+            for future in futures:
+                future.cancel()
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream')
+
+
+def load_builtin_schemas():
+    """加载内置工具的 Schema 列表"""
     try:
         # 尝试使用模块化的 schemas
         builtin_tools = list_schemas()
@@ -552,11 +728,87 @@ def get_builtin_tools():
             if name in builtin_schemas:
                 builtin_tools.append(builtin_schemas[name])
     
-    return jsonify({'success': True, 'tools': builtin_tools})
+    return builtin_tools
+
+
+# 内置工具在进程生命周期内不变，Schema 列表和 ETag 只计算一次
+_builtin_schemas_cache = None
+
+
+@app.route('/api/tools/builtin', methods=['GET'])
+def get_builtin_tools():
+    """获取内置工具列表"""
+    global _builtin_schemas_cache
+    if _builtin_schemas_cache is None:
+        builtin_tools = load_builtin_schemas()
+        digest = hashlib.sha1(json.dumps(builtin_tools, sort_keys=True).encode('utf-8')).hexdigest()[:20]
+        _builtin_schemas_cache = (builtin_tools, digest)
+    
+    builtin_tools, etag = _builtin_schemas_cache
+    return conditional_json(
+        etag,
+        lambda: {'success': True, 'tools': builtin_tools},
+        cache_control='public, max-age=300'
+    )
 
 
 # ==================== 对话功能 ====================
 
+class StreamStats:
+    """SSE 流统计：进行中 / 正常完成 / 客户端断开取消 / 生成过程中出错"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.active = 0
+        self.completed = 0
+        self.cancelled = 0
+        self.errored = 0
+
+    def start(self):
+        with self._lock:
+            self.active += 1
+
+    def finish(self, outcome):
+        with self._lock:
+            self.active -= 1
+            if outcome == 'cancelled':
+                self.cancelled += 1
+            elif outcome == 'errored':
+                self.errored += 1
+            else:
+                self.completed += 1
+        if outcome == 'cancelled':
+            logger.info("🛑 客户端断开，已停止生成并释放上游连接")
+
+    def snapshot(self):
+        with self._lock:
+            return {'active': self.active, 'completed': self.completed, 'cancelled': self.cancelled, 'errored': self.errored}
+
+
+stream_stats = StreamStats()
+
+
+def track_stream(chunks):
+    """
+    包装 SSE 生成器，记录流的结果
+
+    客户端断开时 WSGI 服务器会关闭响应迭代器（GeneratorExit），
+    这里立即关闭内层生成器，使上游模型连接和未完成的工具调用随之取消
+    """
+    stream_stats.start()
+    outcome = 'cancelled'
+    try:
+        for chunk in chunks:
+            yield chunk
+        outcome = 'completed'
+    except Exception:
+        outcome = 'errored'
+        raise
+    finally:
+        chunks.close()
+        stream_stats.finish(outcome)
+
+
 @app.route('/api/chat', methods=['POST'])
 def chat():
     """处理对话请求（非流式）"""
@@ -571,22 +823,18 @@ def chat():
             return jsonify({'success': False, 'error': '缺少必要参数'})
         
         # 获取模型配置
-        models = load_json_config(MODELS_CONFIG, [])
-        model = None
-        for m in models:
-            if m['id'] == model_id:
-                model = m
-                break
+        model = model_registry.get(model_id)
         
         if not model:
             return jsonify({'success': False, 'error': '模型不存在'})
         
-        # 获取启用的工具
-        tools = load_json_config(TOOLS_CONFIG, [])
-        active_tools = [t for t in tools if t['id'] in enabled_tools and t.get('enabled', True)]
+        # 获取启用的工具（工具较多时只保留相关的）
+        active_tools, selection = select_tools(data, get_active_tools(enabled_tools))
         
         # 调用模型
         result = call_model(model, messages, active_tools, params)
+        if selection:
+            result['tool_selection'] = selection
         
         return jsonify(result)
         
@@ -611,25 +859,24 @@ def chat_stream():
             return Response(error_gen(), mimetype='text/event-stream')
         
         # 获取模型配置
-        models = load_json_config(MODELS_CONFIG, [])
-        model = None
-        for m in models:
-            if m['id'] == model_id:
-                model = m
-                break
+        model = model_registry.get(model_id)
         
         if not model:
             def error_gen():
                 yield f"data: {json.dumps({'type': 'error', 'error': '模型不存在'})}\n\n"
             return Response(error_gen(), mimetype='text/event-stream')
         
-        # 获取启用的工具
-        tools = load_json_config(TOOLS_CONFIG, [])
-        active_tools = [t for t in tools if t['id'] in enabled_tools and t.get('enabled', True)]
+        # 获取启用的工具（工具较多时只保留相关的）
+        active_tools, selection = select_tools(data, get_active_tools(enabled_tools))
+        
+        def events():
+            if selection:
+                yield selection_event(selection)
+            yield from call_model_stream(model, messages, active_tools, params)
         
         # 流式调用模型
         return Response(
-            stream_with_context(call_model_stream(model, messages, active_tools, params)),
+            stream_with_context(track_stream(sse_stream(events()))),
             mimetype='text/event-stream'
         )
         
@@ -640,6 +887,23 @@ def chat_stream():
         return Response(error_gen(), mimetype='text/event-stream')
 
 
+def mcp_options(data):
+    """
+    读取 MCP 协调选项（同步/异步模式共用）
+
+    - early_stop: 收到完整的工具调用后提前结束本轮模型输出
+    - max_parallel_tools: 同一轮工具调用的最大并发数
+    - max_iterations: 最大迭代轮数
+    - token_budget: 本次请求的 token 预算
+    """
+    return {
+        'early_stop': bool(data.get('early_stop', False)),
+        'max_parallel_tools': data.get('max_parallel_tools'),
+        'max_iterations': data.get('max_iterations'),
+        'token_budget': data.get('token_budget')
+    }
+
+
 @app.route('/api/chat/mcp', methods=['POST'])
 def chat_mcp():
     """处理对话请求（MCP协调模式）- 支持自动工具调用循环"""
@@ -657,34 +921,19 @@ def chat_mcp():
             return Response(error_gen(), mimetype='text/event-stream')
         
         # 获取模型配置
-        models = load_json_config(MODELS_CONFIG, [])
-        model = None
-        for m in models:
-            if m['id'] == model_id:
-                model = m
-                break
+        model = model_registry.get(model_id)
         
         if not model:
             def error_gen():
                 yield f"data: {json.dumps({'type': 'error', 'error': '模型不存在'})}\n\n"
             return Response(error_gen(), mimetype='text/event-stream')
         
-        # 获取启用的工具
-        tools = load_json_config(TOOLS_CONFIG, [])
-        active_tools = [t for t in tools if t['id'] in enabled_tools and t.get('enabled', True)]
+        # 获取启用的工具（工具较多时只保留相关的）
+        active_tools, selection = select_tools(data, get_active_tools(enabled_tools))
         
-        # 创建模型调用函数（返回字典而非SSE格式）
+        # 创建模型调用函数（直接传递事件字典，只在输出SSE时序列化一次）
         def model_caller(msgs, tools_list, model_params):
-            """包装模型调用，将SSE格式转换为字典"""
-            for sse_chunk in call_model_stream(model, msgs, tools_list, model_params):
-                # SSE格式: "data: {...}\n\n"
-                if sse_chunk.startswith('data: '):
-                    json_str = sse_chunk[6:].strip()
-                    if json_str and json_str != '[DONE]':
-                        try:
-                            yield json.loads(json_str)
-                        except json.JSONDecodeError:
-                            pass
+            return call_model_stream(model, msgs, tools_list, model_params)
         
         # 创建工具执行函数
         def tool_executor(tool_name, tool_args):
@@ -695,11 +944,20 @@ def chat_mcp():
         
         # 使用MCP协调器处理请求
         def mcp_generator():
-            for event in mcp.coordinate_stream(messages, active_tools, params, auto_parse):
-                yield format_mcp_event_for_sse(event)
+            if selection:
+                yield format_mcp_event_for_sse(selection_event(selection))
+            events = mcp.coordinate_stream(
+                messages, active_tools, params, auto_parse, **mcp_options(data)
+            )
+            try:
+                for event in events:
+                    yield format_mcp_event_for_sse(event)
+            finally:
+                # 客户端断开时关闭协调器（取消模型流和工具调用）
+                events.close()
         
         return Response(
-            stream_with_context(mcp_generator()),
+            stream_with_context(track_stream(mcp_generator())),
             mimetype='text/event-stream'
         )
         
@@ -710,6 +968,42 @@ def chat_mcp():
         return Response(error_gen(), mimetype='text/event-stream')
 
 
+def run_tool(tool_name, tool_arguments, tool_config, timeout=None):
+    """
+    按工具配置执行工具（内置工具 / 外部API / 自定义代码）
+    
+    timeout: 执行超时上限（秒），由隔离舱按截止前的剩余时间给出；外部API（包括重试）和代码工具遵守
+    """
+    start_time = time.time()
+    # 1. 优先使用内置工具
+    if tool_name in BUILTIN_TOOLS:
+        logger.info(f"   使用内置工具: {tool_name}")
+        result = BUILTIN_TOOLS[tool_name](tool_arguments)
+        elapsed = time.time() - start_time
+        logger.info(f"   ✅ 执行成功 ({elapsed:.2f}s)")
+        logger.debug(f"   结果: {json.dumps(result, ensure_ascii=False)[:500]}")
+        return result
+    
+    # 2. 如果工具配置了外部API
+    if 'api_url' in tool_config:
+        return api_executor.call(tool_config, tool_arguments, timeout)
+    
+    # 3. 如果工具配置了Python代码
+    if 'code' in tool_config:
+        logger.info(f"   执行自定义代码")
+        result = run_code_tool(tool_config, tool_arguments, timeout)
+        elapsed = time.time() - start_time
+        if not result['success']:
+            logger.error(f"   ❌ {result['error']}")
+            return result
+        logger.info(f"   ✅ 代码执行成功 ({elapsed:.2f}s)")
+        logger.debug(f"   结果: {json.dumps(result, ensure_ascii=False)[:500]}")
+        return result
+    
+    logger.error(f"   ❌ 工具未配置执行方法")
+    return {'success': False, 'error': '工具未配置执行方法'}
+
+
 def execute_tool_call(tool_name, tool_arguments):
     """执行单个工具调用"""
     logger.info(f"🔧 执行工具调用: {tool_name}")
@@ -718,67 +1012,24 @@ def execute_tool_call(tool_name, tool_arguments):
     start_time = time.time()
     try:
         # 获取工具配置
-        tools = load_json_config(TOOLS_CONFIG, [])
-        tool_config = None
-        for tool in tools:
-            if tool['name'] == tool_name:
-                tool_config = tool
-                break
+        tool_config = tool_registry.get_by_name(tool_name)
         
         if not tool_config:
             logger.error(f"   ❌ 工具未注册: {tool_name}")
             return {'success': False, 'error': f'工具 {tool_name} 未注册'}
+        tool_selector.record_usage(tool_name)
         
-        # 执行工具
-        # 1. 优先使用内置工具
-        if tool_name in BUILTIN_TOOLS:
-            logger.info(f"   使用内置工具: {tool_name}")
-            result = BUILTIN_TOOLS[tool_name](tool_arguments)
-            elapsed = time.time() - start_time
-            logger.info(f"   ✅ 执行成功 ({elapsed:.2f}s)")
-            logger.debug(f"   结果: {json.dumps(result, ensure_ascii=False)[:500]}")
-            return result
-        
-        # 2. 如果工具配置了外部API
-        if 'api_url' in tool_config:
-            api_url = tool_config['api_url']
-            api_method = tool_config.get('api_method', 'POST').upper()
-            api_headers = tool_config.get('api_headers', {})
-            
-            logger.info(f"   调用外部API: {api_method} {api_url}")
-            
-            if api_method == 'POST':
-                response = requests.post(api_url, json=tool_arguments, headers=api_headers, timeout=30)
-            elif api_method == 'GET':
-                response = requests.get(api_url, params=tool_arguments, headers=api_headers, timeout=30)
-            else:
-                logger.error(f"   ❌ 不支持的HTTP方法: {api_method}")
-                return {'success': False, 'error': f'不支持的HTTP方法: {api_method}'}
-            
-            elapsed = time.time() - start_time
-            if response.status_code in [200, 201]:
-                result = {'success': True, 'result': response.json()}
-                logger.info(f"   ✅ API调用成功 ({elapsed:.2f}s)")
-                logger.debug(f"   响应: {response.text[:500]}")
-                return result
-            else:
-                logger.error(f"   ❌ API调用失败: HTTP {response.status_code} ({elapsed:.2f}s)")
-                logger.debug(f"   响应: {response.text[:500]}")
-                return {'success': False, 'error': f'工具API调用失败: HTTP {response.status_code}'}
-        
-        # 3. 如果工具配置了Python代码
-        if 'code' in tool_config:
-            logger.info(f"   执行自定义代码")
-            local_vars = {'params': tool_arguments, 'result': None}
-            exec(tool_config['code'], {"__builtins__": {}}, local_vars)
-            elapsed = time.time() - start_time
-            result = {'success': True, 'result': local_vars.get('result')}
-            logger.info(f"   ✅ 代码执行成功 ({elapsed:.2f}s)")
-            logger.debug(f"   结果: {json.dumps(result, ensure_ascii=False)[:500]}")
-            return result
+        # 在工具的隔离舱内执行（并发上限、排队上限和截止时间按工具分别限制）
+        def execute():
+            return tool_bulkheads.run(
+                tool_name, tool_config,
+                lambda timeout: run_tool(tool_name, tool_arguments, tool_config, timeout)
+            )
         
-        logger.error(f"   ❌ 工具未配置执行方法")
-        return {'success': False, 'error': '工具未配置执行方法'}
+        # 配置了 cache_ttl 的工具复用缓存结果，相同的并发调用只执行一次
+        if tool_config.get('cache_ttl'):
+            return tool_cache.get_or_execute(tool_name, tool_arguments, tool_config['cache_ttl'], execute)
+        return execute()
         
     except Exception as e:
         elapsed = time.time() - start_time
@@ -787,339 +1038,320 @@ def execute_tool_call(tool_name, tool_arguments):
         return {'success': False, 'error': str(e)}
 
 
-def call_model_stream(model, messages, tools, params):
-    """流式调用模型 API，支持工具调用"""
+def build_model_request(model, messages, tools, params, stream=False):
+    """
+    构造模型请求（同步/异步、流式/非流式调用共用）
+
+    端点、认证头、模型名和工具定义由 providers.py 按模型配置编译并缓存，每次调用只组装消息和参数
+
+    Returns:
+        (url, headers, request_data)
+    """
+    compiled = request_compiler.compile(model)
+
+    # 处理消息，如果有系统提示词，添加到开头
+    processed_messages = []
+
+    # 添加系统提示词（如果有）
+    if model.get('system_prompt'):
+        processed_messages.append({
+            'role': 'system',
+            'content': model['system_prompt']
+        })
+
+    # 添加用户消息（多模态格式直接使用），超出模型上下文窗口时裁剪较早的历史
+    processed_messages.extend(fit_context(model, model.get('system_prompt'), messages, tools, params))
+
+    # 构造请求数据
+    request_data = {
+        'messages': processed_messages,
+        'temperature': params.get('temperature', 0.7),
+        'max_tokens': params.get('max_tokens', 2000),
+        'top_p': params.get('top_p', 1.0),
+    }
+    if stream:
+        request_data['stream'] = True  # 启用流式
+
+    # 添加可选参数
+    if 'presence_penalty' in params:
+        request_data['presence_penalty'] = params['presence_penalty']
+    if 'frequency_penalty' in params:
+        request_data['frequency_penalty'] = params['frequency_penalty']
+    if params.get('stop'):
+        # 停止序列（Claude 使用 stop_sequences）
+        request_data[compiled.adapter.stop_field] = params['stop']
+
+    # 添加模型名称（使用注册时设置的实际模型名）
+    request_data['model'] = compiled.model_name
+
+    # 添加工具定义（同一工具集合复用同一个列表，请求体编码时复用已编码的字节）
+    if tools:
+        request_data['tools'] = request_compiler.tools(model, tools)
+
+    return compiled.url, dict(compiled.headers), request_data
+
+
+def log_model_request(model, messages, tools, params, url, request_data):
+    """记录模型请求（隐藏敏感信息，只记录消息摘要）"""
     logger.info(f"🤖 调用模型: {model.get('name', 'Unknown')}")
     logger.debug(f"   模型类型: {model.get('model_type')}")
     logger.debug(f"   URL: {model.get('url')}")
     logger.debug(f"   消息数量: {len(messages)}")
     logger.debug(f"   工具数量: {len(tools) if tools else 0}")
     logger.debug(f"   参数: {params}")
-    
-    try:
-        # 发送初始thinking状态
-        yield f"data: {json.dumps({'type': 'status', 'status': 'thinking'})}\n\n"
-        
-        # 工具调用循环：最多允许5轮工具调用
-        max_iterations = 5
-        current_messages = messages.copy()
-        
-        for iteration in range(max_iterations):
-            tool_calls_data = []
-            accumulated_content = ''
-            has_tool_calls = False
-            
-            headers = {
-                'Content-Type': 'application/json',
-            }
-        
-        # 设置认证
-        if model.get('api_key'):
-            if model['model_type'] == 'openai':
-                headers['Authorization'] = f"Bearer {model['api_key']}"
-            elif model['model_type'] == 'claude':
-                headers['x-api-key'] = model['api_key']
-                headers['anthropic-version'] = '2023-06-01'
-        
-        # 处理消息，如果有系统提示词，添加到开头
-        processed_messages = []
-        
-        # 添加系统提示词（如果有）
-        if model.get('system_prompt'):
-            processed_messages.append({
-                'role': 'system',
-                'content': model['system_prompt']
-            })
-        
-        # 处理用户消息
-        for msg in messages:
-            processed_msg = msg.copy()
-            if isinstance(msg.get('content'), list):
-                # 已经是多模态格式，直接使用
-                processed_messages.append(processed_msg)
+
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+
+    request_data_log = request_data.copy()
+    # 只记录消息摘要，避免日志过大
+    if 'messages' in request_data_log:
+        messages_summary = []
+        for msg in request_data_log['messages']:
+            msg_summary = {'role': msg.get('role')}
+            content = msg.get('content', '')
+            if isinstance(content, str):
+                msg_summary['content'] = content[:100] + ('...' if len(content) > 100 else '')
             else:
-                # 纯文本消息
-                processed_messages.append(processed_msg)
-        
-        # 构造请求数据
-        request_data = {
-            'messages': processed_messages,
-            'temperature': params.get('temperature', 0.7),
-            'max_tokens': params.get('max_tokens', 2000),
-            'top_p': params.get('top_p', 1.0),
-            'stream': True  # 启用流式
-        }
-        
-        # 添加可选参数
-        if 'presence_penalty' in params:
-            request_data['presence_penalty'] = params['presence_penalty']
-        if 'frequency_penalty' in params:
-            request_data['frequency_penalty'] = params['frequency_penalty']
-        
-        # 添加模型名称
-        actual_model = model.get('actual_model_name', '')
-        if model['model_type'] == 'openai':
-            request_data['model'] = actual_model or 'gpt-3.5-turbo'
-        elif model['model_type'] == 'claude':
-            request_data['model'] = actual_model or 'claude-3-sonnet-20240229'
-        else:
-            request_data['model'] = actual_model or 'default'
-        
-        # 添加工具定义
-        if tools:
-            if model['model_type'] in ['openai', 'custom']:
-                request_data['tools'] = [
-                    {
-                        'type': 'function',
-                        'function': {
-                            'name': tool['name'],
-                            'description': tool['description'],
-                            'parameters': tool.get('parameters', {})
-                        }
-                    }
-                    for tool in tools
-                ]
-            elif model['model_type'] == 'claude':
-                request_data['tools'] = [
-                    {
-                        'name': tool['name'],
-                        'description': tool['description'],
-                        'input_schema': tool.get('parameters', {})
-                    }
-                    for tool in tools
-                ]
-        
-        # 确定端点
-        url = model['url']
-        if model['model_type'] == 'openai':
-            if not url.endswith('/chat/completions'):
-                url = f"{url.rstrip('/')}/chat/completions"
-        elif model['model_type'] == 'claude':
-            if not url.endswith('/messages'):
-                url = f"{url.rstrip('/')}/messages"
-        
-        # 记录请求数据（隐藏敏感信息）
-        request_data_log = request_data.copy()
-        # 只记录消息摘要，避免日志过大
-        if 'messages' in request_data_log:
-            messages_summary = []
-            for msg in request_data_log['messages']:
-                msg_summary = {'role': msg.get('role')}
-                content = msg.get('content', '')
-                if isinstance(content, str):
-                    msg_summary['content'] = content[:100] + ('...' if len(content) > 100 else '')
+                msg_summary['content'] = '[multimodal]'
+            messages_summary.append(msg_summary)
+        request_data_log['messages'] = messages_summary
+
+    logger.debug(f"   请求数据: {json.dumps(request_data_log, ensure_ascii=False, indent=2)}")
+    logger.debug(f"   发送请求到: {url}")
+
+
+class ModelStreamParser:
+    """
+    上游流式响应解析器（同步/异步流式调用共用）
+
+    逐行输入上游 SSE 数据，输出前端约定格式的事件字典；
+    原生函数调用（OpenAI delta.tool_calls / Claude tool_use）的名称和参数片段在流中累积，
+    结束时以一个 tool_calls 事件输出，由 MCP 协调器直接执行
+    """
+
+    def __init__(self, model):
+        self.model_type = model['model_type']
+        self.first_content = True
+        self.accumulated = ''  # 累积响应内容用于日志
+        self.finished = False  # 收到 [DONE] / message_stop
+        self.tool_calls = {}  # 流式索引 -> {'id', 'name', 'arguments'(JSON 片段)}
+
+    def feed(self, line):
+        """解析一行上游数据，返回事件列表"""
+        events = []
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        if not line or not line.startswith('data: '):
+            return events
+
+        data_str = line[6:]
+        if data_str == '[DONE]':
+            self.finished = True
+            return events
+
+        try:
+            data = json.loads(data_str)
+        except json.JSONDecodeError:
+            return events
+
+        content = ''
+        if self.model_type in ['openai', 'custom']:
+            choices = data.get('choices') or [{}]
+            delta = choices[0].get('delta') or {}
+            content = delta.get('content') or ''
+
+            # 累积工具调用片段（按 index 合并 id、名称和参数）
+            for fragment in delta.get('tool_calls') or []:
+                function = fragment.get('function') or {}
+                call = self._tool_call(fragment.get('index', 0), events)
+                if fragment.get('id'):
+                    call['id'] = fragment['id']
+                if function.get('name'):
+                    call['name'] += function['name']
+                if function.get('arguments'):
+                    call['arguments'] += function['arguments']
+        elif self.model_type == 'claude':
+            event_type = data.get('type')
+            if event_type == 'content_block_start':
+                block = data.get('content_block') or {}
+                if block.get('type') == 'tool_use':
+                    call = self._tool_call(data.get('index', 0), events)
+                    call['id'] = block.get('id', '')
+                    call['name'] = block.get('name', '')
+            elif event_type == 'content_block_delta':
+                delta = data.get('delta') or {}
+                if delta.get('type') == 'input_json_delta':
+                    self._tool_call(data.get('index', 0), events)['arguments'] += delta.get('partial_json', '')
                 else:
-                    msg_summary['content'] = '[multimodal]'
-                messages_summary.append(msg_summary)
-            request_data_log['messages'] = messages_summary
-        
-        logger.debug(f"   请求数据: {json.dumps(request_data_log, ensure_ascii=False, indent=2)}")
-        
+                    content = delta.get('text', '')
+            elif event_type == 'message_stop':
+                self.finished = True
+
+        if content:
+            self.accumulated += content
+
+            # 第一次收到内容时，切换到answering状态
+            if self.first_content:
+                events.append({'type': 'status', 'status': 'answering'})
+                self.first_content = False
+
+            # 直接发送内容，前端会解析 <think> 标签
+            events.append({'type': 'content', 'content': content})
+
+        return events
+
+    def _tool_call(self, index, events):
+        """获取（必要时创建）指定索引的工具调用，第一次出现时发送 function_calling 状态"""
+        if not self.tool_calls:
+            events.append({'type': 'status', 'status': 'function_calling'})
+        return self.tool_calls.setdefault(index, {'id': '', 'name': '', 'arguments': ''})
+
+    @staticmethod
+    def _parse_arguments(name, raw):
+        if not raw.strip():
+            return {}
+        try:
+            arguments = json.loads(raw)
+        except json.JSONDecodeError:
+            logger.warning(f"   ⚠️ 工具 {name} 的参数不是有效的JSON: {raw[:200]}")
+            return {}
+        return arguments if isinstance(arguments, dict) else {'value': arguments}
+
+    def finish(self):
+        """上游流结束：记录完整响应，返回工具调用事件（如有）和完成事件"""
+        events = []
+        if self.accumulated:
+            response_preview = self.accumulated[:500] + ('...' if len(self.accumulated) > 500 else '')
+            logger.info(f"   ✅ 模型响应完成 (长度: {len(self.accumulated)} 字符)")
+            logger.debug(f"   响应内容: {response_preview}")
+        elif not self.tool_calls:
+            logger.warning(f"   ⚠️ 模型响应为空")
+
+        if self.tool_calls:
+            calls = [
+                {
+                    'id': call['id'],
+                    'name': call['name'],
+                    'arguments': self._parse_arguments(call['name'], call['arguments'])
+                }
+                for _, call in sorted(self.tool_calls.items())
+                if call['name']
+            ]
+            logger.info(f"   🔧 模型请求调用 {len(calls)} 个工具: {[call['name'] for call in calls]}")
+            events.append({
+                'type': 'tool_calls',
+                'format': 'claude' if self.model_type == 'claude' else 'openai',
+                'calls': calls
+            })
+
+        events.append({'type': 'done'})
+        return events
+
+
+def model_error_events(error_msg):
+    """模型调用失败时发送给前端的事件序列"""
+    return [
+        {'type': 'status', 'status': 'error'},
+        {'type': 'error', 'error': error_msg},
+        {'type': 'done'}
+    ]
+
+
+def upstream_error_message(status_code, body_text):
+    """根据上游错误响应生成错误信息"""
+    logger.error(f"   ❌ API调用失败: HTTP {status_code}")
+    error_msg = f'API 调用失败: HTTP {status_code}'
+    try:
+        error_detail = json.loads(body_text)
+        if 'error' in error_detail:
+            error_msg += f" - {error_detail['error'].get('message', '')}"
+            logger.error(f"   错误详情: {error_detail}")
+    except Exception:
+        error_text = body_text[:200]
+        error_msg += f" - {error_text}"
+        logger.error(f"   错误响应: {error_text}")
+    return error_msg
+
+
+def sse_event(event):
+    """将事件格式化为SSE格式"""
+    return f"data: {json.dumps(event)}\n\n"
+
+
+def sse_stream(events):
+    """在传输边界把事件字典序列化为 SSE（每个事件只编码一次）"""
+    try:
+        for event in events:
+            yield sse_event(event)
+    finally:
+        events.close()
+
+
+def call_model_stream(model, messages, tools, params):
+    """
+    流式调用模型 API，支持工具调用
+
+    产出事件字典（status / content / tool_calls / error / done），由传输层负责序列化
+    """
+    try:
+        # 发送初始thinking状态
+        yield {'type': 'status', 'status': 'thinking'}
+
+        url, headers, request_data = build_model_request(model, messages, tools, params, stream=True)
+        log_model_request(model, messages, tools, params, url, request_data)
+
         # 发送流式请求
-        logger.debug(f"   发送请求到: {url}")
-        response = requests.post(url, json=request_data, headers=headers, stream=True, timeout=60)
+        # 历史消息使用缓存的编码，MCP 每轮只编码新追加的消息
+        response = upstream_pool.post(
+            url, data=encode_request_body(request_data), headers=headers, stream=True, timeout=model_timeouts(model)
+        )
         logger.debug(f"   响应状态: {response.status_code}")
-        
-        if response.status_code in [200, 201]:
-            first_content = True
-            accumulated_response = ''  # 累积响应内容用于日志
-            # 处理流式响应
-            for line in response.iter_lines():
-                if line:
-                    line = line.decode('utf-8')
-                    if line.startswith('data: '):
-                        data_str = line[6:]
-                        if data_str == '[DONE]':
-                            break
-                        try:
-                            data = json.loads(data_str)
-                            if model['model_type'] in ['openai', 'custom']:
-                                delta = data.get('choices', [{}])[0].get('delta', {})
-                                content = delta.get('content', '')
-                                
-                                # 检查是否有工具调用
-                                tool_calls = delta.get('tool_calls')
-                                if tool_calls:
-                                    yield f"data: {json.dumps({'type': 'status', 'status': 'function_calling'})}\n\n"
-                                
-                                if content:
-                                    # 累积响应内容
-                                    accumulated_response += content
-                                    
-                                    # 第一次收到内容时，切换到answering状态
-                                    if first_content:
-                                        yield f"data: {json.dumps({'type': 'status', 'status': 'answering'})}\n\n"
-                                        first_content = False
-                                    
-                                    # 直接发送内容，前端会解析 <think> 标签
-                                    yield f"data: {json.dumps({'type': 'content', 'content': content})}\n\n"
-                                    
-                            elif model['model_type'] == 'claude':
-                                if data.get('type') == 'content_block_delta':
-                                    content = data.get('delta', {}).get('text', '')
-                                    if content:
-                                        # 累积响应内容
-                                        accumulated_response += content
-                                        
-                                        if first_content:
-                                            yield f"data: {json.dumps({'type': 'status', 'status': 'answering'})}\n\n"
-                                            first_content = False
-                                        yield f"data: {json.dumps({'type': 'content', 'content': content})}\n\n"
-                        except json.JSONDecodeError:
-                            pass
-            
-            # 记录完整的模型响应
-            if accumulated_response:
-                response_preview = accumulated_response[:500] + ('...' if len(accumulated_response) > 500 else '')
-                logger.info(f"   ✅ 模型响应完成 (长度: {len(accumulated_response)} 字符)")
-                logger.debug(f"   响应内容: {response_preview}")
+
+        try:
+            if response.status_code in [200, 201]:
+                parser = ModelStreamParser(model)
+                # 处理流式响应
+                for line in response.iter_lines():
+                    yield from parser.feed(line)
+                    if parser.finished:
+                        break
+
+                # 记录完整的模型响应并发送完成信号
+                yield from parser.finish()
             else:
-                logger.warning(f"   ⚠️ 模型响应为空")
-            
-            # 发送完成信号
-            yield f"data: {json.dumps({'type': 'done'})}\n\n"
-        else:
-            logger.error(f"   ❌ API调用失败: HTTP {response.status_code}")
-            error_msg = f'API 调用失败: HTTP {response.status_code}'
-            try:
-                error_detail = response.json()
-                if 'error' in error_detail:
-                    error_msg += f" - {error_detail['error'].get('message', '')}"
-                    logger.error(f"   错误详情: {error_detail}")
-            except:
-                error_text = response.text[:200]
-                error_msg += f" - {error_text}"
-                logger.error(f"   错误响应: {error_text}")
-            
-            yield f"data: {json.dumps({'type': 'status', 'status': 'error'})}\n\n"
-            yield f"data: {json.dumps({'type': 'error', 'error': error_msg})}\n\n"
-            yield f"data: {json.dumps({'type': 'done'})}\n\n"
-            
+                error_msg = upstream_error_message(response.status_code, response.text)
+                yield from model_error_events(error_msg)
+        finally:
+            # 释放连接回连接池
+            response.close()
+
     except requests.exceptions.Timeout:
         logger.error(f"   ❌ 请求超时")
-        yield f"data: {json.dumps({'type': 'status', 'status': 'error'})}\n\n"
-        yield f"data: {json.dumps({'type': 'error', 'error': '请求超时，请稍后重试'})}\n\n"
-        yield f"data: {json.dumps({'type': 'done'})}\n\n"
+        yield from model_error_events('请求超时，请稍后重试')
     except requests.exceptions.ConnectionError as e:
         logger.error(f"   ❌ 连接错误: {e}")
-        yield f"data: {json.dumps({'type': 'status', 'status': 'error'})}\n\n"
-        yield f"data: {json.dumps({'type': 'error', 'error': '无法连接到模型服务器'})}\n\n"
-        yield f"data: {json.dumps({'type': 'done'})}\n\n"
+        yield from model_error_events('无法连接到模型服务器')
     except Exception as e:
         logger.error(f"   ❌ 未知错误: {e}")
         logger.error(traceback.format_exc())
-        yield f"data: {json.dumps({'type': 'status', 'status': 'error'})}\n\n"
-        yield f"data: {json.dumps({'type': 'error', 'error': str(e)})}\n\n"
-        yield f"data: {json.dumps({'type': 'done'})}\n\n"
+        yield from model_error_events(str(e))
 
 
 def call_model(model, messages, tools, params):
     """调用模型 API"""
     try:
-        headers = {
-            'Content-Type': 'application/json',
-        }
-        
-        # 设置认证
-        if model.get('api_key'):
-            if model['model_type'] == 'openai':
-                headers['Authorization'] = f"Bearer {model['api_key']}"
-            elif model['model_type'] == 'claude':
-                headers['x-api-key'] = model['api_key']
-                headers['anthropic-version'] = '2023-06-01'
-        
-        # 处理消息，如果有系统提示词，添加到开头
-        processed_messages = []
-        
-        # 添加系统提示词（如果有）
-        if model.get('system_prompt'):
-            processed_messages.append({
-                'role': 'system',
-                'content': model['system_prompt']
-            })
-        
-        # 添加用户消息
-        processed_messages.extend(messages)
-        
-        # 构造请求数据
-        request_data = {
-            'messages': processed_messages,
-            'temperature': params.get('temperature', 0.7),
-            'max_tokens': params.get('max_tokens', 2000),
-            'top_p': params.get('top_p', 1.0),
-        }
-        
-        # 添加可选参数
-        if 'presence_penalty' in params:
-            request_data['presence_penalty'] = params['presence_penalty']
-        if 'frequency_penalty' in params:
-            request_data['frequency_penalty'] = params['frequency_penalty']
-        
-        # 添加模型名称（使用注册时设置的实际模型名）
-        actual_model = model.get('actual_model_name', '')
-        if model['model_type'] == 'openai':
-            request_data['model'] = actual_model or 'gpt-3.5-turbo'
-        elif model['model_type'] == 'claude':
-            request_data['model'] = actual_model or 'claude-3-sonnet-20240229'
-        else:
-            request_data['model'] = actual_model or 'default'
-        
-        # 添加工具定义
-        if tools:
-            if model['model_type'] in ['openai', 'custom']:
-                request_data['tools'] = [
-                    {
-                        'type': 'function',
-                        'function': {
-                            'name': tool['name'],
-                            'description': tool['description'],
-                            'parameters': tool.get('parameters', {})
-                        }
-                    }
-                    for tool in tools
-                ]
-            elif model['model_type'] == 'claude':
-                request_data['tools'] = [
-                    {
-                        'name': tool['name'],
-                        'description': tool['description'],
-                        'input_schema': tool.get('parameters', {})
-                    }
-                    for tool in tools
-                ]
-        
-        # 确定端点
-        url = model['url']
-        if model['model_type'] == 'openai':
-            if not url.endswith('/chat/completions'):
-                url = f"{url.rstrip('/')}/chat/completions"
-        elif model['model_type'] == 'claude':
-            if not url.endswith('/messages'):
-                url = f"{url.rstrip('/')}/messages"
-        
+        url, headers, request_data = build_model_request(model, messages, tools, params)
+
         # 发送请求
-        response = requests.post(url, json=request_data, headers=headers, timeout=60)
-        
+        response = upstream_pool.post(url, data=encode_request_body(request_data), headers=headers, timeout=model_timeouts(model))
+
         if response.status_code in [200, 201]:
             result = response.json()
-            
+
             # 提取回复内容
-            if model['model_type'] == 'openai' or model['model_type'] == 'custom':
-                content = result.get('choices', [{}])[0].get('message', {}).get('content', '')
-                tool_calls = result.get('choices', [{}])[0].get('message', {}).get('tool_calls', [])
-            elif model['model_type'] == 'claude':
-                content_blocks = result.get('content', [])
-                content = ''
-                tool_calls = []
-                for block in content_blocks:
-                    if block.get('type') == 'text':
-                        content += block.get('text', '')
-                    elif block.get('type') == 'tool_use':
-                        tool_calls.append(block)
-            else:
-                content = str(result)
-                tool_calls = []
-            
+            content, tool_calls = request_compiler.compile(model).adapter.parse_response(result)
+
             return {
                 'success': True,
                 'content': content,
@@ -1131,7 +1363,7 @@ def call_model(model, messages, tools, params):
                 'success': False,
                 'error': f"API 调用失败: HTTP {response.status_code}\n{response.text}"
             }
-            
+
     except requests.exceptions.Timeout:
         return {'success': False, 'error': '请求超时'}
     except Exception as e:
@@ -1139,6 +1371,28 @@ def call_model(model, messages, tools, params):
         return {'success': False, 'error': str(e)}
 
 
+# ==================== 运行状态 ====================
+
+@app.route('/api/stats', methods=['GET'])
+def get_stats():
+    """运行状态（上游连接池等），用于监控"""
+    return jsonify({
+        'success': True,
+        'upstream_pool': upstream_pool.stats(),
+        'async_upstream': async_upstream.stats(),
+        'streams': stream_stats.snapshot(),
+        'tool_cache': tool_cache.stats(),
+        'tool_results': result_store.stats(),
+        'message_cache': message_cache.stats(),
+        'request_compiler': request_compiler.stats(),
+        'tool_selector': tool_selector.stats(),
+        'code_tools': code_cache.stats(),
+        'sandbox': sandbox_pool.stats(),
+        'api_tools': api_executor.stats(),
+        'bulkheads': tool_bulkheads.stats()
+    })
+
+
 # ==================== 图片上传 ====================
 
 @app.route('/api/uploads/clear', methods=['POST'])
@@ -1229,9 +1483,13 @@ def serve_static(path):
 
 
 if __name__ == '__main__':
+    # 开发服务器；生产环境请使用 python serve.py
+    debug = os.environ.get('FLASK_DEBUG', '0').lower() in ('1', 'true', 'yes', 'on')
     print("=" * 60)
     print("行业智能通用运维模型2.0 服务启动中...")
     print("访问地址: http://localhost:5000")
+    if debug:
+        print("⚠️ 调试模式已开启，请勿用于生产环境")
     print("=" * 60)
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    app.run(host='0.0.0.0', port=5000, debug=debug, threaded=True)
 
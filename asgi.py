@@ -0,0 +1,286 @@
+"""
+异步流式服务（ASGI 模式）
+/api/chat/stream 和 /api/chat/mcp 以异步生成器运行在事件循环上，等待上游 token 时不占用线程，
+单个进程可以同时保持大量 SSE 连接；其余 REST 接口仍交给 Flask 应用处理，接口和事件格式与同步模式一致
+
+启动方式：
+    pip install httpx uvicorn a2wsgi
+    uvicorn asgi:app --host 0.0.0.0 --port 5000
+"""
+
+import json
+import asyncio
+import logging
+import traceback
+
+from app import (
+    app as flask_app, model_registry, tool_registry, get_active_tools, select_tools, selection_event, execute_tool_call,
+    BUILTIN_TOOLS, tool_selector,
+    build_model_request, log_model_request, ModelStreamParser, mcp_options,
+    model_error_events, upstream_error_message, sse_event, stream_stats
+)
+from http_pool import async_upstream, model_timeouts
+from request_body import encode_request_body
+from api_tools import api_executor
+from bulkhead import tool_bulkheads
+from mcp import MCPCoordinator, format_mcp_event_for_sse
+
+# 可选依赖：httpx（异步上游客户端）
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+# 其余接口通过 WSGI 适配器交给 Flask（a2wsgi 或 asgiref 任选其一）
+try:
+    from a2wsgi import WSGIMiddleware
+    flask_asgi = WSGIMiddleware(flask_app)
+except ImportError:
+    try:
+        from asgiref.wsgi import WsgiToAsgi
+        flask_asgi = WsgiToAsgi(flask_app)
+    except ImportError:
+        flask_asgi = None
+
+logger = logging.getLogger(__name__)
+
+SSE_HEADERS = [
+    (b'content-type', b'text/event-stream; charset=utf-8'),
+    (b'cache-control', b'no-cache'),
+    (b'x-accel-buffering', b'no'),
+    (b'access-control-allow-origin', b'*'),
+]
+
+
+async def acall_model_stream(model, messages, tools, params):
+    """流式调用模型 API（异步版本，产出与 call_model_stream 相同的事件字典）"""
+    try:
+        # 发送初始thinking状态
+        yield {'type': 'status', 'status': 'thinking'}
+
+        if httpx is None:
+            raise RuntimeError('异步服务模式需要 httpx（pip install httpx）')
+
+        url, headers, request_data = build_model_request(model, messages, tools, params, stream=True)
+        log_model_request(model, messages, tools, params, url, request_data)
+
+        async with async_upstream.stream(
+            'POST', url, content=encode_request_body(request_data), headers=headers, timeout=model_timeouts(model)
+        ) as response:
+            logger.debug(f"   响应状态: {response.status_code}")
+            if response.status_code in [200, 201]:
+                parser = ModelStreamParser(model)
+                async for line in response.aiter_lines():
+                    for event in parser.feed(line):
+                        yield event
+                    if parser.finished:
+                        break
+
+                for event in parser.finish():
+                    yield event
+            else:
+                body = (await response.aread()).decode('utf-8', errors='replace')
+                for event in model_error_events(upstream_error_message(response.status_code, body)):
+                    yield event
+
+    except Exception as e:
+        if httpx is not None and isinstance(e, httpx.TimeoutException):
+            logger.error(f"   ❌ 请求超时")
+            error_msg = '请求超时，请稍后重试'
+        elif httpx is not None and isinstance(e, httpx.TransportError):
+            logger.error(f"   ❌ 连接错误: {e}")
+            error_msg = '无法连接到模型服务器'
+        else:
+            logger.error(f"   ❌ 未知错误: {e}")
+            logger.error(traceback.format_exc())
+            error_msg = str(e)
+        for event in model_error_events(error_msg):
+            yield event
+
+
+def _resolve_chat_request(data):
+    """校验对话请求，返回 (model, active_tools, selection, error)"""
+    if not isinstance(data, dict):
+        return None, None, None, '请求体不是有效的JSON'
+
+    model_id = data.get('model_id')
+    messages = data.get('messages', [])
+    if not model_id or not messages:
+        return None, None, None, '缺少必要参数'
+
+    # 获取模型配置
+    model = model_registry.get(model_id)
+    if not model:
+        return None, None, None, '模型不存在'
+
+    # 获取启用的工具（工具较多时只保留相关的）
+    active_tools, selection = select_tools(data, get_active_tools(data.get('enabled_tools', [])))
+    return model, active_tools, selection, None
+
+
+async def chat_stream(data):
+    """处理对话请求（流式）- 传统模式"""
+    model, active_tools, selection, error = _resolve_chat_request(data)
+    if error:
+        yield sse_event({'type': 'error', 'error': error})
+        return
+    if selection:
+        yield sse_event(selection_event(selection))
+
+    async for event in acall_model_stream(model, data['messages'], active_tools, data.get('params', {})):
+        yield sse_event(event)
+
+
+async def aexecute_tool_call(tool_name, tool_args):
+    """
+    执行工具调用（异步版本）
+
+    api_url 工具在隔离舱内直接在事件循环上调用（共享连接池，不占用线程）；其余工具以及配置了 cache_ttl 的工具
+    仍由同步的 execute_tool_call 在线程池中执行
+    """
+    tool_config = tool_registry.get_by_name(tool_name)
+    if (tool_config and 'api_url' in tool_config and tool_name not in BUILTIN_TOOLS
+            and not tool_config.get('cache_ttl')):
+        logger.info(f"🔧 执行工具调用: {tool_name}")
+        tool_selector.record_usage(tool_name)
+        return await tool_bulkheads.arun(
+            tool_name, tool_config,
+            lambda timeout: api_executor.acall(tool_config, tool_args, timeout)
+        )
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, execute_tool_call, tool_name, tool_args)
+
+
+async def chat_mcp(data):
+    """处理对话请求（MCP协调模式）- 支持自动工具调用循环"""
+    model, active_tools, selection, error = _resolve_chat_request(data)
+    if error:
+        yield sse_event({'type': 'error', 'error': error})
+        return
+    if selection:
+        yield sse_event(selection_event(selection))
+
+    def model_caller(msgs, tools_list, model_params):
+        return acall_model_stream(model, msgs, tools_list, model_params)
+
+    mcp = MCPCoordinator(model_caller, aexecute_tool_call)
+    async for event in mcp.acoordinate_stream(
+        data['messages'], active_tools, data.get('params', {}),
+        data.get('auto_parse', False), **mcp_options(data)
+    ):
+        yield format_mcp_event_for_sse(event)
+
+
+STREAM_ROUTES = {
+    '/api/chat/stream': chat_stream,
+    '/api/chat/mcp': chat_mcp,
+}
+
+
+async def _read_json(receive):
+    """读取完整请求体并解析为 JSON，解析失败返回 None"""
+    body = b''
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            break
+    try:
+        return json.loads(body or b'null')
+    except ValueError:
+        return None
+
+
+async def _wait_disconnect(receive):
+    """等待客户端断开（请求体读完后，receive 只会再返回 http.disconnect）"""
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+
+
+async def _send_events(events, send):
+    """逐块发送 SSE 事件"""
+    try:
+        async for chunk in events:
+            await send({'type': 'http.response.body', 'body': chunk.encode('utf-8'), 'more_body': True})
+    except Exception as e:
+        logger.error(f"❌ [ASGI] 流式响应异常: {e}")
+        logger.error(traceback.format_exc())
+        error = sse_event({'type': 'error', 'error': str(e)})
+        await send({'type': 'http.response.body', 'body': error.encode('utf-8'), 'more_body': True})
+    await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+
+
+async def _stream_response(handler, scope, receive, send):
+    """
+    以 SSE 流返回处理函数产出的事件
+
+    同时监听客户端断开：断开后立即取消生成任务，关闭上游模型连接并取消进行中的工具调用
+    """
+    logger.info(f"📥 [ASGI] {scope['method']} {scope['path']}")
+    data = await _read_json(receive)
+
+    await send({'type': 'http.response.start', 'status': 200, 'headers': SSE_HEADERS})
+    events = handler(data)
+    stream_stats.start()
+    stream_task = asyncio.ensure_future(_send_events(events, send))
+    disconnect_task = asyncio.ensure_future(_wait_disconnect(receive))
+    outcome = 'cancelled'
+    try:
+        done, _ = await asyncio.wait({stream_task, disconnect_task}, return_when=asyncio.FIRST_COMPLETED)
+        if stream_task in done:
+            outcome = 'errored'
+            stream_task.result()
+            outcome = 'completed'
+    finally:
+        for task in (stream_task, disconnect_task):
+            if not task.done():
+                task.cancel()
+        await asyncio.gather(stream_task, disconnect_task, return_exceptions=True)
+        await events.aclose()
+        stream_stats.finish(outcome)
+
+
+async def _send_json(send, status, payload):
+    body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            if httpx is None:
+                logger.warning("⚠️ 未安装 httpx，异步流式接口不可用（pip install httpx）")
+            if flask_asgi is None:
+                logger.warning("⚠️ 未安装 a2wsgi/asgiref，只能提供流式对话接口（pip install a2wsgi）")
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await async_upstream.aclose()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    """ASGI 入口"""
+    if scope['type'] == 'lifespan':
+        await _lifespan(receive, send)
+        return
+
+    handler = STREAM_ROUTES.get(scope.get('path'))
+    if scope['type'] == 'http' and scope['method'] == 'POST' and handler:
+        await _stream_response(handler, scope, receive, send)
+        return
+
+    if flask_asgi is None:
+        await _send_json(send, 500, {'success': False, 'error': '未安装 a2wsgi/asgiref，无法处理该接口'})
+        return
+    await flask_asgi(scope, receive, send)
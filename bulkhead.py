@@ -0,0 +1,245 @@
+"""
+工具隔离舱（bulkhead）
+每个工具单独限制同时执行的调用数和排队数：并发已满时在有限的队列中等待，队列也满时立即拒绝，
+等待和执行共用工具的截止时间。某个下游 API 变慢时只影响它自己的工具，不会占满整个服务的工作线程
+"""
+
+import os
+import time
+import asyncio
+import threading
+import logging
+from collections import deque
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+
+class _Waiter:
+    """
+    排队中的调用
+
+    名额由 release() 直接移交给队首的等待者（active 不变）：线程等待者置 granted 后被唤醒，
+    异步等待者的 future 在它所属的事件循环上被设置结果
+    """
+
+    __slots__ = ('granted', 'loop', 'future')
+
+    def __init__(self, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.granted = False
+        self.loop = loop
+        self.future = loop.create_future() if loop is not None else None
+
+
+class _Compartment:
+    """一个工具的隔离舱状态"""
+
+    def __init__(self, lock: threading.Lock):
+        self.condition = threading.Condition(lock)
+        self.concurrency = 1
+        self.active = 0
+        self.waiters: 'deque[_Waiter]' = deque()  # 线程和异步调用共用的 FIFO 队列
+        self.peak = 0
+        self.calls = 0
+        self.saturated = 0  # 需要排队的次数
+        self.rejected = 0   # 队列已满被拒绝的次数
+        self.timeouts = 0   # 排队超过截止时间的次数
+
+
+class ToolBulkheads:
+    """
+    按工具名称划分的隔离舱
+
+    - 工具配置: max_concurrency（同时执行的调用数）、max_queue（排队上限）、timeout（截止时间，秒，包括排队时间）；
+      未配置时使用构造参数中的默认值，配置修改后下一次调用即生效
+    - 取得执行名额后把截止前的剩余时间作为执行超时交给执行函数（外部 API / 代码工具以它为上限，包括重试）；
+      工具没有配置 timeout 时截止时间为默认值
+    - 线程和协程在同一个 FIFO 队列中排队，协程在事件循环上等待
+    - 与 MCP 的 max_parallel 不同，这里的限制在所有请求之间共享
+    """
+
+    def __init__(self, max_concurrency: int = 16, max_queue: int = 32, timeout: float = 30):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._compartments: Dict[str, _Compartment] = {}
+
+    def limits(self, tool_config: Dict) -> Tuple[int, int, float]:
+        """工具的 (并发上限, 排队上限, 截止时间)"""
+        return (
+            max(1, int(tool_config.get('max_concurrency') or self.max_concurrency)),
+            max(0, int(tool_config.get('max_queue', self.max_queue))),
+            float(tool_config.get('timeout') or self.timeout)
+        )
+
+    def _enter(self, tool_name: str, concurrency: int, max_queue: int,
+               loop: Optional[asyncio.AbstractEventLoop] = None) -> Tuple[Optional[Dict], Optional[_Waiter]]:
+        """
+        登记一次调用（调用方持有锁）：有空闲名额时直接占用，否则进入队列，队列已满时拒绝
+
+        Returns:
+            (错误结果, 等待者) - 两者都为 None 时已取得名额
+        """
+        compartment = self._compartments.get(tool_name)
+        if compartment is None:
+            compartment = self._compartments[tool_name] = _Compartment(self._lock)
+        compartment.concurrency = concurrency
+        compartment.calls += 1
+        if compartment.active < concurrency and not compartment.waiters:
+            compartment.active += 1
+            compartment.peak = max(compartment.peak, compartment.active)
+            return None, None
+        if len(compartment.waiters) >= max_queue:
+            compartment.rejected += 1
+            logger.warning(f"   🚧 工具 {tool_name} 繁忙，拒绝调用（执行中 {compartment.active}，排队 {len(compartment.waiters)}）")
+            return {'success': False, 'error': f'工具 {tool_name} 繁忙（并发上限 {concurrency}，排队已满），请稍后重试'}, None
+        compartment.saturated += 1
+        waiter = _Waiter(loop)
+        compartment.waiters.append(waiter)
+        self._dispatch(tool_name, compartment)  # 并发上限调大后排队的调用可以直接执行
+        return None, waiter
+
+    def _dispatch(self, tool_name: str, compartment: _Compartment):
+        """把空闲名额依次移交给队首的等待者（调用方持有锁）"""
+        while compartment.waiters and compartment.active < compartment.concurrency:
+            waiter = compartment.waiters.popleft()
+            compartment.active += 1
+            compartment.peak = max(compartment.peak, compartment.active)
+            if waiter.loop is None:
+                waiter.granted = True
+                compartment.condition.notify_all()
+                continue
+            try:
+                waiter.loop.call_soon_threadsafe(self._wake, tool_name, waiter)
+            except RuntimeError:
+                compartment.active -= 1  # 等待者的事件循环已关闭
+
+    def _wake(self, tool_name: str, waiter: _Waiter):
+        """在等待者的事件循环上交付名额；等待者已被取消时立即归还"""
+        if waiter.future.done():
+            self.release(tool_name)
+        else:
+            waiter.future.set_result(None)
+
+    def _timed_out(self, tool_name: str, compartment: _Compartment, timeout: float) -> Dict:
+        """记录排队超时（调用方持有锁）"""
+        compartment.timeouts += 1
+        logger.warning(f"   ⏱️ 工具 {tool_name} 排队超时（{timeout:g}s）")
+        return {'success': False, 'error': f'工具 {tool_name} 排队超时（{timeout:g}s）'}
+
+    def acquire(self, tool_name: str, tool_config: Dict) -> Tuple[Optional[Dict], float]:
+        """
+        取得执行名额（必要时排队等待）
+
+        Returns:
+            (错误结果, 截止时间) - 取得名额时错误结果为 None，之后必须调用 release()
+        """
+        concurrency, max_queue, timeout = self.limits(tool_config)
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            error, waiter = self._enter(tool_name, concurrency, max_queue)
+            if waiter is None:
+                return error, deadline
+            compartment = self._compartments[tool_name]
+            while not waiter.granted:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    compartment.waiters.remove(waiter)
+                    return self._timed_out(tool_name, compartment, timeout), deadline
+                compartment.condition.wait(remaining)
+        return None, deadline
+
+    async def aacquire(self, tool_name: str, tool_config: Dict) -> Tuple[Optional[Dict], float]:
+        """
+        异步版本：在事件循环上等待，不占用线程
+
+        排队时被取消不会占用名额：还在队列中时直接移出；名额已移交时由本方法或 _wake 归还
+        """
+        concurrency, max_queue, timeout = self.limits(tool_config)
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            error, waiter = self._enter(tool_name, concurrency, max_queue, asyncio.get_running_loop())
+        if waiter is None:
+            return error, deadline
+        try:
+            await asyncio.wait_for(waiter.future, deadline - time.monotonic())
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            with self._lock:
+                compartment = self._compartments[tool_name]
+                queued = waiter in compartment.waiters
+                if queued:
+                    compartment.waiters.remove(waiter)
+                error = self._timed_out(tool_name, compartment, timeout) if isinstance(e, asyncio.TimeoutError) else None
+            if not queued and waiter.future.done() and not waiter.future.cancelled():
+                self.release(tool_name)
+            if error is None:
+                raise
+            return error, deadline
+        return None, deadline
+
+    def release(self, tool_name: str):
+        """归还执行名额，移交给排队的调用"""
+        with self._lock:
+            compartment = self._compartments[tool_name]
+            compartment.active -= 1
+            self._dispatch(tool_name, compartment)
+
+    @staticmethod
+    def _execution_timeout(deadline: float) -> float:
+        """执行超时为截止前的剩余时间"""
+        return max(deadline - time.monotonic(), 0.001)
+
+    def run(self, tool_name: str, tool_config: Dict, execute: Callable[[float], Dict]) -> Dict:
+        """在隔离舱内执行 execute(执行超时)"""
+        error, deadline = self.acquire(tool_name, tool_config)
+        if error:
+            return error
+        try:
+            return execute(self._execution_timeout(deadline))
+        finally:
+            self.release(tool_name)
+
+    async def arun(self, tool_name: str, tool_config: Dict, execute: Callable[[float], Awaitable[Dict]]) -> Dict:
+        """异步版本：排队在事件循环上等待，不阻塞事件循环也不占用线程"""
+        error, deadline = await self.aacquire(tool_name, tool_config)
+        if error:
+            return error
+        try:
+            return await execute(self._execution_timeout(deadline))
+        finally:
+            self.release(tool_name)
+
+    def stats(self) -> Dict:
+        """各工具的执行中 / 排队 / 拒绝计数，用于监控"""
+        with self._lock:
+            tools = {
+                name: {
+                    'active': c.active,
+                    'waiting': len(c.waiters),
+                    'peak': c.peak,
+                    'calls': c.calls,
+                    'saturated': c.saturated,
+                    'rejected': c.rejected,
+                    'timeouts': c.timeouts
+                }
+                for name, c in self._compartments.items()
+            }
+        return {
+            'max_concurrency': self.max_concurrency,
+            'max_queue': self.max_queue,
+            'timeout': self.timeout,
+            'saturated': sum(tool['saturated'] for tool in tools.values()),
+            'rejected': sum(tool['rejected'] for tool in tools.values()),
+            'timeouts': sum(tool['timeouts'] for tool in tools.values()),
+            'tools': tools
+        }
+
+
+# 全局共享的工具隔离舱
+tool_bulkheads = ToolBulkheads(
+    max_concurrency=int(os.environ.get('TOOL_MAX_CONCURRENCY', '16')),
+    max_queue=int(os.environ.get('TOOL_MAX_QUEUE', '32')),
+    timeout=float(os.environ.get('TOOL_DEADLINE', '30'))
+)
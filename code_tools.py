@@ -0,0 +1,116 @@
+"""
+自定义代码工具
+按 (工具 id, 源码哈希) 缓存编译后的代码对象，MCP 循环中反复调用同一工具时不再重复解析和编译源码；
+编译错误在注册时报告，已存储的错误代码只编译一次，之后的调用直接返回缓存的错误
+"""
+
+import os
+import hashlib
+import threading
+import logging
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+
+def source_hash(code: str) -> str:
+    """源码的 SHA-256 摘要"""
+    return hashlib.sha256(code.encode('utf-8')).hexdigest()
+
+
+def compile_code(code: str, filename: str = '<tool>'):
+    """
+    编译工具源码
+
+    Returns:
+        (代码对象, 错误信息) - 编译失败时代码对象为 None
+    """
+    if not isinstance(code, str):
+        return None, '代码必须是字符串'
+    try:
+        return compile(code, filename, 'exec'), None
+    except (SyntaxError, ValueError) as e:
+        line = f"（第 {e.lineno} 行）" if getattr(e, 'lineno', None) else ''
+        return None, f"代码编译错误{line}: {getattr(e, 'msg', None) or e}"
+
+
+class CodeToolCache:
+    """
+    代码对象缓存
+
+    - 键为 (工具 id, 源码哈希)，源码变化后自然使用新的条目；重新注册或删除工具时 invalidate() 清掉旧条目
+    - 编译失败的结果同样缓存，错误代码不会在每次调用时重新编译
+    - 超过 max_entries 时淘汰最久未使用的条目（LRU）
+    """
+
+    def __init__(self, max_entries: int = 512):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: 'OrderedDict[Tuple[str, str], Tuple[object, Optional[str]]]' = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        self._errors = 0
+
+    def get(self, tool_config: Dict):
+        """
+        返回工具的代码对象
+
+        Returns:
+            (代码对象, 错误信息) - 编译失败时代码对象为 None
+        """
+        code = tool_config.get('code')
+        if not isinstance(code, str):
+            return None, '代码必须是字符串'
+        key = (tool_config.get('id') or tool_config.get('name', ''), source_hash(code))
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return entry
+
+        entry = compile_code(code, f"<tool:{tool_config.get('name', key[0])}>")
+        with self._lock:
+            self._misses += 1
+            if entry[1]:
+                self._errors += 1
+                logger.warning(f"   ⚠️ 工具 {tool_config.get('name')} {entry[1]}")
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def invalidate(self, tool_id: str):
+        """清除工具的所有已编译版本（重新注册、覆盖或删除工具时调用）"""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == tool_id]:
+                del self._entries[key]
+
+    def run(self, tool_config: Dict, params) -> Dict:
+        """执行代码工具：代码中读取 params，把返回值写入 result"""
+        code, error = self.get(tool_config)
+        if error:
+            return {'success': False, 'error': error}
+        # 安全执行自定义代码（生产环境需要更严格的沙箱）
+        local_vars = {'params': params, 'result': None}
+        exec(code, {"__builtins__": {}}, local_vars)
+        return {'success': True, 'result': local_vars.get('result')}
+
+    def stats(self) -> Dict:
+        """缓存统计，用于监控"""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self._hits,
+                'misses': self._misses,
+                'compile_errors': self._errors
+            }
+
+
+# 全局共享的代码对象缓存
+code_cache = CodeToolCache(max_entries=int(os.environ.get('CODE_TOOL_CACHE_SIZE', '512')))
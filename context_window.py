@@ -0,0 +1,147 @@
+"""
+上下文窗口管理
+本地估算 token 数（中日韩字符按字计），每次请求上游前按模型的上下文窗口裁剪历史消息：
+保留系统提示词、固定（pinned）的消息和最近的对话，较早的中间部分折叠为一条省略说明
+"""
+
+import os
+import json
+import logging
+from typing import Dict, List
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 模型配置未设置 context_window 时使用的上下文窗口（tokens）
+DEFAULT_CONTEXT_WINDOW = int(os.environ.get('MODEL_CONTEXT_WINDOW', '32768'))
+
+# 图片/视频按固定数量估算，不按 base64 长度计算
+MEDIA_TOKENS = 1000
+
+# 每条消息的角色等格式开销
+MESSAGE_OVERHEAD = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数：中日韩字符约 1 个/token，其余约 4 个字符/token"""
+    cjk = sum(1 for char in text if '\u2e80' <= char <= '\u9fff' or '\uac00' <= char <= '\ud7af')
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def estimate_message_tokens(message: Dict) -> int:
+    """估算单条消息的 token 数（多模态内容中的媒体按固定数量计算）"""
+    content = message.get('content') or ''
+    if isinstance(content, str):
+        total = estimate_tokens(content)
+    else:
+        total = 0
+        for part in content:
+            part_type = part.get('type', '') if isinstance(part, dict) else ''
+            if part_type in ('image_url', 'video_url', 'image'):
+                total += MEDIA_TOKENS
+            elif part_type == 'text':
+                total += estimate_tokens(part.get('text', ''))
+            else:
+                total += estimate_tokens(json.dumps(part, ensure_ascii=False))
+    if message.get('tool_calls'):
+        total += estimate_tokens(json.dumps(message['tool_calls'], ensure_ascii=False))
+    return total + MESSAGE_OVERHEAD
+
+
+def estimate_messages_tokens(messages: List[Dict]) -> int:
+    """估算消息列表的 token 数"""
+    return sum(estimate_message_tokens(message) for message in messages)
+
+
+def _is_tool_result(message: Dict) -> bool:
+    """是否是工具结果消息（需要和前面的调用消息一起保留或一起省略）"""
+    if message.get('role') == 'tool':
+        return True
+    content = message.get('content')
+    return isinstance(content, list) and any(
+        isinstance(part, dict) and part.get('type') == 'tool_result' for part in content
+    )
+
+
+def _group_messages(messages: List[Dict]) -> List[List[int]]:
+    """按不可拆分的单元分组：工具结果消息和前面的调用消息同组"""
+    groups = []
+    for index, message in enumerate(messages):
+        if groups and _is_tool_result(message):
+            groups[-1].append(index)
+        else:
+            groups.append([index])
+    return groups
+
+
+def _without_pin(message: Dict) -> Dict:
+    """去掉只在本地使用的 pinned 标记（上游不接受未知字段）"""
+    if 'pinned' not in message:
+        return message
+    return {key: value for key, value in message.items() if key != 'pinned'}
+
+
+def trim_messages(messages: List[Dict], max_tokens: int) -> List[Dict]:
+    """
+    裁剪消息使估算 token 数不超过 max_tokens
+
+    - system 消息和 pinned 为 True 的消息总是保留
+    - 最后一组消息（当前问题或最新的工具结果）总是保留
+    - 其余从最新往前保留，直到预算用完；省略的较早消息折叠为一条说明
+    - 工具调用和对应的工具结果一起保留或一起省略
+
+    Returns:
+        裁剪后的消息列表（未超出预算时内容不变，只去掉 pinned 标记）
+    """
+    tokens = [estimate_message_tokens(message) for message in messages]
+    if sum(tokens) <= max_tokens:
+        return [_without_pin(message) for message in messages]
+
+    groups = _group_messages(messages)
+    keep = set()
+    for position, group in enumerate(groups):
+        if position == len(groups) - 1 or any(
+            messages[i].get('role') == 'system' or messages[i].get('pinned') for i in group
+        ):
+            keep.update(group)
+
+    notice_tokens = estimate_tokens('（已省略较早的 0000 条消息）') + MESSAGE_OVERHEAD
+    used = sum(tokens[i] for i in keep) + notice_tokens
+    for group in reversed(groups):
+        if group[0] in keep:
+            continue
+        group_tokens = sum(tokens[i] for i in group)
+        if used + group_tokens > max_tokens:
+            break
+        keep.update(group)
+        used += group_tokens
+
+    dropped = [i for i in range(len(messages)) if i not in keep]
+    if used > max_tokens:
+        logger.warning(f"   ⚠️ 必须保留的消息已超出上下文窗口: 约 {used}/{max_tokens} tokens")
+    if not dropped:
+        return [_without_pin(message) for message in messages]
+    logger.info(f"   ✂️ 上下文裁剪: 省略 {len(dropped)} 条较早的消息（约 {sum(tokens)} → {used} tokens）")
+
+    trimmed = []
+    for index, message in enumerate(messages):
+        if index == dropped[0]:
+            trimmed.append({'role': 'user', 'content': f'（已省略较早的 {len(dropped)} 条消息）'})
+        if index in keep:
+            trimmed.append(_without_pin(message))
+    return trimmed
+
+
+def fit_context(model: Dict, system_prompt: str, messages: List[Dict], tools: List[Dict], params: Dict) -> List[Dict]:
+    """
+    按模型的上下文窗口裁剪消息
+
+    预算 = 上下文窗口 - 输出的 max_tokens - 系统提示词 - 工具定义
+    """
+    context_window = int(model.get('context_window') or DEFAULT_CONTEXT_WINDOW)
+    budget = context_window - int(params.get('max_tokens', 2000))
+    if system_prompt:
+        budget -= estimate_tokens(system_prompt) + MESSAGE_OVERHEAD
+    if tools:
+        budget -= estimate_tokens(json.dumps(tools, ensure_ascii=False, separators=(',', ':')))
+    return trim_messages(messages, max(0, budget))
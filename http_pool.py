@@ -0,0 +1,346 @@
+"""
+上游 HTTP 连接池
+按 (scheme, host, port) 复用 keep-alive 会话，避免每次模型调用/工具调用都重新握手
+"""
+
+import os
+import asyncio
+import threading
+import logging
+import weakref
+from contextlib import asynccontextmanager
+from typing import Dict, Tuple
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 可选依赖：httpx（HTTP/2 多路复用和异步服务模式需要，pip install httpx[http2]）
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+DEFAULT_CONNECT_TIMEOUT = 10
+DEFAULT_READ_TIMEOUT = 60
+
+
+def model_timeouts(model: Dict, default_read: float = DEFAULT_READ_TIMEOUT) -> Tuple[float, float]:
+    """从模型配置中读取 (连接超时, 读取超时)"""
+    return (
+        float(model.get('connect_timeout') or DEFAULT_CONNECT_TIMEOUT),
+        float(model.get('read_timeout') or default_read)
+    )
+
+
+class _Http2Response:
+    """把 httpx 响应包装成调用方使用的 requests.Response 接口子集"""
+
+    def __init__(self, response):
+        self._response = response
+        self.status_code = response.status_code
+        self.headers = response.headers
+
+    @property
+    def text(self):
+        self._response.read()
+        return self._response.text
+
+    @property
+    def content(self):
+        return self._response.read()
+
+    def json(self):
+        self._response.read()
+        return self._response.json()
+
+    def iter_lines(self):
+        for line in self._response.iter_lines():
+            yield line.encode('utf-8')
+
+    def close(self):
+        self._response.close()
+
+
+class _Http2Session:
+    """基于 httpx 的 HTTP/2 会话，同一连接上多路复用多个请求"""
+
+    def __init__(self, pool_maxsize: int, keep_alive: bool):
+        self._client = httpx.Client(
+            http2=True,
+            limits=httpx.Limits(
+                max_connections=pool_maxsize,
+                max_keepalive_connections=pool_maxsize if keep_alive else 0
+            )
+        )
+
+    def request(self, method, url, params=None, json=None, data=None, headers=None, stream=False, timeout=None):
+        if isinstance(timeout, tuple):
+            timeout = httpx.Timeout(timeout[1], connect=timeout[0])
+        try:
+            request = self._client.build_request(
+                method, url, params=params, json=json, content=data, headers=headers, timeout=timeout
+            )
+            response = self._client.send(request, stream=True)
+            if not stream:
+                response.read()
+            return _Http2Response(response)
+        except httpx.TimeoutException as e:
+            raise requests.exceptions.Timeout(str(e))
+        except httpx.TransportError as e:
+            raise requests.exceptions.ConnectionError(str(e))
+
+    def pool_stats(self):
+        return {'created': None, 'idle': None}
+
+
+class UpstreamSessionPool:
+    """
+    上游会话池
+
+    - 每个 (scheme, host, port) 一个会话，会话内部维护最多 pool_maxsize 个 keep-alive 连接
+    - http2=True 且安装了 httpx 时使用 HTTP/2，同一连接上并发多个请求
+    - stats() 返回各上游的 in_use / idle / created 计数，用于监控
+    """
+
+    def __init__(self, pool_maxsize: int = 20, keep_alive: bool = True, http2: bool = False):
+        self.pool_maxsize = pool_maxsize
+        self.keep_alive = keep_alive
+        self.http2 = http2 and httpx is not None
+        if http2 and httpx is None:
+            logger.warning("⚠️ 未安装 httpx，HTTP/2 已禁用（pip install httpx[http2]）")
+        self._lock = threading.Lock()
+        self._sessions: Dict[Tuple[str, str, int], object] = {}
+        self._in_use: Dict[Tuple[str, str, int], int] = {}
+        self._requests: Dict[Tuple[str, str, int], int] = {}
+        self._pid = os.getpid()
+
+    @staticmethod
+    def _key(url: str) -> Tuple[str, str, int]:
+        parts = urlsplit(url)
+        port = parts.port or (443 if parts.scheme == 'https' else 80)
+        return (parts.scheme, parts.hostname or '', port)
+
+    def _create_session(self):
+        if self.http2:
+            return _Http2Session(self.pool_maxsize, self.keep_alive)
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_maxsize, max_retries=0)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        if not self.keep_alive:
+            session.headers['Connection'] = 'close'
+        return session
+
+    def session_for(self, url: str):
+        """获取（必要时创建）目标地址对应的会话"""
+        key = self._key(url)
+        if self._pid != os.getpid():
+            self._reset_after_fork()
+        session = self._sessions.get(key)
+        if session is None:
+            with self._lock:
+                session = self._sessions.get(key)
+                if session is None:
+                    session = self._create_session()
+                    self._sessions[key] = session
+                    self._in_use[key] = 0
+                    self._requests[key] = 0
+                    logger.debug(f"🔌 创建上游会话: {key[0]}://{key[1]}:{key[2]}")
+        return session
+
+    def _reset_after_fork(self):
+        """fork 出的子进程不能复用父进程的 socket，丢弃继承来的会话"""
+        with self._lock:
+            if self._pid != os.getpid():
+                self._sessions, self._in_use, self._requests = {}, {}, {}
+                self._pid = os.getpid()
+
+    def _release(self, key):
+        with self._lock:
+            self._in_use[key] -= 1
+
+    def request(self, method: str, url: str, stream: bool = False, **kwargs):
+        """
+        发送请求
+
+        stream=True 时，连接在响应关闭（response.close()）或读完后才归还，调用方必须关闭响应
+        """
+        session = self.session_for(url)
+        key = self._key(url)
+        with self._lock:
+            self._in_use[key] += 1
+            self._requests[key] += 1
+        try:
+            response = session.request(method, url, stream=stream, **kwargs)
+        except Exception:
+            self._release(key)
+            raise
+
+        if not stream:
+            self._release(key)
+            return response
+
+        # 流式响应：关闭时归还计数（只归还一次）
+        original_close = response.close
+        released = threading.Event()
+
+        def close():
+            if not released.is_set():
+                released.set()
+                self._release(key)
+            original_close()
+
+        response.close = close
+        return response
+
+    def post(self, url: str, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def get(self, url: str, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def stats(self) -> Dict:
+        """各上游连接池状态"""
+        upstreams = {}
+        with self._lock:
+            items = list(self._sessions.items())
+            in_use = dict(self._in_use)
+            total_requests = dict(self._requests)
+        for key, session in items:
+            if isinstance(session, requests.Session):
+                created, idle = self._urllib3_pool_stats(session)
+            else:
+                pool_stats = session.pool_stats()
+                created, idle = pool_stats['created'], pool_stats['idle']
+            upstreams[f"{key[0]}://{key[1]}:{key[2]}"] = {
+                'in_use': in_use.get(key, 0),
+                'idle': idle,
+                'created': created,
+                'requests': total_requests.get(key, 0)
+            }
+        return {
+            'pool_maxsize': self.pool_maxsize,
+            'keep_alive': self.keep_alive,
+            'http2': self.http2,
+            'upstreams': upstreams
+        }
+
+    @staticmethod
+    def _urllib3_pool_stats(session) -> Tuple[int, int]:
+        """统计 urllib3 连接池中已创建和空闲的连接数"""
+        created, idle = 0, 0
+        # http:// 和 https:// 挂载的是同一个 adapter，去重后再统计
+        adapters = {id(adapter): adapter for adapter in session.adapters.values()}
+        for adapter in adapters.values():
+            pools = getattr(adapter.poolmanager, 'pools', None)
+            if pools is None:
+                continue
+            for pool_key in list(pools.keys()):
+                pool = pools.get(pool_key)
+                if pool is None:
+                    continue
+                created += getattr(pool, 'num_connections', 0)
+                queue = getattr(pool, 'pool', None)
+                if queue is not None:
+                    idle += sum(1 for conn in list(queue.queue) if conn is not None)
+        return created, idle
+
+
+class AsyncUpstreamClient:
+    """
+    异步上游客户端（ASGI 服务模式使用）
+
+    - 每个事件循环一个 httpx.AsyncClient，连接在所有并发流之间复用
+    - 等待上游 token 时只占用连接，不占用线程
+    """
+
+    def __init__(self, max_connections: int = 1000, keepalive_connections: int = 20, http2: bool = False):
+        self.max_connections = max_connections
+        self.keepalive_connections = keepalive_connections
+        self.http2 = http2
+        self._clients = weakref.WeakKeyDictionary()
+        self.in_use = 0
+        self.requests = 0
+
+    def client(self):
+        """获取当前事件循环的客户端"""
+        if httpx is None:
+            raise RuntimeError('异步服务模式需要 httpx（pip install httpx）')
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            client = httpx.AsyncClient(
+                http2=self.http2,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.keepalive_connections
+                )
+            )
+            self._clients[loop] = client
+            logger.debug("🔌 创建异步上游客户端")
+        return client
+
+    @staticmethod
+    def _timeout(timeout):
+        if isinstance(timeout, tuple):
+            return httpx.Timeout(timeout[1], connect=timeout[0])
+        return timeout
+
+    @asynccontextmanager
+    async def stream(self, method: str, url: str, timeout=None, **kwargs):
+        """流式请求，退出上下文时关闭响应、归还连接"""
+        client = self.client()
+        self.in_use += 1
+        self.requests += 1
+        try:
+            async with client.stream(method, url, timeout=self._timeout(timeout), **kwargs) as response:
+                yield response
+        finally:
+            self.in_use -= 1
+
+    async def request(self, method: str, url: str, timeout=None, **kwargs):
+        """非流式请求"""
+        client = self.client()
+        self.in_use += 1
+        self.requests += 1
+        try:
+            return await client.request(method, url, timeout=self._timeout(timeout), **kwargs)
+        finally:
+            self.in_use -= 1
+
+    async def aclose(self):
+        """关闭当前事件循环的客户端（服务退出时调用）"""
+        client = self._clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+
+    def stats(self) -> Dict:
+        return {
+            'available': httpx is not None,
+            'max_connections': self.max_connections,
+            'in_use': self.in_use,
+            'requests': self.requests
+        }
+
+
+def _env_flag(name: str, default: str) -> bool:
+    return os.environ.get(name, default).lower() in ('1', 'true', 'yes', 'on')
+
+
+# 进程级共享连接池（可通过环境变量调整）
+upstream_pool = UpstreamSessionPool(
+    pool_maxsize=int(os.environ.get('UPSTREAM_POOL_SIZE', '20')),
+    keep_alive=_env_flag('UPSTREAM_KEEPALIVE', '1'),
+    http2=_env_flag('UPSTREAM_HTTP2', '0')
+)
+
+# 异步服务模式共享的上游客户端
+async_upstream = AsyncUpstreamClient(
+    max_connections=int(os.environ.get('UPSTREAM_ASYNC_MAX_CONNECTIONS', '1000')),
+    keepalive_connections=int(os.environ.get('UPSTREAM_POOL_SIZE', '20')),
+    http2=_env_flag('UPSTREAM_HTTP2', '0') and httpx is not None
+)
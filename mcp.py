@@ -3,16 +3,32 @@ Model Context Protocol (MCP) - 工具调用协调器
 负责模型与工具之间的交互协调，支持多轮工具调用循环
 """
 
+import os
 import json
-import re
+import asyncio
 import traceback
 import logging
-from typing import Dict, List, Any, Optional, Generator
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Any, Optional, Generator, AsyncGenerator
 from datetime import datetime
 
+from tool_parser import scan_model_output, StreamingToolScanner, TOOL_CALL_CLOSE
+from tool_cache import canonical_arguments
+from context_window import estimate_tokens, estimate_messages_tokens
+from tool_output import encode_result, compact_json, result_store, RESULT_PAGE_TOOL, RESULT_PAGE_TOOL_DEFINITION
+
 # 配置日志
 logger = logging.getLogger(__name__)
 
+# 同步工具函数在线程池中执行，避免阻塞事件循环
+_tool_threads = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('MCP_TOOL_THREADS', '32')),
+    thread_name_prefix='mcp-tool'
+)
+
+# 重复调用时附在复用结果中的提醒
+REPEATED_CALL_NOTE = '该工具已用相同参数调用过，这是之前的结果。请不要重复调用，直接基于已有结果回答。'
+
 
 class MCPCoordinator:
     """MCP协调器 - 管理模型和工具之间的交互"""
@@ -22,28 +38,80 @@ class MCPCoordinator:
         初始化MCP协调器
         
         Args:
-            model_caller: 模型调用函数
-            tool_executor: 工具执行函数
+            model_caller: 模型调用函数，返回事件字典的（异步）生成器
+            tool_executor: 工具执行函数，可以是普通函数或协程函数
         """
         self.model_caller = model_caller
         self.tool_executor = tool_executor
         self.max_iterations = 10  # 最大工具调用轮数
+        self.keepalive_interval = 1.0  # 工具执行期间 keepalive 间隔（秒）
+        self.max_parallel_tools = int(os.environ.get('MCP_MAX_PARALLEL_TOOLS', '4'))  # 同一轮工具调用的最大并发数
+        self.loop_threshold = 2  # 连续多少轮只重复之前的工具调用时判定为循环
+        self.result_tokens = int(os.environ.get('MCP_TOOL_RESULT_TOKENS', '2000'))  # 单个工具结果回传给模型的默认预算
+        self.result_store = result_store  # 被截断结果的完整内容，供分页工具读取
     
     def coordinate_stream(
         self,
         messages: List[Dict],
         tools: List[Dict],
         params: Dict,
-        auto_parse: bool = False
+        auto_parse: bool = False,
+        early_stop: bool = False,
+        max_parallel_tools: Optional[int] = None,
+        max_iterations: Optional[int] = None,
+        token_budget: Optional[int] = None
     ) -> Generator:
         """
-        协调模型和工具的交互（流式）
+        协调模型和工具的交互（流式，同步接口）
+        
+        在私有事件循环上驱动 acoordinate_stream，供 Flask 工作线程使用
+        
+        Yields:
+            MCP事件流
+        """
+        loop = asyncio.new_event_loop()
+        events = self.acoordinate_stream(
+            messages, tools, params, auto_parse,
+            early_stop=early_stop,
+            max_parallel_tools=max_parallel_tools,
+            max_iterations=max_iterations,
+            token_budget=token_budget
+        )
+        try:
+            while True:
+                try:
+                    event = loop.run_until_complete(events.__anext__())
+                except StopAsyncIteration:
+                    break
+                yield event
+        finally:
+            # 客户端提前断开时也要关闭模型流
+            loop.run_until_complete(events.aclose())
+            loop.close()
+    
+    async def acoordinate_stream(
+        self,
+        messages: List[Dict],
+        tools: List[Dict],
+        params: Dict,
+        auto_parse: bool = False,
+        early_stop: bool = False,
+        max_parallel_tools: Optional[int] = None,
+        max_iterations: Optional[int] = None,
+        token_budget: Optional[int] = None
+    ) -> AsyncGenerator:
+        """
+        协调模型和工具的交互（流式，异步接口）
         
         Args:
             messages: 对话消息列表
             tools: 可用工具列表
             params: 模型参数
             auto_parse: 是否自动解析工具调用
+            early_stop: 收到第一个完整的工具调用后即结束本轮模型输出（同时以 </tool_call> 作为停止序列）
+            max_parallel_tools: 同一轮工具调用的最大并发数，默认使用 self.max_parallel_tools
+            max_iterations: 本次请求的最大迭代轮数，默认使用 self.max_iterations
+            token_budget: 本次请求的 token 预算（按估算的输入+输出累计），用尽后不再发起新一轮模型调用
             
         Yields:
             MCP事件流
@@ -52,12 +120,34 @@ class MCPCoordinator:
         logger.debug(f"   消息数量: {len(messages)}")
         logger.debug(f"   工具数量: {len(tools)}")
         logger.debug(f"   自动解析: {auto_parse}")
-        logger.debug(f"   最大迭代: {self.max_iterations}")
+        logger.debug(f"   提前结束: {early_stop}")
+        max_iterations = max(1, int(max_iterations or self.max_iterations))
+        logger.debug(f"   最大迭代: {max_iterations}")
+        logger.debug(f"   token预算: {token_budget or '不限'}")
         
         current_messages = messages.copy()
         iteration = 0
+        tokens_used = 0
+        executed = {}  # 调用签名 -> 之前成功执行的结果（跨轮次，用于识别重复调用）
+        no_progress = 0  # 连续只有重复调用的轮数
+        # 工具定义中的 max_result_tokens 覆盖默认的结果预算
+        result_budgets = {tool['name']: int(tool['max_result_tokens']) for tool in tools if tool.get('max_result_tokens')}
+        
+        # 提前结束时让上游在 </tool_call> 处停止生成，截断的调用由扫描器补全
+        model_params = params
+        if auto_parse and early_stop and 'stop' not in params:
+            model_params = {**params, 'stop': [TOOL_CALL_CLOSE]}
         
-        while iteration < self.max_iterations:
+        while iteration < max_iterations:
+            if token_budget and tokens_used >= token_budget:
+                logger.warning(f"   ⚠️ token预算已用尽: {tokens_used}/{token_budget}")
+                yield self._create_event('budget_exceeded', {
+                    'tokens_used': tokens_used,
+                    'token_budget': token_budget
+                })
+                yield self._create_event('done', {})
+                return
+            
             iteration += 1
             
             logger.info(f"   🔁 第 {iteration} 轮迭代开始")
@@ -73,49 +163,86 @@ class MCPCoordinator:
             thinking_content = ''
             has_tool_calls = False
             tool_calls = []
+            native_format = None  # 原生函数调用的消息格式（openai / claude）
+            # 自动解析时边接收边扫描，thinking 之外完整的 <tool_call> 一闭合就开始执行
+            stream_scanner = StreamingToolScanner() if auto_parse else None
+            eager_tasks = []  # [(工具调用, 执行任务)]，重复调用的任务为 None
+            tool_round = self._tool_round(tools, max_parallel_tools)
             
             # 发送thinking状态
             yield self._create_event('status', {'status': 'thinking'})
             
             try:
                 # 收集模型的完整输出
-                for chunk in self.model_caller(current_messages, tools, params):
-                    if chunk['type'] == 'content':
-                        model_content += chunk['content']
-                        # 实时传递内容
-                        yield chunk
-                    elif chunk['type'] == 'status':
-                        yield chunk
-                    elif chunk['type'] == 'error':
-                        yield chunk
-                        return
-                    elif chunk['type'] == 'done':
-                        # 先不发送done，等工具调用完成
-                        pass
+                model_stream = self._iter_model(current_messages, tools, model_params)
+                try:
+                    async for chunk in model_stream:
+                        if chunk['type'] == 'content':
+                            model_content += chunk['content']
+                            # 实时传递内容
+                            yield chunk
+                            if stream_scanner is not None:
+                                for call in stream_scanner.feed(chunk['content']):
+                                    if self._call_signature(call) in executed:
+                                        # 重复调用不提前执行，稍后直接复用之前的结果
+                                        eager_tasks.append((call, None))
+                                        continue
+                                    logger.info(f"      ⚡ 工具调用已完整，提前开始执行: {call['name']}")
+                                    eager_tasks.append((call, asyncio.ensure_future(self._run_tool(
+                                        len(eager_tasks), call['name'], call['arguments'], tool_round
+                                    ))))
+                                if eager_tasks and early_stop:
+                                    logger.info(f"      ✂️ 已收到完整工具调用，提前结束模型输出")
+                                    break
+                        elif chunk['type'] == 'status':
+                            yield chunk
+                        elif chunk['type'] == 'error':
+                            yield chunk
+                            return
+                        elif chunk['type'] == 'tool_calls':
+                            # 模型原生函数调用，无需从文本中解析
+                            native_format = chunk.get('format', 'openai')
+                            tool_calls = self._with_call_ids(chunk['calls'], iteration)
+                        elif chunk['type'] == 'done':
+                            # 先不发送done，等工具调用完成
+                            pass
+                finally:
+                    # 提前结束时立即关闭模型流（释放上游连接）
+                    await model_stream.aclose()
+                
+                # 累计本轮消耗（估算）
+                tokens_used += estimate_messages_tokens(current_messages) + estimate_tokens(model_content)
                 
-                # 解析thinking内容
-                thinking_content = self._extract_thinking(model_content)
+                # 一次扫描得到 thinking、清理后的文本和文本格式的工具调用
+                scanned = scan_model_output(model_content)
+                thinking_content = scanned['thinking']
                 if thinking_content:
                     yield self._create_event('thinking_extracted', {
                         'thinking': thinking_content
                     })
                 
-                # 如果启用自动解析，从输出中提取工具调用
-                if auto_parse:
-                    tool_calls = self._parse_tool_calls(model_content)
-                    if tool_calls:
-                        has_tool_calls = True
-                        yield self._create_event('tool_calls_parsed', {
-                            'count': len(tool_calls),
-                            'calls': tool_calls
-                        })
+                # 原生函数调用优先；否则在启用自动解析时从输出中提取工具调用
+                started_tasks = []
+                if not tool_calls and auto_parse:
+                    eager_calls = [call for call, _ in eager_tasks]
+                    tool_calls = self._with_call_ids(
+                        self._merge_eager_calls(eager_calls, scanned['tool_calls']), iteration
+                    )
+                    started_tasks = [task for _, task in eager_tasks]
+                if tool_calls:
+                    has_tool_calls = True
+                    yield self._create_event('tool_calls_parsed', {
+                        'count': len(tool_calls),
+                        'calls': tool_calls,
+                        'native': native_format is not None
+                    })
                 
                 # 如果没有工具调用，结束循环
                 if not has_tool_calls:
                     # 添加助手消息到历史
                     current_messages.append({
                         'role': 'assistant',
-                        'content': self._clean_content(model_content)
+                        'content': scanned['text']
                     })
                     
                     yield self._create_event('iteration_complete', {
@@ -127,64 +254,177 @@ class MCPCoordinator:
                     yield self._create_event('done', {})
                     break
                 
-                # 执行工具调用
+                # 执行工具调用：同一轮的多个调用并发执行（受 max_parallel_tools 和工具的 max_parallel 限制），
+                # 模型输出期间已开始的直接等待结果
                 yield self._create_event('status', {'status': 'function_calling'})
                 
-                tool_results = []
-                for tool_call in tool_calls:
-                    logger.info(f"      🔧 执行工具: {tool_call['name']}")
-                    logger.debug(f"         参数: {json.dumps(tool_call['arguments'], ensure_ascii=False)}")
-                    
-                    # 发送工具调用开始事件
-                    yield self._create_event('tool_call_start', {
-                        'name': tool_call['name'],
-                        'arguments': tool_call['arguments']
-                    })
-                    
-                    try:
-                        # 执行工具
-                        result = self.tool_executor(
-                            tool_call['name'],
-                            tool_call['arguments']
-                        )
-                        
-                        logger.info(f"         ✅ 工具执行成功")
-                        logger.debug(f"         结果: {json.dumps(result, ensure_ascii=False)[:300]}")
-                        
-                        tool_results.append({
+                # 之前轮次已用相同参数成功执行过的调用视为重复
+                signatures = [self._call_signature(tool_call) for tool_call in tool_calls]
+                repeated = [signature in executed for signature in signatures]
+                
+                results = [None] * len(tool_calls)
+                announced = set()
+                pending = {}
+                for index, tool_call in enumerate(tool_calls):
+                    if index < len(started_tasks) and started_tasks[index] is not None:
+                        pending[started_tasks[index]] = index
+                    elif repeated[index]:
+                        # 直接复用之前的结果，不再执行
+                        logger.info(f"      ♻️ 重复的工具调用，复用之前的结果: {tool_call['name']}")
+                        result = executed[signatures[index]]
+                        results[index] = {
+                            'id': tool_call['id'],
                             'name': tool_call['name'],
                             'arguments': tool_call['arguments'],
                             'result': result,
-                            'success': result.get('success', False)
+                            'success': True
+                        }
+                        announced.add(index)
+                        yield self._create_event('tool_call_start', {
+                            'index': index,
+                            'id': tool_call['id'],
+                            'name': tool_call['name'],
+                            'arguments': tool_call['arguments']
                         })
-                        
-                        # 发送工具调用完成事件
                         yield self._create_event('tool_call_complete', {
+                            'index': index,
+                            'id': tool_call['id'],
                             'name': tool_call['name'],
-                            'success': result.get('success', False),
+                            'success': True,
+                            'cached': True,
+                            'repeated': True,
                             'result': result
                         })
+                    else:
+                        pending[asyncio.ensure_future(self._run_tool(
+                            index, tool_call['name'], tool_call['arguments'], tool_round
+                        ))] = index
+                
+                signal_task = asyncio.ensure_future(tool_round['signal'].wait())
+                try:
+                    while pending:
+                        # 等待期间定期发送 keepalive，以便及时发现客户端断开
+                        done, _ = await asyncio.wait(
+                            {signal_task, *pending},
+                            timeout=self.keepalive_interval,
+                            return_when=asyncio.FIRST_COMPLETED
+                        )
+                        if not done:
+                            yield self._create_event('keepalive')
+                            continue
+                        if signal_task in done:
+                            tool_round['signal'].clear()
+                            signal_task = asyncio.ensure_future(tool_round['signal'].wait())
                         
-                    except Exception as e:
-                        error_result = {
-                            'success': False,
-                            'error': str(e)
-                        }
-                        
-                        tool_results.append({
-                            'name': tool_call['name'],
-                            'arguments': tool_call['arguments'],
-                            'result': error_result,
-                            'success': False
-                        })
+                        # 先发送开始事件，再按调用顺序发送本次完成的结果
+                        finished = sorted((pending.pop(task), task) for task in done if task in pending)
+                        starting = tool_round['started'] + [index for index, _ in finished]
+                        tool_round['started'] = []
+                        for index in starting:
+                            if index in announced:
+                                continue
+                            announced.add(index)
+                            tool_call = tool_calls[index]
+                            logger.info(f"      🔧 执行工具: {tool_call['name']}")
+                            logger.debug(f"         参数: {json.dumps(tool_call['arguments'], ensure_ascii=False)}")
+                            yield self._create_event('tool_call_start', {
+                                'index': index,
+                                'id': tool_call['id'],
+                                'name': tool_call['name'],
+                                'arguments': tool_call['arguments']
+                            })
                         
-                        yield self._create_event('tool_call_error', {
-                            'name': tool_call['name'],
-                            'error': str(e)
-                        })
+                        for index, task in finished:
+                            tool_call = tool_calls[index]
+                            try:
+                                result = task.result()
+                            except Exception as e:
+                                logger.error(f"         ❌ 工具执行失败: {tool_call['name']} - {e}")
+                                results[index] = {
+                                    'id': tool_call['id'],
+                                    'name': tool_call['name'],
+                                    'arguments': tool_call['arguments'],
+                                    'result': {'success': False, 'error': str(e)},
+                                    'success': False
+                                }
+                                yield self._create_event('tool_call_error', {
+                                    'index': index,
+                                    'id': tool_call['id'],
+                                    'name': tool_call['name'],
+                                    'error': str(e)
+                                })
+                                continue
+                            
+                            # cached 标记只放在事件中，不回传给模型
+                            cached = bool(result.pop('cached', False))
+                            logger.info(f"         ✅ 工具执行成功: {tool_call['name']}{'（缓存）' if cached else ''}")
+                            logger.debug(f"         结果: {json.dumps(result, ensure_ascii=False)[:300]}")
+                            results[index] = {
+                                'id': tool_call['id'],
+                                'name': tool_call['name'],
+                                'arguments': tool_call['arguments'],
+                                'result': result,
+                                'success': result.get('success', False)
+                            }
+                            
+                            # 发送工具调用完成事件
+                            yield self._create_event('tool_call_complete', {
+                                'index': index,
+                                'id': tool_call['id'],
+                                'name': tool_call['name'],
+                                'success': result.get('success', False),
+                                'cached': cached,
+                                'result': result
+                            })
+                finally:
+                    signal_task.cancel()
+                    for task, index in pending.items():
+                        # 客户端已断开：取消尚未完成的工具调用
+                        task.cancel()
+                        logger.info(f"         🛑 客户端断开，已取消工具调用: {tool_calls[index]['name']}")
+                
+                # 结果按原始调用顺序回传给模型；重复的调用附带提醒
+                tool_results = results
+                for index, tool_result in enumerate(tool_results):
+                    if repeated[index]:
+                        tool_result['result'] = dict(tool_result['result'], note=REPEATED_CALL_NOTE)
+                    elif tool_result['success']:
+                        executed[signatures[index]] = tool_result['result']
+                
+                # 按预算编码回传给模型的结果；有结果被截断时，后续轮次自动提供分页工具
+                encoded_results = []
+                for tool_result in tool_results:
+                    text, truncated = self._encode_result(tool_result, result_budgets)
+                    encoded_results.append(text)
+                    if truncated and all(tool['name'] != RESULT_PAGE_TOOL for tool in tools):
+                        tools = tools + [RESULT_PAGE_TOOL_DEFINITION]
+                
+                # 连续多轮只重复之前的调用：判定为循环，提前结束
+                no_progress = no_progress + 1 if all(repeated) else 0
+                if no_progress >= self.loop_threshold:
+                    logger.warning(f"   🔁 检测到重复的工具调用循环，提前结束（第 {iteration} 轮）")
+                    yield self._create_event('loop_detected', {
+                        'iteration': iteration,
+                        'calls': [tool_call['name'] for tool_call in tool_calls]
+                    })
+                    yield self._create_event('done', {})
+                    return
+                
+                # 原生函数调用：按模型的函数调用协议回传调用和结果
+                if native_format:
+                    current_messages.extend(self._native_tool_messages(
+                        native_format, scanned['text'], tool_results, encoded_results
+                    ))
+                    yield self._create_event('iteration_complete', {
+                        'iteration': iteration,
+                        'has_tool_calls': True,
+                        'tool_results': tool_results,
+                        'tokens_used': tokens_used
+                    })
+                    continue
                 
                 # 将模型输出添加到消息历史（只保留清理后的内容，不包含工具调用）
-                assistant_content = self._clean_content(model_content)
+                assistant_content = scanned['text']
                 current_messages.append({
                     'role': 'assistant',
                     'content': assistant_content if assistant_content else '我需要使用工具来回答这个问题。'
@@ -192,8 +432,7 @@ class MCPCoordinator:
                 
                 # 添加工具结果到消息 - 格式化为易于模型理解的形式
                 tool_results_summary = []
-                for tool_result in tool_results:
-                    result_str = json.dumps(tool_result['result'], ensure_ascii=False, indent=2)
+                for tool_result, result_str in zip(tool_results, encoded_results):
                     if tool_result['success']:
                         tool_results_summary.append(
                             f"工具 {tool_result['name']} 执行成功，结果：\n{result_str}"
@@ -214,7 +453,8 @@ class MCPCoordinator:
                 yield self._create_event('iteration_complete', {
                     'iteration': iteration,
                     'has_tool_calls': True,
-                    'tool_results': tool_results
+                    'tool_results': tool_results,
+                    'tokens_used': tokens_used
                 })
                 
                 # 继续下一轮迭代（让模型处理工具结果）
@@ -228,198 +468,162 @@ class MCPCoordinator:
                 })
                 yield self._create_event('done', {})
                 break
-        
-        # 如果达到最大迭代次数
-        if iteration >= self.max_iterations:
+            finally:
+                # 未被采用（如模型最终给出原生调用）或因客户端断开未等待的提前执行任务一律取消
+                for _, task in eager_tasks:
+                    if task is not None and not task.done():
+                        task.cancel()
+        else:
+            # 达到最大迭代次数（正常结束或出错时已 break，不会走到这里）
             yield self._create_event('max_iterations_reached', {
-                'max_iterations': self.max_iterations
+                'max_iterations': max_iterations
             })
             yield self._create_event('done', {})
     
+    async def _iter_model(self, messages: List[Dict], tools: List[Dict], params: Dict) -> AsyncGenerator:
+        """遍历模型输出，兼容同步和异步的模型调用函数"""
+        stream = self.model_caller(messages, tools, params)
+        if hasattr(stream, '__aiter__'):
+            try:
+                async for chunk in stream:
+                    yield chunk
+            finally:
+                await stream.aclose()
+        else:
+            try:
+                for chunk in stream:
+                    yield chunk
+            finally:
+                if hasattr(stream, 'close'):
+                    stream.close()
+    
+    def _tool_round(self, tools: List[Dict], max_parallel_tools: Optional[int]) -> Dict:
+        """
+        本轮工具调用的并发限制和开始通知
+        
+        全局并发数来自请求的 max_parallel_tools（默认 self.max_parallel_tools），
+        单个工具的并发数来自工具定义中的 max_parallel
+        """
+        return {
+            'parallel': asyncio.Semaphore(max(1, int(max_parallel_tools or self.max_parallel_tools))),
+            'per_tool': {
+                tool['name']: asyncio.Semaphore(max(1, int(tool['max_parallel'])))
+                for tool in tools if tool.get('max_parallel')
+            },
+            'started': [],  # 已开始执行、尚未发送开始事件的调用序号
+            'signal': asyncio.Event()
+        }
+    
+    async def _run_tool(self, index: int, tool_name: str, tool_args: Dict, tool_round: Dict) -> Dict:
+        """在并发限制内执行一个工具调用，真正开始执行时通知协调循环"""
+        tool_limit = tool_round['per_tool'].get(tool_name)
+        if tool_limit is not None:
+            await tool_limit.acquire()
+        try:
+            async with tool_round['parallel']:
+                tool_round['started'].append(index)
+                tool_round['signal'].set()
+                return await self._execute_tool(tool_name, tool_args)
+        finally:
+            if tool_limit is not None:
+                tool_limit.release()
+    
+    async def _execute_tool(self, tool_name: str, tool_args: Dict) -> Dict:
+        """执行工具，同步工具函数放到线程池中运行"""
+        if tool_name == RESULT_PAGE_TOOL:
+            # 分页工具由协调器自己提供
+            return self.result_store.read(str(tool_args.get('handle', '')), int(tool_args.get('page') or 1))
+        if asyncio.iscoroutinefunction(self.tool_executor):
+            return await self.tool_executor(tool_name, tool_args)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_tool_threads, self.tool_executor, tool_name, tool_args)
+    
+    def _encode_result(self, tool_result: Dict, result_budgets: Dict[str, int]):
+        """
+        编码回传给模型的工具结果（紧凑 JSON，超出预算时截断）
+        
+        Returns:
+            (编码后的文本, 是否截断)
+        """
+        if tool_result['name'] == RESULT_PAGE_TOOL:
+            # 分页结果本身已按预算切分
+            return compact_json(tool_result['result']), False
+        budget = result_budgets.get(tool_result['name'], self.result_tokens)
+        return encode_result(tool_result['result'], budget, estimate_tokens, self.result_store)
+    
+    def _call_signature(self, tool_call: Dict) -> str:
+        """调用签名：工具名 + 规范化参数"""
+        return f"{tool_call['name']}:{canonical_arguments(tool_call['arguments'])}"
+    
+    def _with_call_ids(self, tool_calls: List[Dict], iteration: int) -> List[Dict]:
+        """为没有 id 的工具调用补充 id，用于关联调用和结果"""
+        for index, tool_call in enumerate(tool_calls):
+            if not tool_call.get('id'):
+                tool_call['id'] = f'call_{iteration}_{index}'
+        return tool_calls
+    
+    def _merge_eager_calls(self, eager_calls: List[Dict], parsed_calls: List[Dict]) -> List[Dict]:
+        """合并流式过程中已开始执行的调用和完整输出的解析结果：已执行的在前，其余按解析顺序追加"""
+        remaining = list(parsed_calls)
+        for call in eager_calls:
+            if call in remaining:
+                remaining.remove(call)
+        return eager_calls + remaining
+    
+    def _native_tool_messages(self, call_format: str, content: str, tool_results: List[Dict],
+                              encoded_results: List[str]) -> List[Dict]:
+        """按原生函数调用协议构造助手的调用消息和工具结果消息（结果使用已编码的文本）"""
+        if call_format == 'claude':
+            blocks = [{'type': 'text', 'text': content}] if content else []
+            blocks.extend(
+                {'type': 'tool_use', 'id': r['id'], 'name': r['name'], 'input': r['arguments']}
+                for r in tool_results
+            )
+            return [
+                {'role': 'assistant', 'content': blocks},
+                {'role': 'user', 'content': [
+                    {
+                        'type': 'tool_result',
+                        'tool_use_id': r['id'],
+                        'content': encoded,
+                        'is_error': not r['success']
+                    }
+                    for r, encoded in zip(tool_results, encoded_results)
+                ]}
+            ]
+        
+        messages = [{
+            'role': 'assistant',
+            'content': content or None,
+            'tool_calls': [
+                {
+                    'id': r['id'],
+                    'type': 'function',
+                    'function': {'name': r['name'], 'arguments': json.dumps(r['arguments'], ensure_ascii=False)}
+                }
+                for r in tool_results
+            ]
+        }]
+        messages.extend(
+            {'role': 'tool', 'tool_call_id': r['id'], 'content': encoded}
+            for r, encoded in zip(tool_results, encoded_results)
+        )
+        return messages
+    
     def _extract_thinking(self, content: str) -> str:
         """提取thinking内容"""
-        think_regex = r'<think>([\s\S]*?)</think>'
-        matches = re.findall(think_regex, content)
-        if matches:
-            return '\n'.join(matches)
-        return ''
+        return scan_model_output(content)['thinking']
     
     def _clean_content(self, content: str) -> str:
         """清理内容，移除thinking和工具调用标签"""
-        # 移除thinking标签
-        content = re.sub(r'<think>[\s\S]*?</think>', '', content)
-        
-        # 移除格式1: <tool_call>...</tool_call>
-        content = re.sub(r'<tool_call>[\s\S]*?</tool_call>', '', content)
-        
-        # 移除格式2: <tool_call ... />
-        content = re.sub(r'<tool_call[^>]*?/>', '', content)
-        
-        # 移除格式3: 函数调用格式 function_name({...})
-        # 先找到</think>之后的内容
-        think_end_idx = content.rfind('</think>')
-        if think_end_idx != -1:
-            before_think = content[:think_end_idx + 8]
-            after_think = content[think_end_idx + 8:]
-            # 移除函数调用
-            after_think = re.sub(r'\w+\s*\(\s*\{[\s\S]*?\}\s*\)', '', after_think)
-            content = before_think + after_think
-        else:
-            # 如果没有think标签，也尝试移除函数调用
-            content = re.sub(r'\w+\s*\(\s*\{[\s\S]*?\}\s*\)', '', content)
-        
-        return content.strip()
+        return scan_model_output(content)['text']
     
     def _parse_tool_calls(self, content: str) -> List[Dict]:
         """
         从模型输出中解析工具调用
-        支持多种格式，具有鲁棒性处理
+        支持多种格式（含未封闭/截断的调用），单次线性扫描，见 tool_parser.py
         """
-        tool_calls = []
-        
-        # 格式1: <tool_call>{"name": "...", "arguments": {...}}</tool_call>
-        regex1 = r'<tool_call>([\s\S]*?)</tool_call>'
-        for match in re.finditer(regex1, content):
-            try:
-                call_data = json.loads(match.group(1).strip())
-                if 'name' in call_data:
-                    tool_calls.append({
-                        'name': call_data['name'],
-                        'arguments': call_data.get('arguments', {})
-                    })
-            except json.JSONDecodeError:
-                pass
-        
-        # 格式1b: 未封闭的<tool_call>（流式输出时可能出现）
-        # 查找最后一个<tool_call>，如果没有对应的</tool_call>，尝试解析
-        last_open_tag_idx = content.rfind('<tool_call>')
-        if last_open_tag_idx != -1:
-            # 检查这个<tool_call>是否已经被format1处理
-            after_last_open = content[last_open_tag_idx:]
-            if '</tool_call>' not in after_last_open:
-                # 未封闭的tool_call，尝试提取内容
-                json_content = after_last_open[11:].strip()  # 11 = len('<tool_call>')
-                
-                # 尝试多种JSON提取策略
-                # 策略1: 直接解析（可能完整）
-                try:
-                    call_data = json.loads(json_content)
-                    if 'name' in call_data and call_data['name'] not in [t['name'] for t in tool_calls]:
-                        tool_calls.append({
-                            'name': call_data['name'],
-                            'arguments': call_data.get('arguments', {})
-                        })
-                except json.JSONDecodeError:
-                    # 策略2: 尝试找到JSON的部分（可能被截断）
-                    # 查找可能的JSON结构（可能不完整）
-                    json_match = re.search(r'(\{[\s\S]*)', json_content)
-                    if json_match:
-                        potential_json = json_match.group(1)
-                        # 尝试多种补全方式
-                        # 注意：被截断的JSON可能是：{"name":"tool","argu
-                        # 我们需要补全成：{"name":"tool","arguments":{}} 或 {"name":"tool"}
-                        attempts = [
-                            potential_json,          # 原样
-                            potential_json + '}',    # 补一个右括号
-                            potential_json + '}}',   # 补两个右括号
-                            potential_json + '""}',  # 补引号和括号
-                            potential_json + '":""}', # 补完整的键值对
-                        ]
-                        
-                        # 如果看起来是被截断的键（如 "argu），尝试移除它
-                        if re.search(r'[,\{]\s*"[^"]*$', potential_json):
-                            # 移除最后不完整的键
-                            cleaned = re.sub(r'[,\{]\s*"[^"]*$', '', potential_json)
-                            attempts.extend([
-                                cleaned + '}',
-                                cleaned + '}}',
-                            ])
-                        
-                        for attempt in attempts:
-                            try:
-                                call_data = json.loads(attempt)
-                                if 'name' in call_data and call_data['name'] not in [t['name'] for t in tool_calls]:
-                                    tool_calls.append({
-                                        'name': call_data['name'],
-                                        'arguments': call_data.get('arguments', {})
-                                    })
-                                    break
-                            except json.JSONDecodeError:
-                                continue
-        
-        # 格式2: <tool_call name="..." arguments='...'/>
-        regex2 = r'<tool_call\s+name="([^"]+)"\s+arguments=\'([^\']+)\'\s*/>'
-        for match in re.finditer(regex2, content):
-            try:
-                args = json.loads(match.group(2))
-                if match.group(1) not in [t['name'] for t in tool_calls]:
-                    tool_calls.append({
-                        'name': match.group(1),
-                        'arguments': args
-                    })
-            except json.JSONDecodeError:
-                pass
-        
-        # 格式2b: 未封闭的属性格式 <tool_call name="..." (可能未完成)
-        regex2b = r'<tool_call\s+name="([^"]+)"(?:\s+arguments=[\'"]([^\'"]*)[\'"]?)?(?!/>)'
-        for match in re.finditer(regex2b, content):
-            tool_name = match.group(1)
-            if tool_name not in [t['name'] for t in tool_calls]:
-                args_str = match.group(2) if match.group(2) else '{}'
-                try:
-                    # 尝试解析参数
-                    args = json.loads(args_str) if args_str else {}
-                    tool_calls.append({
-                        'name': tool_name,
-                        'arguments': args
-                    })
-                except json.JSONDecodeError:
-                    # 参数解析失败，使用空参数
-                    tool_calls.append({
-                        'name': tool_name,
-                        'arguments': {}
-                    })
-        
-        # 格式3: 函数调用格式（在</think>后或整个内容中）
-        # 先尝试</think>之后
-        think_end_idx = content.rfind('</think>')
-        search_area = content[think_end_idx + 8:] if think_end_idx != -1 else content
-        
-        # 完整的函数调用
-        regex3 = r'(\w+)\s*\(\s*(\{[\s\S]*?\})\s*\)'
-        for match in re.finditer(regex3, search_area):
-            func_name = match.group(1)
-            if func_name not in [t['name'] for t in tool_calls]:
-                try:
-                    args = json.loads(match.group(2))
-                    tool_calls.append({
-                        'name': func_name,
-                        'arguments': args
-                    })
-                except json.JSONDecodeError:
-                    pass
-        
-        # 格式3b: 未封闭的函数调用 function_name({...  （没有闭合括号）
-        regex3b = r'(\w+)\s*\(\s*(\{[\s\S]*?)$'
-        for match in re.finditer(regex3b, search_area):
-            func_name = match.group(1)
-            # 避免误匹配普通文本，检查是否真的像工具调用
-            if func_name.islower() or '_' in func_name:  # 工具名通常是小写或包含下划线
-                if func_name not in [t['name'] for t in tool_calls]:
-                    json_part = match.group(2).strip()
-                    # 尝试补全JSON
-                    for attempt in [json_part, json_part + '}', json_part + '}}']:
-                        try:
-                            args = json.loads(attempt)
-                            tool_calls.append({
-                                'name': func_name,
-                                'arguments': args
-                            })
-                            break
-                        except json.JSONDecodeError:
-                            continue
-        
-        return tool_calls
+        return scan_model_output(content)['tool_calls']
     
     def _create_event(self, event_type: str, data: Dict = None) -> Dict:
         """创建MCP事件"""
@@ -434,5 +638,8 @@ class MCPCoordinator:
 
 def format_mcp_event_for_sse(event: Dict) -> str:
     """将MCP事件格式化为SSE格式"""
+    if event['type'] == 'keepalive':
+        # SSE 注释行，前端会忽略，只用于检测连接是否断开
+        return ": keepalive\n\n"
     return f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
 
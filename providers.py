@@ -0,0 +1,176 @@
+"""
+模型服务商适配层
+按服务商（openai / claude / custom）集中处理认证头、请求端点、默认模型名、工具定义格式和响应解析；
+模型请求中不随调用变化的部分按模型配置编译一次并缓存，工具定义按工具集合缓存
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+
+
+class ProviderAdapter:
+    """服务商适配器基类（OpenAI 兼容格式）"""
+
+    name = 'custom'
+    default_model = 'default'
+    endpoint_suffix = None  # URL 不以此结尾时自动补全
+    stop_field = 'stop'
+
+    def auth_headers(self, api_key: str) -> Dict[str, str]:
+        """认证请求头"""
+        return {}
+
+    def endpoint(self, url: str) -> str:
+        """请求端点"""
+        if self.endpoint_suffix and not url.endswith(self.endpoint_suffix):
+            return f"{url.rstrip('/')}{self.endpoint_suffix}"
+        return url
+
+    def tool_schema(self, tool: Dict) -> Dict:
+        """工具定义的请求格式"""
+        return {
+            'type': 'function',
+            'function': {
+                'name': tool['name'],
+                'description': tool['description'],
+                'parameters': tool.get('parameters', {})
+            }
+        }
+
+    def parse_response(self, result: Dict) -> Tuple[str, List]:
+        """解析非流式响应，返回 (回复内容, 工具调用)"""
+        message = result.get('choices', [{}])[0].get('message', {})
+        return message.get('content', ''), message.get('tool_calls', [])
+
+
+class OpenAIAdapter(ProviderAdapter):
+    """OpenAI Chat Completions"""
+
+    name = 'openai'
+    default_model = 'gpt-3.5-turbo'
+    endpoint_suffix = '/chat/completions'
+
+    def auth_headers(self, api_key: str) -> Dict[str, str]:
+        return {'Authorization': f'Bearer {api_key}'}
+
+
+class ClaudeAdapter(ProviderAdapter):
+    """Anthropic Messages"""
+
+    name = 'claude'
+    default_model = 'claude-3-sonnet-20240229'
+    endpoint_suffix = '/messages'
+    stop_field = 'stop_sequences'
+
+    def auth_headers(self, api_key: str) -> Dict[str, str]:
+        return {'x-api-key': api_key, 'anthropic-version': '2023-06-01'}
+
+    def tool_schema(self, tool: Dict) -> Dict:
+        return {
+            'name': tool['name'],
+            'description': tool['description'],
+            'input_schema': tool.get('parameters', {})
+        }
+
+    def parse_response(self, result: Dict) -> Tuple[str, List]:
+        content = ''
+        tool_calls = []
+        for block in result.get('content', []):
+            if block.get('type') == 'text':
+                content += block.get('text', '')
+            elif block.get('type') == 'tool_use':
+                tool_calls.append(block)
+        return content, tool_calls
+
+
+PROVIDERS = {adapter.name: adapter for adapter in (OpenAIAdapter(), ClaudeAdapter(), ProviderAdapter())}
+
+
+def get_adapter(model_type: str) -> ProviderAdapter:
+    """按模型类型获取适配器（未知类型按 OpenAI 兼容格式处理）"""
+    return PROVIDERS.get(model_type) or PROVIDERS['custom']
+
+
+class CompiledModel:
+    """编译后的模型请求静态部分"""
+
+    def __init__(self, model: Dict):
+        self.adapter = get_adapter(model.get('model_type'))
+        self.url = self.adapter.endpoint(model['url'])
+        self.headers = {'Content-Type': 'application/json'}
+        if model.get('api_key'):
+            self.headers.update(self.adapter.auth_headers(model['api_key']))
+        self.model_name = model.get('actual_model_name') or self.adapter.default_model
+
+
+class _IdentityCache:
+    """
+    按对象身份缓存（持有对象引用，保证 id 不会被复用）
+
+    注册表每次变化都会生成新的配置字典，按对象缓存即相当于按注册表版本缓存
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: 'OrderedDict[tuple, Tuple[tuple, object]]' = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_build(self, objects: tuple, build):
+        key = tuple(id(obj) for obj in objects)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and all(a is b for a, b in zip(entry[0], objects)):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+        value = build()
+        with self._lock:
+            self.misses += 1
+            self._entries[key] = (objects, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RequestCompiler:
+    """
+    模型请求编译器
+
+    - compile(model): 端点、认证头、模型名，每个模型配置编译一次
+    - tools(model, tools): 服务商格式的工具定义列表，每种服务商 + 工具集合生成一次；
+      返回同一个列表对象，请求体编码时按对象复用已编码的字节（见 request_body.py）
+    """
+
+    def __init__(self, max_models: int = 64, max_tool_sets: int = 256):
+        self._models = _IdentityCache(max_models)
+        self._tool_sets = _IdentityCache(max_tool_sets)
+
+    def compile(self, model: Dict) -> CompiledModel:
+        return self._models.get_or_build((model,), lambda: CompiledModel(model))
+
+    def tools(self, model: Dict, tools: List[Dict]) -> List[Dict]:
+        adapter = self.compile(model).adapter
+        return self._tool_sets.get_or_build(
+            (adapter,) + tuple(tools),
+            lambda: [adapter.tool_schema(tool) for tool in tools]
+        )
+
+    def stats(self) -> Dict:
+        """编译缓存统计，用于监控"""
+        return {
+            'models': len(self._models),
+            'tool_sets': len(self._tool_sets),
+            'hits': self._models.hits + self._tool_sets.hits,
+            'misses': self._models.misses + self._tool_sets.misses
+        }
+
+
+# 全局共享的请求编译器
+request_compiler = RequestCompiler()
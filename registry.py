@@ -0,0 +1,469 @@
+"""
+配置注册表 - 模型/工具配置的进程内缓存
+按 id 和 name 建立索引，只有当底层存储的版本变化时才重新加载
+
+存储后端:
+- JsonConfigStore: config/*.json 文件（默认），以 mtime/size 作为版本
+- SQLiteConfigStore: SQLite（WAL 模式），行级写入 + 单调递增的版本号，适合多 worker 部署
+"""
+
+import os
+import json
+import hashlib
+import sqlite3
+import threading
+import logging
+from typing import Dict, List, Any, Optional
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+
+def load_json_config(path, default=None):
+    """加载 JSON 配置文件"""
+    if os.path.exists(path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"加载配置失败 {path}: {e}")
+    return default or []
+
+
+def save_json_config(path, data):
+    """保存 JSON 配置文件（先写临时文件再替换，避免读到写了一半的文件）"""
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+        return True
+    except Exception as e:
+        print(f"保存配置失败 {path}: {e}")
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        return False
+
+
+# ==================== 存储后端 ====================
+
+class JsonConfigStore:
+    """JSON 文件存储，每次写入整体重写文件"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.kind = os.path.splitext(os.path.basename(path))[0]
+
+    def signature(self):
+        """版本签名：(mtime_ns, size)，文件不存在时为 None"""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def expected_signature(self, before):
+        """文件签名无法预测，写入后总是重新加载"""
+        return None
+
+    def load(self) -> List[Dict]:
+        items = load_json_config(self.path, [])
+        return items if isinstance(items, list) else []
+
+    def add(self, item: Dict) -> bool:
+        return save_json_config(self.path, self.load() + [item])
+
+    def update(self, item_id: str, changes: Dict[str, Any]) -> Optional[Dict]:
+        items = self.load()
+        updated = None
+        for index, item in enumerate(items):
+            if item.get('id') == item_id:
+                updated = {**item, **changes}
+                items[index] = updated
+                break
+        if updated is None:
+            return None
+        return updated if save_json_config(self.path, items) else None
+
+    def remove(self, item_id: str) -> bool:
+        items = [item for item in self.load() if item.get('id') != item_id]
+        return save_json_config(self.path, items)
+
+    def put_many(self, new_items: List[Dict]) -> bool:
+        """批量写入：id 已存在的替换，其余追加，只重写一次文件"""
+        items = self.load()
+        positions = {item.get('id'): index for index, item in enumerate(items)}
+        for item in new_items:
+            if item['id'] in positions:
+                items[positions[item['id']]] = item
+            else:
+                positions[item['id']] = len(items)
+                items.append(item)
+        return save_json_config(self.path, items)
+
+
+class SQLiteConfigStore:
+    """
+    SQLite 存储（WAL 模式）
+
+    - 每个配置项一行，写入只影响对应行，不再整体重写
+    - 每次写入在同一事务内递增 config_meta.version，读取方只需查询这一个整数即可判断是否变化
+    - 首次使用某类配置时，自动从对应的 JSON 文件一次性迁移
+    """
+
+    def __init__(self, db_path: str, kind: str, migrate_from: str = None):
+        self.db_path = db_path
+        self.kind = kind
+        self._local = threading.local()
+        self._init_schema()
+        if migrate_from:
+            self.migrate_from_json(migrate_from)
+
+    def _conn(self) -> sqlite3.Connection:
+        """每个线程一个连接（sqlite3 连接不能跨线程/跨 fork 共享）"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA busy_timeout=30000')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _init_schema(self):
+        conn = self._conn()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS config_items (
+                kind TEXT NOT NULL,
+                id TEXT NOT NULL,
+                name TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                data TEXT NOT NULL,
+                PRIMARY KEY (kind, id)
+            )
+        ''')
+        conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_config_items_name ON config_items (kind, name)')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS config_meta (
+                kind TEXT PRIMARY KEY,
+                version INTEGER NOT NULL
+            )
+        ''')
+
+    def _bump_version(self, conn):
+        conn.execute('''
+            INSERT INTO config_meta (kind, version) VALUES (?, 1)
+            ON CONFLICT (kind) DO UPDATE SET version = version + 1
+        ''', (self.kind,))
+
+    def _insert(self, conn, item: Dict):
+        row = conn.execute(
+            'SELECT COALESCE(MAX(position), 0) + 1 FROM config_items WHERE kind = ?', (self.kind,)
+        ).fetchone()
+        conn.execute(
+            'INSERT INTO config_items (kind, id, name, position, data) VALUES (?, ?, ?, ?, ?)',
+            (self.kind, item['id'], item.get('name', item['id']), row[0], json.dumps(item, ensure_ascii=False))
+        )
+
+    def migrate_from_json(self, json_path: str) -> int:
+        """从 JSON 文件一次性迁移（该类配置已有版本记录时跳过），返回迁移条数"""
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if conn.execute('SELECT 1 FROM config_meta WHERE kind = ?', (self.kind,)).fetchone():
+                conn.execute('COMMIT')
+                return 0
+            items = load_json_config(json_path, [])
+            for item in items:
+                self._insert(conn, item)
+            self._bump_version(conn)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        if items:
+            logger.info(f"📦 已从 {json_path} 迁移 {len(items)} 项 {self.kind} 配置到 SQLite")
+        return len(items)
+
+    def signature(self):
+        """版本签名：config_meta 中的版本号"""
+        row = self._conn().execute(
+            'SELECT version FROM config_meta WHERE kind = ?', (self.kind,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def expected_signature(self, before):
+        """单次写入后的版本号；实际版本不同说明期间有其他 worker 写入"""
+        return (before or 0) + 1
+
+    def load(self) -> List[Dict]:
+        rows = self._conn().execute(
+            'SELECT data FROM config_items WHERE kind = ? ORDER BY position', (self.kind,)
+        ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def add(self, item: Dict) -> bool:
+        conn = self._conn()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            self._insert(conn, item)
+            self._bump_version(conn)
+            conn.execute('COMMIT')
+            return True
+        except Exception as e:
+            conn.execute('ROLLBACK')
+            print(f"保存配置失败 {self.kind}: {e}")
+            return False
+
+    def update(self, item_id: str, changes: Dict[str, Any]) -> Optional[Dict]:
+        conn = self._conn()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute(
+                'SELECT data FROM config_items WHERE kind = ? AND id = ?', (self.kind, item_id)
+            ).fetchone()
+            if not row:
+                conn.execute('ROLLBACK')
+                return None
+            updated = {**json.loads(row[0]), **changes}
+            conn.execute(
+                'UPDATE config_items SET name = ?, data = ? WHERE kind = ? AND id = ?',
+                (updated.get('name', item_id), json.dumps(updated, ensure_ascii=False), self.kind, item_id)
+            )
+            self._bump_version(conn)
+            conn.execute('COMMIT')
+            return updated
+        except Exception as e:
+            conn.execute('ROLLBACK')
+            print(f"保存配置失败 {self.kind}: {e}")
+            return None
+
+    def remove(self, item_id: str) -> bool:
+        conn = self._conn()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('DELETE FROM config_items WHERE kind = ? AND id = ?', (self.kind, item_id))
+            self._bump_version(conn)
+            conn.execute('COMMIT')
+            return True
+        except Exception as e:
+            conn.execute('ROLLBACK')
+            print(f"保存配置失败 {self.kind}: {e}")
+            return False
+
+    def put_many(self, items: List[Dict]) -> bool:
+        """批量 upsert：单个事务，已存在的行保留原有顺序，整批只递增一次版本"""
+        conn = self._conn()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            next_position = conn.execute(
+                'SELECT COALESCE(MAX(position), 0) + 1 FROM config_items WHERE kind = ?', (self.kind,)
+            ).fetchone()[0]
+            conn.executemany(
+                'INSERT INTO config_items (kind, id, name, position, data) VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT (kind, id) DO UPDATE SET name = excluded.name, data = excluded.data',
+                [
+                    (self.kind, item['id'], item.get('name', item['id']), next_position + index,
+                     json.dumps(item, ensure_ascii=False))
+                    for index, item in enumerate(items)
+                ]
+            )
+            self._bump_version(conn)
+            conn.execute('COMMIT')
+            return True
+        except Exception as e:
+            conn.execute('ROLLBACK')
+            print(f"保存配置失败 {self.kind}: {e}")
+            return False
+
+
+# ==================== 注册表 ====================
+
+class _Snapshot:
+    """
+    注册表内容及其索引（创建后不再修改）
+
+    重建时生成新的快照并一次性替换，读取方先取得快照的引用再查询，
+    不会把旧的位置索引和新的列表混在一起
+    """
+
+    __slots__ = ('items', 'by_id', 'position', 'by_name', 'by_category', 'search_text')
+
+    def __init__(self, items: List[Dict]):
+        self.items = items
+        self.by_id = {item['id']: item for item in items if 'id' in item}
+        self.position = {item['id']: index for index, item in enumerate(items) if 'id' in item}
+        self.by_name = {item['name']: item for item in items if 'name' in item}
+        self.by_category: Dict[str, List[Dict]] = {}
+        self.search_text: Dict[str, str] = {}
+        for item in items:
+            self.by_category.setdefault(item.get('category') or '', []).append(item)
+            self.search_text[item.get('id')] = f"{item.get('name', '')}\n{item.get('description', '')}".lower()
+
+
+class ConfigRegistry:
+    """
+    配置注册表
+
+    - 读取: 每次访问只检查一次存储版本，未变化时直接使用内存中的索引
+    - 写入: 通过 add/update/remove 写入存储，随后重新同步内存索引
+    - 查询: get(id) / get_by_name(name) 均为 O(1)
+
+    注意: 返回的配置字典是共享缓存，调用方不要直接修改，修改请走 update()
+    """
+
+    def __init__(self, store):
+        if isinstance(store, str):
+            store = JsonConfigStore(store)
+        self.store = store
+        self._lock = threading.RLock()
+        self._snapshot = _Snapshot([])
+        self._signature = None
+        self._loaded = False
+        self.version = 0  # 本进程内每次内容变化递增
+
+    def _rebuild(self, items: List[Dict]):
+        """替换内容并重建索引（整体替换快照，读取方不会看到一半的索引）"""
+        self._snapshot = _Snapshot(items)
+        self.version += 1
+
+    def refresh(self, force: bool = False):
+        """存储发生变化（或强制）时重新加载"""
+        signature = self.store.signature()
+        if self._loaded and not force and signature == self._signature:
+            return
+        with self._lock:
+            signature = self.store.signature()
+            if self._loaded and not force and signature == self._signature:
+                return
+            self._rebuild(self.store.load())
+            self._signature = signature
+            self._loaded = True
+            logger.debug(f"📂 重新加载配置: {self.store.__class__.__name__} ({len(self._snapshot.items)} 项)")
+
+    # ==================== 查询 ====================
+
+    def all(self) -> List[Dict]:
+        """所有配置项（保持注册顺序）"""
+        self.refresh()
+        return list(self._snapshot.items)
+
+    def get(self, item_id: str) -> Optional[Dict]:
+        """按 id 查询"""
+        self.refresh()
+        return self._snapshot.by_id.get(item_id)
+
+    def get_many(self, item_ids) -> List[Dict]:
+        """按 id 批量查询，结果保持注册顺序（与传入顺序、重复无关），不存在的 id 忽略"""
+        self.refresh()
+        snapshot = self._snapshot
+        positions = sorted({snapshot.position[item_id] for item_id in item_ids if item_id in snapshot.position})
+        return [snapshot.items[position] for position in positions]
+
+    def get_by_name(self, name: str) -> Optional[Dict]:
+        """按 name 查询"""
+        self.refresh()
+        return self._snapshot.by_name.get(name)
+
+    def __len__(self):
+        self.refresh()
+        return len(self._snapshot.items)
+
+    def categories(self) -> List[str]:
+        """所有非空分类"""
+        self.refresh()
+        return sorted(category for category in self._snapshot.by_category if category)
+
+    def query(self, q: str = '', category: str = None, offset: int = 0, limit: int = 50):
+        """
+        分页查询
+
+        Args:
+            q: 按名称/描述做不区分大小写的子串匹配
+            category: 只返回该分类（使用分类索引，不扫描其他分类）
+            offset/limit: 分页参数
+
+        Returns:
+            (当前页列表, 符合条件的总数)
+        """
+        self.refresh()
+        snapshot = self._snapshot
+        items = snapshot.items if category is None else snapshot.by_category.get(category, [])
+        if q:
+            needle = q.lower()
+            search_text = snapshot.search_text
+            items = [item for item in items if needle in search_text.get(item.get('id'), '')]
+        return items[offset:offset + limit], len(items)
+
+    @property
+    def etag(self) -> str:
+        """由存储版本派生的强 ETag（多个 worker 看到同一版本时结果一致）"""
+        self.refresh()
+        source = f"{self.store.__class__.__name__}:{self.store.kind}:{self._signature}"
+        return hashlib.sha1(source.encode('utf-8')).hexdigest()[:20]
+
+    # ==================== 修改 ====================
+
+    def _write(self, operation, apply_local):
+        """
+        执行一次写入并同步内存索引
+
+        如果写入前缓存是最新的，且写入后版本恰好前进一步（没有其他 worker 并发写入），
+        直接在内存中应用这次修改；否则从存储重新加载
+        """
+        with self._lock:
+            before = self.store.signature()
+            result = operation()
+            after = self.store.signature()
+            expected = self.store.expected_signature(before)
+            if result and self._loaded and before == self._signature and expected is not None and after == expected:
+                apply_local(result)
+                self._signature = after
+            else:
+                self.refresh(force=True)
+            return result
+
+    def add(self, item: Dict) -> bool:
+        """追加一项配置"""
+        return self._write(
+            lambda: self.store.add(item),
+            lambda _: self._rebuild(self._snapshot.items + [item])
+        )
+
+    def put_many(self, items: List[Dict]) -> bool:
+        """批量写入（id 已存在的替换，其余追加），整批只写一次存储"""
+        def apply_local(_):
+            replacements = {item['id']: item for item in items}
+            merged = [replacements.pop(item.get('id'), item) for item in self._snapshot.items]
+            self._rebuild(merged + list(replacements.values()))
+        return self._write(lambda: self.store.put_many(items), apply_local)
+
+    def update(self, item_id: str, changes: Dict[str, Any]) -> Optional[Dict]:
+        """更新指定配置项，返回更新后的配置；不存在或保存失败时返回 None"""
+        return self._write(
+            lambda: self.store.update(item_id, changes),
+            lambda updated: self._rebuild([updated if item.get('id') == item_id else item for item in self._snapshot.items])
+        )
+
+    def remove(self, item_id: str) -> bool:
+        """删除指定配置项（不存在时也视为成功）"""
+        return self._write(
+            lambda: self.store.remove(item_id),
+            lambda _: self._rebuild([item for item in self._snapshot.items if item.get('id') != item_id])
+        )
+
+
+def create_registry(kind: str, json_path: str, backend: str = 'json', db_path: str = None) -> ConfigRegistry:
+    """
+    按后端类型创建注册表
+
+    Args:
+        kind: 配置类别（models / tools）
+        json_path: JSON 配置文件路径（json 后端直接使用；sqlite 后端用于首次迁移）
+        backend: 'json' 或 'sqlite'
+        db_path: SQLite 数据库路径
+    """
+    if backend == 'sqlite':
+        return ConfigRegistry(SQLiteConfigStore(db_path, kind, migrate_from=json_path))
+    return ConfigRegistry(JsonConfigStore(json_path))
@@ -0,0 +1,100 @@
+"""
+模型请求体编码
+消息加入历史后不再修改，按消息对象缓存编码后的字节；MCP 多轮迭代时只编码新追加的消息，
+再拼接成请求体，避免每轮重复编码历史中的 base64 图片/视频。工具定义列表同样按对象缓存（见 providers.py）
+"""
+
+import os
+import json
+import threading
+from collections import OrderedDict
+from typing import Dict, Tuple
+
+
+def _encode(value) -> bytes:
+    """紧凑 JSON 的 UTF-8 字节"""
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+class MessageEncodingCache:
+    """
+    消息编码缓存
+
+    - 按消息对象（id）缓存，同时持有消息的引用，保证 id 不会被复用到其他对象
+    - 缓存的总字节数超过 max_bytes 时淘汰最久未使用的消息
+    - 消息加入历史后不能再原地修改（需要修改时应创建新的字典）
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: 'OrderedDict[int, Tuple[object, bytes]]' = OrderedDict()
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._saved_bytes = 0
+
+    def encode(self, message) -> bytes:
+        """返回消息（或工具定义列表）的编码，已编码过的直接复用"""
+        key = id(message)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] is message:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                self._saved_bytes += len(entry[1])
+                return entry[1]
+
+        encoded = _encode(message)
+        with self._lock:
+            self._misses += 1
+            if len(encoded) > self.max_bytes:
+                return encoded
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old[1])
+            self._entries[key] = (message, encoded)
+            self._bytes += len(encoded)
+            while self._bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+        return encoded
+
+    def stats(self) -> Dict:
+        """缓存统计，用于监控"""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self._hits,
+                'misses': self._misses,
+                'saved_bytes': self._saved_bytes
+            }
+
+
+def encode_request_body(request_data: Dict, cache: 'MessageEncodingCache' = None) -> bytes:
+    """
+    编码模型请求体：messages 中的每条消息和 tools 列表使用缓存的编码，其余字段直接编码后拼接
+
+    结果与 json.dumps(request_data) 等价（紧凑格式、UTF-8）
+    """
+    cache = cache or message_cache
+    messages = request_data.get('messages')
+    if messages is None:
+        return _encode(request_data)
+
+    rest = _encode({key: value for key, value in request_data.items() if key not in ('messages', 'tools')})
+    parts = [b'{"messages":[', b','.join(cache.encode(message) for message in messages), b']']
+    if request_data.get('tools') is not None:
+        parts.append(b',"tools":')
+        parts.append(cache.encode(request_data['tools']))
+    if rest != b'{}':
+        parts.append(b',')
+        parts.append(rest[1:-1])
+    parts.append(b'}')
+    return b''.join(parts)
+
+
+# 全局共享的消息编码缓存
+message_cache = MessageEncodingCache(max_bytes=int(os.environ.get('MESSAGE_CACHE_BYTES', str(64 * 1024 * 1024))))
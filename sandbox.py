@@ -0,0 +1,267 @@
+"""
+代码工具沙箱进程池
+自定义代码工具在预先启动的工作进程中执行，不占用 Web worker 线程和 GIL；每次调用有 CPU 时间、
+内存（地址空间）和墙钟时间限制，超时或超限的进程直接结束并补充新进程，进程执行 N 次后回收重建
+
+工作进程以 `python sandbox.py <fd>` 启动（不重新导入 Web 服务的主模块），通过 socketpair 上的
+multiprocessing Connection（长度前缀 + pickle）通信；仅支持 Unix
+"""
+
+import os
+import sys
+import time
+import queue
+import atexit
+import signal
+import socket
+import threading
+import logging
+import subprocess
+from multiprocessing.connection import Connection
+from typing import Dict, Optional
+
+from code_tools import code_cache, source_hash
+
+# 可选依赖：resource（仅 Unix，其他平台不设置 CPU/内存限制）
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 超出 CPU 软限制时内核发送的信号
+_SIGXCPU = getattr(signal, 'SIGXCPU', None)
+
+
+def _limit_cpu(cpu_seconds: float):
+    """把 CPU 时间软限制设为「已用时间 + cpu_seconds」（限制按进程累计，每次调用前重新设置）"""
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    soft = int(usage.ru_utime + usage.ru_stime + cpu_seconds) + 1
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+
+def _worker_main(conn, cpu_seconds: float, memory_bytes: int):
+    """
+    工作进程主循环
+
+    请求: (代码键, 源码或 None, 参数)；源码只在该进程第一次执行此代码时发送，编译后按代码键缓存
+    响应: (是否成功, 结果或错误信息)
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if resource is not None and memory_bytes:
+        try:
+            resource.setrlimit(resource.RLIMIT_AS, (memory_bytes, memory_bytes))
+        except (ValueError, OSError):
+            pass
+
+    codes = {}
+    while True:
+        try:
+            key, source, params = conn.recv()
+        except (EOFError, OSError):
+            break
+        try:
+            if source is not None:
+                codes[key] = compile(source, '<tool>', 'exec')
+            if resource is not None and cpu_seconds:
+                _limit_cpu(cpu_seconds)
+            local_vars = {'params': params, 'result': None}
+            exec(codes[key], {"__builtins__": {}}, local_vars)
+            reply = (True, local_vars.get('result'))
+        except MemoryError:
+            reply = (False, '代码执行错误: 超出内存限制')
+        except Exception as e:
+            reply = (False, f'代码执行错误: {e}')
+        try:
+            conn.send(reply)
+        except Exception as e:
+            conn.send((False, f'代码执行错误: 结果无法序列化（{e}）'))
+
+
+class _Worker:
+    """一个工作进程及其连接"""
+
+    def __init__(self, cpu_seconds: float, memory_bytes: int):
+        parent_sock, child_sock = socket.socketpair()
+        fd = child_sock.fileno()
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), str(fd), str(cpu_seconds), str(memory_bytes)],
+            pass_fds=(fd,), stdin=subprocess.DEVNULL, close_fds=True
+        )
+        child_sock.close()
+        self.conn = Connection(parent_sock.detach())
+        self.calls = 0
+        self.keys = set()  # 该进程已编译的代码键
+
+    def exitcode(self) -> Optional[int]:
+        try:
+            return self.process.wait(1)
+        except subprocess.TimeoutExpired:
+            return None
+
+    def kill(self):
+        try:
+            self.process.kill()
+            self.process.wait(1)
+        except Exception:
+            pass
+        self.conn.close()
+
+
+class SandboxPool:
+    """
+    代码工具进程池
+
+    - 第一次调用时启动 workers 个工作进程（gunicorn 预加载时不会在 master 进程中创建）
+    - 每次调用的限制: CPU 时间 cpu_seconds、地址空间 memory_mb、墙钟时间 timeout（工具配置的 timeout 优先，不超过调用方给出的上限）
+    - 超时的进程被结束，异常退出（如超出 CPU 限制）的进程被替换；进程执行 max_calls 次后回收重建
+    - 所有进程都在忙时最多等待 timeout 秒
+    """
+
+    def __init__(self, workers: int = 2, cpu_seconds: float = 5, memory_mb: int = 512,
+                 timeout: float = 10, max_calls: int = 500):
+        self.workers = workers
+        self.cpu_seconds = cpu_seconds
+        self.memory_bytes = memory_mb * 1024 * 1024 if memory_mb else 0
+        self.timeout = timeout
+        self.max_calls = max_calls
+        self._lock = threading.Lock()
+        self._idle: 'queue.Queue[_Worker]' = queue.Queue()
+        self._all = set()
+        self._started = False
+        self._closed = False
+        self._calls = 0
+        self._timeouts = 0
+        self._crashes = 0
+        self._recycled = 0
+
+    def _start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        for _ in range(self.workers):
+            self._idle.put(self._spawn())
+        atexit.register(self.close)
+        logger.info(f"🧰 代码工具进程池已启动: {self.workers} 个进程")
+
+    def _spawn(self) -> _Worker:
+        worker = _Worker(self.cpu_seconds, self.memory_bytes)
+        with self._lock:
+            self._all.add(worker)
+        return worker
+
+    def _discard(self, worker: _Worker):
+        worker.kill()
+        with self._lock:
+            self._all.discard(worker)
+
+    def _release(self, worker: _Worker, healthy: bool):
+        """归还进程；异常或达到 max_calls 的进程替换为新进程"""
+        if self._closed:
+            self._discard(worker)
+            return
+        if healthy and worker.calls < self.max_calls:
+            self._idle.put(worker)
+            return
+        if healthy:
+            with self._lock:
+                self._recycled += 1
+        self._discard(worker)
+        self._idle.put(self._spawn())
+
+    def run(self, tool_config: Dict, params, timeout: Optional[float] = None) -> Dict:
+        """
+        在工作进程中执行代码工具，返回 {'success': ..., 'result'/'error': ...}
+
+        timeout: 墙钟时间上限（如隔离舱截止前的剩余时间），与工具配置的 timeout 取较小值
+        """
+        _, error = code_cache.get(tool_config)  # 编译错误在本进程报告一次并缓存
+        if error:
+            return {'success': False, 'error': error}
+        source = tool_config['code']
+        key = f"{tool_config.get('id') or tool_config.get('name', '')}:{source_hash(source)}"
+        limit = float(tool_config.get('timeout') or self.timeout)
+        timeout = limit if timeout is None else min(limit, timeout)
+
+        self._start()
+        deadline = time.monotonic() + timeout
+        try:
+            worker = self._idle.get(timeout=timeout)
+        except queue.Empty:
+            return {'success': False, 'error': f'代码工具繁忙: {timeout:g}s 内没有空闲的执行进程'}
+
+        healthy = False
+        try:
+            worker.conn.send((key, None if key in worker.keys else source, params))
+            worker.keys.add(key)
+            worker.calls += 1
+            with self._lock:
+                self._calls += 1
+            if not worker.conn.poll(max(0.0, deadline - time.monotonic())):
+                with self._lock:
+                    self._timeouts += 1
+                logger.warning(f"   ⏱️ 代码工具 {tool_config.get('name')} 执行超时（{timeout:g}s），结束工作进程")
+                return {'success': False, 'error': f'代码执行超时（{timeout:g}s）'}
+            ok, value = worker.conn.recv()
+            healthy = True
+            return {'success': True, 'result': value} if ok else {'success': False, 'error': value}
+        except (EOFError, OSError):
+            exitcode = worker.exitcode()
+            with self._lock:
+                self._crashes += 1
+            if _SIGXCPU and exitcode == -_SIGXCPU:
+                error = f'代码执行错误: 超出 CPU 时间限制（{self.cpu_seconds}s）'
+            else:
+                error = f'代码执行错误: 工作进程异常退出（exitcode={exitcode}）'
+            logger.warning(f"   ⚠️ 代码工具 {tool_config.get('name')} {error}")
+            return {'success': False, 'error': error}
+        finally:
+            self._release(worker, healthy)
+
+    def close(self):
+        """结束所有工作进程"""
+        self._closed = True
+        with self._lock:
+            workers = list(self._all)
+            self._all.clear()
+        for worker in workers:
+            worker.kill()
+
+    def stats(self) -> Dict:
+        """进程池统计，用于监控"""
+        with self._lock:
+            return {
+                'workers': len(self._all),
+                'idle': self._idle.qsize(),
+                'calls': self._calls,
+                'timeouts': self._timeouts,
+                'crashes': self._crashes,
+                'recycled': self._recycled
+            }
+
+
+# 全局共享的代码工具进程池（CODE_TOOL_WORKERS=0 或非 Unix 平台时不使用进程池，在 Web worker 线程中直接执行）
+sandbox_pool = SandboxPool(
+    workers=int(os.environ.get('CODE_TOOL_WORKERS', '2')) if os.name == 'posix' else 0,
+    cpu_seconds=float(os.environ.get('CODE_TOOL_CPU_SECONDS', '5')),
+    memory_mb=int(os.environ.get('CODE_TOOL_MEMORY_MB', '512')),
+    timeout=float(os.environ.get('CODE_TOOL_TIMEOUT', '10')),
+    max_calls=int(os.environ.get('CODE_TOOL_MAX_CALLS', '500'))
+)
+
+
+def run_code_tool(tool_config: Dict, params, timeout: Optional[float] = None) -> Dict:
+    """执行代码工具（启用进程池时在工作进程中执行，timeout 为墙钟时间上限）"""
+    if sandbox_pool.workers > 0:
+        return sandbox_pool.run(tool_config, params, timeout)
+    return code_cache.run(tool_config, params)
+
+
+if __name__ == '__main__':
+    _worker_main(Connection(int(sys.argv[1])), float(sys.argv[2]), int(sys.argv[3]))
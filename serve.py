@@ -0,0 +1,126 @@
+"""
+生产环境启动入口
+多进程 + 多线程（gunicorn gthread）或异步（uvicorn worker）方式运行服务，替代 Werkzeug 开发服务器
+
+- 主进程预加载应用和 builtin_tools，fork 出的 worker 以写时复制方式共享
+- SIGHUP 平滑重启 worker；SIGTERM 停止接收新连接，等待进行中的 SSE 流在 graceful_timeout 内结束
+
+用法：
+    python serve.py                       # 同步模式（gunicorn gthread）
+    python serve.py --asgi                # 异步模式（asgi:app，uvicorn worker）
+    python serve.py --workers 4 --threads 64 --graceful-timeout 120
+"""
+
+import os
+import sys
+import argparse
+import multiprocessing
+
+# 可选依赖：gunicorn（pip install gunicorn）
+try:
+    from gunicorn.app.base import BaseApplication
+    from gunicorn.util import import_app
+except ImportError:
+    BaseApplication = None
+
+
+def parse_args(argv=None):
+    """命令行参数，默认值来自环境变量"""
+    env = os.environ
+    parser = argparse.ArgumentParser(description='行业智能通用运维模型2.0 服务')
+    parser.add_argument('--bind', default=env.get('BIND', f"{env.get('HOST', '0.0.0.0')}:{env.get('PORT', '5000')}"),
+                        help='监听地址（默认 0.0.0.0:5000）')
+    parser.add_argument('--workers', type=int, default=int(env.get('WEB_WORKERS', multiprocessing.cpu_count())),
+                        help='worker 进程数（默认 CPU 核数）')
+    parser.add_argument('--threads', type=int, default=int(env.get('WEB_THREADS', '32')),
+                        help='每个 worker 的线程数，即可同时保持的 SSE 连接数（同步模式）')
+    parser.add_argument('--graceful-timeout', type=int, default=int(env.get('GRACEFUL_TIMEOUT', '60')),
+                        help='停止/重启时等待进行中请求结束的秒数')
+    parser.add_argument('--asgi', action='store_true', default=env.get('SERVE_MODE') == 'asgi',
+                        help='异步模式（asgi:app）')
+    parser.add_argument('--reload', action='store_true', help='代码变化时自动重启（开发用，不预加载）')
+    return parser.parse_args(argv)
+
+
+def uvicorn_worker_class(graceful_timeout):
+    """把 graceful_timeout 传给 uvicorn，停止时等待进行中的流结束"""
+    try:
+        from uvicorn_worker import UvicornWorker
+    except ImportError:
+        from uvicorn.workers import UvicornWorker
+
+    class DrainingUvicornWorker(UvicornWorker):
+        CONFIG_KWARGS = {**UvicornWorker.CONFIG_KWARGS, 'timeout_graceful_shutdown': graceful_timeout}
+
+    return DrainingUvicornWorker
+
+
+def gunicorn_options(args):
+    """生成 gunicorn 配置"""
+    options = {
+        'bind': args.bind,
+        'workers': args.workers,
+        'graceful_timeout': args.graceful_timeout,
+        'preload_app': not args.reload,
+        'reload': args.reload,
+        'keepalive': 5,
+        'on_starting': lambda server: server.log.info(f"🚀 服务启动: {args.bind} ({args.workers} workers)"),
+        'worker_int': lambda worker: worker.log.info(f"🛑 worker {worker.pid} 收到中断，等待进行中的请求结束"),
+    }
+    if args.asgi:
+        options['worker_class'] = uvicorn_worker_class(args.graceful_timeout)
+    else:
+        # gthread：每个 SSE 流占用一个线程，心跳由主循环发送，长连接不会被判定超时
+        options['worker_class'] = 'gthread'
+        options['threads'] = args.threads
+    return options
+
+
+if BaseApplication is not None:
+    class ServerApplication(BaseApplication):
+        """以代码方式配置的 gunicorn 应用"""
+
+        def __init__(self, app_uri, options):
+            self.app_uri = app_uri
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            # preload_app=True 时在主进程中执行：导入 app 会同时加载 builtin_tools 和配置注册表
+            return import_app(self.app_uri)
+
+
+def run_fallback(args):
+    """未安装 gunicorn 时的降级方式"""
+    host, _, port = args.bind.rpartition(':')
+    if args.asgi:
+        import uvicorn
+        uvicorn.run('asgi:app', host=host, port=int(port), workers=args.workers,
+                    reload=args.reload, timeout_graceful_shutdown=args.graceful_timeout)
+        return
+
+    print("⚠️ 未安装 gunicorn，使用单进程多线程服务器（pip install gunicorn）")
+    from app import app
+    app.run(host=host, port=int(port), threaded=True, debug=False, use_reloader=args.reload)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    app_uri = 'asgi:app' if args.asgi else 'app:app'
+
+    # 保证从任意目录启动都能导入 app / asgi
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    if BaseApplication is None:
+        run_fallback(args)
+        return
+
+    ServerApplication(app_uri, gunicorn_options(args)).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -51,9 +51,10 @@ echo "=========================================="
 echo "   启动服务中..."
 echo "=========================================="
 echo ""
-echo "访问地址: http://localhost:5000"
-echo "按 Ctrl+C 停止服务"
+echo "访问地址: http://localhost:${PORT:-5000}"
+echo "按 Ctrl+C 停止服务（进行中的对话会在 ${GRACEFUL_TIMEOUT:-60} 秒内结束）"
 echo ""
 
-python3 app.py
+# 生产模式启动（多 worker）；额外参数透传给 serve.py，如: bash start.sh --asgi --workers 4
+exec python3 serve.py "$@"
 
@@ -52,6 +52,9 @@ const elements = {
     
     // 工具管理
     toolsList: document.getElementById('tools-list'),
+    toolsSearch: document.getElementById('tools-search'),
+    toolsCategory: document.getElementById('tools-category'),
+    toolsPagination: document.getElementById('tools-pagination'),
     addToolBtn: document.getElementById('add-tool-btn'),
     toolModal: document.getElementById('tool-modal'),
     autoParseTools: document.getElementById('auto-parse-tools'),
@@ -85,6 +88,7 @@ document.addEventListener('DOMContentLoaded', () => {
     initChat();
     initModals();
     initToolForm();
+    initToolsFilter();
     loadModels();
     loadTools();
     loadBuiltinTools();
@@ -835,13 +839,63 @@ async function deleteModel(modelId) {
 
 // ==================== 工具管理 ====================
 
+// 工具列表分页状态
+const TOOLS_PAGE_SIZE = 20;
+let toolsOffset = 0;
+let toolsSearchTimer = null;
+
+function initToolsFilter() {
+    elements.toolsSearch.addEventListener('input', () => {
+        // 输入停顿后再查询，避免每个按键都请求一次
+        clearTimeout(toolsSearchTimer);
+        toolsSearchTimer = setTimeout(() => {
+            toolsOffset = 0;
+            loadToolsPage();
+        }, 300);
+    });
+    
+    elements.toolsCategory.addEventListener('change', () => {
+        toolsOffset = 0;
+        loadToolsPage();
+    });
+}
+
 async function loadTools() {
+    await Promise.all([loadToolsPage(), loadToolsCheckboxes()]);
+}
+
+async function loadToolsPage() {
     try {
-        const response = await fetch(`${API_BASE}/api/tools`);
+        const query = new URLSearchParams({
+            offset: toolsOffset,
+            limit: TOOLS_PAGE_SIZE,
+            q: elements.toolsSearch.value.trim(),
+            category: elements.toolsCategory.value
+        });
+        const response = await fetch(`${API_BASE}/api/tools?${query}`);
         const data = await response.json();
         
         if (data.success) {
+            // 当前页被删空时回退一页
+            if (data.tools.length === 0 && toolsOffset > 0) {
+                toolsOffset = Math.max(toolsOffset - TOOLS_PAGE_SIZE, 0);
+                return loadToolsPage();
+            }
             renderTools(data.tools);
+            renderToolsPagination(data.total);
+            updateToolsCategories(data.categories || []);
+        }
+    } catch (error) {
+        console.error('加载工具失败:', error);
+    }
+}
+
+async function loadToolsCheckboxes() {
+    try {
+        const response = await fetch(`${API_BASE}/api/tools`);
+        const data = await response.json();
+        
+        if (data.success) {
             updateToolsCheckboxes(data.tools);
         }
     } catch (error) {
@@ -849,9 +903,39 @@ async function loadTools() {
     }
 }
 
+function renderToolsPagination(total) {
+    if (total <= TOOLS_PAGE_SIZE) {
+        elements.toolsPagination.innerHTML = '';
+        return;
+    }
+    
+    const page = Math.floor(toolsOffset / TOOLS_PAGE_SIZE) + 1;
+    const pages = Math.ceil(total / TOOLS_PAGE_SIZE);
+    
+    elements.toolsPagination.innerHTML = `
+        <button class="btn btn-secondary" onclick="changeToolsPage(-1)" ${page <= 1 ? 'disabled' : ''}>上一页</button>
+        <span>第 ${page} / ${pages} 页（共 ${total} 个工具）</span>
+        <button class="btn btn-secondary" onclick="changeToolsPage(1)" ${page >= pages ? 'disabled' : ''}>下一页</button>
+    `;
+}
+
+function changeToolsPage(delta) {
+    toolsOffset = Math.max(toolsOffset + delta * TOOLS_PAGE_SIZE, 0);
+    loadToolsPage();
+}
+
+function updateToolsCategories(categories) {
+    const selected = elements.toolsCategory.value;
+    elements.toolsCategory.innerHTML = '<option value="">全部分类</option>' + categories.map(category =>
+        `<option value="${category}">${category}</option>`
+    ).join('');
+    elements.toolsCategory.value = categories.includes(selected) ? selected : '';
+}
+
 function renderTools(tools) {
     if (tools.length === 0) {
-        elements.toolsList.innerHTML = '<p class="text-muted">暂无已注册的工具</p>';
+        const filtered = elements.toolsSearch.value.trim() || elements.toolsCategory.value;
+        elements.toolsList.innerHTML = `<p class="text-muted">${filtered ? '没有匹配的工具' : '暂无已注册的工具'}</p>`;
         return;
     }
     
@@ -1455,8 +1539,8 @@ async function autoParseAndExecuteTools(content, textDiv, messageDiv) {
         const messageContent = messageDiv.querySelector('.message-content');
         messageContent.appendChild(toolResultsDiv);
         
-        // 执行每个工具调用
-        for (const toolCall of toolCalls) {
+        // 先为每个工具调用创建结果显示项
+        const resultDivs = toolCalls.map(toolCall => {
             const toolResultItem = document.createElement('div');
             toolResultItem.className = 'tool-result-item';
             toolResultItem.innerHTML = `
@@ -1465,33 +1549,55 @@ async function autoParseAndExecuteTools(content, textDiv, messageDiv) {
                 <div class="tool-result">⏳ 执行中...</div>
             `;
             toolResultsDiv.appendChild(toolResultItem);
-            
-            try {
-                // 调用工具执行API
-                const response = await fetch(`${API_BASE}/api/tools/execute`, {
-                    method: 'POST',
-                    headers: { 'Content-Type': 'application/json' },
-                    body: JSON.stringify({
+            return toolResultItem.querySelector('.tool-result');
+        });
+        
+        try {
+            // 一次请求并发执行所有工具调用，每个调用完成时立即显示结果
+            const response = await fetch(`${API_BASE}/api/tools/execute/batch`, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({
+                    calls: toolCalls.map(toolCall => ({
                         tool_name: toolCall.name,
                         parameters: toolCall.arguments
-                    })
-                });
-                
+                    })),
+                    stream: true
+                })
+            });
+            
+            if (!(response.headers.get('Content-Type') || '').startsWith('text/event-stream')) {
                 const data = await response.json();
-                const resultDiv = toolResultItem.querySelector('.tool-result');
+                throw new Error(data.error || `HTTP ${response.status}`);
+            }
+            
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            
+            while (true) {
+                const { done, value } = await reader.read();
+                if (done) break;
                 
-                if (data.success) {
-                    resultDiv.innerHTML = `✅ 结果: <code>${JSON.stringify(data.result, null, 2)}</code>`;
-                    resultDiv.className = 'tool-result success';
-                } else {
-                    resultDiv.innerHTML = `❌ 错误: ${data.error}`;
-                    resultDiv.className = 'tool-result error';
+                buffer += decoder.decode(value, { stream: true });
+                const events = buffer.split('\n\n');
+                buffer = events.pop();
+                
+                for (const line of events) {
+                    if (!line.startsWith('data: ')) continue;
+                    const event = JSON.parse(line.slice(6));
+                    if (event.type === 'tool_result') {
+                        renderToolResult(resultDivs[event.index], event);
+                    }
                 }
-            } catch (error) {
-                const resultDiv = toolResultItem.querySelector('.tool-result');
-                resultDiv.innerHTML = `❌ 执行失败: ${error.message}`;
-                resultDiv.className = 'tool-result error';
             }
+        } catch (error) {
+            resultDivs.forEach(resultDiv => {
+                if (resultDiv.className === 'tool-result') {
+                    resultDiv.innerHTML = `❌ 执行失败: ${error.message}`;
+                    resultDiv.className = 'tool-result error';
+                }
+            });
         }
         
         // 滚动到底部
@@ -1502,6 +1608,20 @@ async function autoParseAndExecuteTools(content, textDiv, messageDiv) {
     }
 }
 
+function renderToolResult(resultDiv, data) {
+    /**
+     * 显示单个工具调用的执行结果
+     */
+    if (!resultDiv) return;
+    if (data.success) {
+        resultDiv.innerHTML = `✅ 结果: <code>${JSON.stringify(data.result, null, 2)}</code>`;
+        resultDiv.className = 'tool-result success';
+    } else {
+        resultDiv.innerHTML = `❌ 错误: ${data.error}`;
+        resultDiv.className = 'tool-result error';
+    }
+}
+
 // ==================== MCP事件处理 ====================
 
 function handleMCPEvent(event, messageBody, statusDiv, textDiv, thinkingDiv, contentDiv) {
@@ -1515,6 +1635,16 @@ function handleMCPEvent(event, messageBody, statusDiv, textDiv, thinkingDiv, con
     const detailsBtn = messageBody.querySelector('.message-details-btn');
     
     switch (event.type) {
+        case 'tools_selected':
+            // 工具较多时服务端只发送相关的工具定义
+            addDetailsItem(detailsContent, {
+                type: 'info',
+                title: `🔎 已筛选 ${event.selected.length}/${event.total} 个相关工具（工具定义约 ${event.schema_tokens} → ${event.selected_schema_tokens} tokens）`,
+                content: event.selected.join(', '),
+                time: formatTime(event.timestamp)
+            });
+            break;
+            
         case 'iteration_start':
             // 新的迭代开始
             addDetailsItem(detailsContent, {
@@ -1546,11 +1676,12 @@ function handleMCPEvent(event, messageBody, statusDiv, textDiv, thinkingDiv, con
             break;
             
         case 'tool_call_start':
-            // 工具调用开始
+            // 工具调用开始（同一轮的调用可能并发执行，按调用 id 关联结果）
             const toolCallId = `tool-${Date.now()}-${Math.random()}`;
             addDetailsItem(detailsContent, {
                 type: 'tool_call',
                 id: toolCallId,
+                callId: event.id,
                 title: `🔧 调用工具: ${event.name}`,
                 content: `参数: ${JSON.stringify(event.arguments, null, 2)}`,
                 status: 'executing',
@@ -1567,15 +1698,16 @@ function handleMCPEvent(event, messageBody, statusDiv, textDiv, thinkingDiv, con
             
         case 'tool_call_complete':
             // 工具调用完成
-            updateLastToolCall(detailsContent, {
+            updateToolCall(detailsContent, event.id, {
                 status: event.success ? 'success' : 'error',
-                result: event.result
+                result: event.result,
+                cached: event.cached
             });
             break;
             
         case 'tool_call_error':
             // 工具调用失败
-            updateLastToolCall(detailsContent, {
+            updateToolCall(detailsContent, event.id, {
                 status: 'error',
                 error: event.error
             });
@@ -1598,6 +1730,24 @@ function handleMCPEvent(event, messageBody, statusDiv, textDiv, thinkingDiv, con
             }
             break;
             
+        case 'loop_detected':
+            // 检测到重复调用循环，提前结束
+            addDetailsItem(detailsContent, {
+                type: 'warning',
+                title: `⚠️ 检测到重复的工具调用 (${event.calls.join(', ')})，已提前结束`,
+                time: formatTime(event.timestamp)
+            });
+            break;
+            
+        case 'budget_exceeded':
+            // token 预算用尽
+            addDetailsItem(detailsContent, {
+                type: 'warning',
+                title: `⚠️ 已用尽 token 预算 (${event.tokens_used}/${event.token_budget})`,
+                time: formatTime(event.timestamp)
+            });
+            break;
+            
         case 'max_iterations_reached':
             // 达到最大迭代次数
             addDetailsItem(detailsContent, {
@@ -1616,6 +1766,7 @@ function addDetailsItem(container, item) {
     const itemDiv = document.createElement('div');
     itemDiv.className = `details-item details-${item.type}`;
     if (item.id) itemDiv.id = item.id;
+    if (item.callId) itemDiv.dataset.callId = item.callId;
     
     let html = `
         <div class="details-item-header">
@@ -1647,21 +1798,25 @@ function addDetailsItem(container, item) {
     container.appendChild(itemDiv);
 }
 
-function updateLastToolCall(container, update) {
+function updateToolCall(container, callId, update) {
     /**
-     * 更新最后一个工具调用的状态
+     * 更新工具调用的状态（按调用 id 查找，没有 id 时更新最后一个）
      */
     const toolCalls = container.querySelectorAll('.details-tool_call');
     if (toolCalls.length === 0) return;
     
-    const lastCall = toolCalls[toolCalls.length - 1];
-    let statusDiv = lastCall.querySelector('.details-item-status');
+    let targetCall = toolCalls[toolCalls.length - 1];
+    if (callId) {
+        const matched = Array.from(toolCalls).reverse().find(item => item.dataset.callId === callId);
+        if (matched) targetCall = matched;
+    }
+    let statusDiv = targetCall.querySelector('.details-item-status');
     
     // 如果没有status div，创建一个
     if (!statusDiv) {
         statusDiv = document.createElement('div');
         statusDiv.className = 'details-item-status';
-        lastCall.appendChild(statusDiv);
+        targetCall.appendChild(statusDiv);
     }
     
     if (statusDiv) {
@@ -1671,7 +1826,7 @@ function updateLastToolCall(container, update) {
             // 显示完整的函数返回结果
             const resultHtml = `
                 <div style="margin-top: 0.5rem;">
-                    <strong>✅ 执行成功</strong>
+                    <strong>✅ 执行成功${update.cached ? '（缓存）' : ''}</strong>
                     <pre style="background: #f5f5f5; padding: 0.5rem; border-radius: 0.25rem; overflow-x: auto; margin-top: 0.25rem;">${escapeHtml(JSON.stringify(update.result, null, 2))}</pre>
                 </div>
             `;
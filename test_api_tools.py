@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+测试外部 API 工具执行器
+验证 Cache-Control 新鲜度、ETag 条件请求（304）、no-store、按工具配置的超时与重试，以及并发调用共享连接
+"""
+
+import json
+import time
+import logging
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from concurrent.futures import ThreadPoolExecutor
+
+from api_tools import ApiToolExecutor, freshness_lifetime, parse_cache_control
+
+
+class Handler(BaseHTTPRequestHandler):
+    """测试用工具 API"""
+
+    hits = {}
+    not_modified = 0
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, body=None, headers=None):
+        data = json.dumps(body).encode('utf-8') if body is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        try:
+            self.wfile.write(data)
+        except BrokenPipeError:
+            pass  # 客户端已超时断开
+
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        Handler.hits[path] = Handler.hits.get(path, 0) + 1
+        if path == '/fresh':
+            self._reply(200, {'stock': 42}, {'Cache-Control': 'max-age=60'})
+        elif path == '/etag':
+            if self.headers.get('If-None-Match') == '"v1"':
+                Handler.not_modified += 1
+                self._reply(304, headers={'ETag': '"v1"'})
+            else:
+                self._reply(200, {'status': 'ok'}, {'Cache-Control': 'no-cache', 'ETag': '"v1"'})
+        elif path == '/nostore':
+            self._reply(200, {'n': Handler.hits[path]}, {'Cache-Control': 'no-store', 'ETag': '"x"'})
+        elif path == '/flaky':
+            self._reply(503 if Handler.hits[path] <= 2 else 200, {'ok': Handler.hits[path] > 2})
+        elif path == '/slow':
+            time.sleep(0.2)
+            self._reply(200, {'slow': True})
+        else:
+            self._reply(404, {})
+
+    def do_POST(self):
+        Handler.hits['POST'] = Handler.hits.get('POST', 0) + 1
+        length = int(self.headers.get('Content-Length') or 0)
+        self._reply(200, json.loads(self.rfile.read(length) or b'null'), {'ETag': '"p"'})
+
+
+def _server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def _tool(base, path, **extra):
+    return dict({'name': path.strip('/'), 'api_url': f'{base}{path}', 'api_method': 'GET'}, **extra)
+
+
+def test_freshness():
+    """测试 Cache-Control / Expires 解析"""
+    print("=== 测试1: 缓存策略解析 ===")
+    assert parse_cache_control('public, max-age=60, no-cache="Set-Cookie"') == {
+        'public': None, 'max-age': '60', 'no-cache': 'Set-Cookie'
+    }
+    assert freshness_lifetime({'cache-control': 'max-age=60', 'age': '10'}) == (True, 50.0)
+    assert freshness_lifetime({'cache-control': 'no-store, max-age=60'}) == (False, 0.0)
+    assert freshness_lifetime({'cache-control': 'no-cache, max-age=60'}) == (True, 0.0)
+    assert freshness_lifetime({
+        'expires': 'Thu, 01 Jan 2026 00:01:00 GMT', 'date': 'Thu, 01 Jan 2026 00:00:00 GMT'
+    }) == (True, 60.0)
+    assert freshness_lifetime({'expires': '0'}) == (True, 0.0)
+    print("  ✓ 缓存策略解析通过\n")
+
+
+def test_http_cache():
+    """测试新鲜响应直接复用、ETag 条件请求和 no-store"""
+    print("=== 测试2: HTTP 缓存 ===")
+    server, base = _server()
+    executor = ApiToolExecutor()
+    try:
+        tool = _tool(base, '/fresh')
+        assert executor.call(tool, {'sku': 'A1'}) == {'success': True, 'result': {'stock': 42}}
+        assert executor.call(tool, {'sku': 'A1'}) == {'success': True, 'result': {'stock': 42}, 'cached': True}
+        executor.call(tool, {'sku': 'B2'})  # 参数不同，分别缓存
+        assert Handler.hits['/fresh'] == 2
+
+        tool = _tool(base, '/etag')
+        executor.call(tool, {})
+        result = executor.call(tool, {})
+        assert result == {'success': True, 'result': {'status': 'ok'}, 'cached': True}
+        assert Handler.hits['/etag'] == 2 and Handler.not_modified == 1
+
+        tool = _tool(base, '/nostore')
+        assert executor.call(tool, {})['result'] == {'n': 1}
+        assert executor.call(tool, {})['result'] == {'n': 2}
+
+        # POST 响应没有明确的有效期时不缓存
+        post = {'name': 'echo', 'api_url': f'{base}/echo', 'api_method': 'POST'}
+        assert executor.call(post, {'q': 1})['result'] == {'q': 1}
+        executor.call(post, {'q': 1})
+        assert Handler.hits['POST'] == 2
+
+        stats = executor.stats()
+        assert stats['hits'] == 1 and stats['revalidated'] == 1 and stats['entries'] == 3
+    finally:
+        server.shutdown()
+    print("  ✓ HTTP 缓存通过\n")
+
+
+def test_timeout_and_retries():
+    """测试工具配置的超时和重试"""
+    print("=== 测试3: 超时与重试 ===")
+    server, base = _server()
+    executor = ApiToolExecutor()
+    try:
+        result = executor.call(_tool(base, '/slow', timeout=0.05), {})
+        assert result == {'success': False, 'error': '工具API调用超时（0.05s）'}
+
+        result = executor.call(_tool(base, '/flaky', retries=1, retry_backoff=0.01), {})
+        assert result == {'success': False, 'error': '工具API调用失败: HTTP 503'}
+        Handler.hits['/flaky'] = 0
+        result = executor.call(_tool(base, '/flaky', retries=2, retry_backoff=0.01), {})
+        assert result == {'success': True, 'result': {'ok': True}}
+
+        result = executor.call(dict(_tool(base, '/fresh'), api_method='DELETE'), {})
+        assert result == {'success': False, 'error': '不支持的HTTP方法: DELETE'}
+        assert executor.stats()['retries'] == 3
+
+        # timeout 是整次调用的截止时间：剩余时间不够等待时不再重试
+        Handler.hits['/flaky'] = 0
+        start = time.perf_counter()
+        result = executor.call(_tool(base, '/flaky', retries=5, retry_backoff=0.2, timeout=0.5), {})
+        assert result == {'success': False, 'error': '工具API调用失败: HTTP 503'}
+        assert time.perf_counter() - start < 0.5 and Handler.hits['/flaky'] == 2
+
+        # 调用方给出的时间上限（隔离舱剩余时间）同样包括重试
+        start = time.perf_counter()
+        result = executor.call(_tool(base, '/slow', retries=3, retry_backoff=0.01), {}, timeout=0.15)
+        assert result == {'success': False, 'error': '工具API调用超时（30s）'}
+        assert time.perf_counter() - start < 0.25
+
+        # 可重试的状态码决定重试后，截止时间在下一次请求前用完：返回最后一次的错误
+        class SlowRetryLog(logging.Handler):
+            def emit(self, record):
+                if 'API返回 HTTP' in record.getMessage():
+                    time.sleep(0.35)
+
+        handler = SlowRetryLog()
+        logging.getLogger('api_tools').addHandler(handler)
+        try:
+            Handler.hits['/flaky'] = 0
+            result = executor.call(_tool(base, '/flaky', retries=3, retry_backoff=0.2, timeout=0.5), {})
+        finally:
+            logging.getLogger('api_tools').removeHandler(handler)
+        assert result == {'success': False, 'error': '工具API调用失败: HTTP 503'}
+        assert Handler.hits['/flaky'] == 1
+    finally:
+        server.shutdown()
+    print("  ✓ 超时与重试通过\n")
+
+
+def test_fan_out():
+    """测试多个线程的并发调用在后台事件循环上同时进行"""
+    print("=== 测试4: 并发调用 ===")
+    server, base = _server()
+    executor = ApiToolExecutor()
+    try:
+        tool = _tool(base, '/slow')
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=10) as pool:
+            results = list(pool.map(lambda i: executor.call(tool, {'i': i}), range(10)))
+        elapsed = time.perf_counter() - start
+        assert all(result['success'] for result in results)
+        assert elapsed < 10 * 0.2 * 0.75, f"10 个 200ms 的调用耗时 {elapsed:.2f}s，没有并发执行"
+        print(f"  10 个 200ms 的调用并发耗时 {elapsed * 1000:.0f}ms，连接池 {executor.stats()['hosts']} 个")
+    finally:
+        server.shutdown()
+    print("  ✓ 并发调用通过\n")
+
+
+def main():
+    """运行所有测试"""
+    print("\n" + "="*60)
+    print("外部 API 工具执行器测试")
+    print("="*60 + "\n")
+
+    test_freshness()
+    test_http_cache()
+    test_timeout_and_retries()
+    test_fan_out()
+
+    print("="*60)
+    print("✓ 所有测试通过")
+    print("="*60)
+
+
+if __name__ == '__main__':
+    main()
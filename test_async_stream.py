@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+"""
+测试异步协调器
+验证异步模型流/异步工具、同步驱动接口以及客户端断开时模型流和工具的取消
+"""
+
+import time
+import asyncio
+from mcp import MCPCoordinator
+
+TOOL_CALL_RESPONSE = [
+    {'type': 'status', 'status': 'thinking'},
+    {'type': 'content', 'content': '<tool_call>{"name": "get_current_time", "arguments": {}}</tool_call>'},
+    {'type': 'done'}
+]
+FINAL_RESPONSE = [
+    {'type': 'content', 'content': '现在是 14:30'},
+    {'type': 'done'}
+]
+
+
+def _responses_for(messages):
+    """第一轮返回工具调用，拿到工具结果后返回最终回答"""
+    return FINAL_RESPONSE if len(messages) > 1 else TOOL_CALL_RESPONSE
+
+
+async def async_model_caller(messages, tools, params):
+    for chunk in _responses_for(messages):
+        await asyncio.sleep(0)
+        yield chunk
+
+
+async def async_tool_executor(tool_name, tool_args):
+    await asyncio.sleep(0)
+    return {'success': True, 'result': {'time': '14:30'}}
+
+
+def sync_tool_executor(tool_name, tool_args):
+    return {'success': True, 'result': {'time': '14:30'}}
+
+
+def test_async_coordinate():
+    """测试异步模型流 + 异步工具"""
+    print("=== 测试1: 异步协调 ===")
+    mcp = MCPCoordinator(async_model_caller, async_tool_executor)
+
+    async def collect():
+        return [event async for event in mcp.acoordinate_stream(
+            [{'role': 'user', 'content': '现在几点？'}], [], {}, auto_parse=True
+        )]
+
+    events = asyncio.run(collect())
+    types = [event['type'] for event in events]
+    assert 'tool_call_complete' in types
+    assert types[-1] == 'done'
+    assert ''.join(e['content'] for e in events if e['type'] == 'content').endswith('现在是 14:30')
+    print(f"  ✓ 共收到 {len(events)} 个事件\n")
+
+
+def test_sync_driver_with_async_caller():
+    """测试同步接口驱动异步模型流，同步工具在线程池中执行"""
+    print("=== 测试2: 同步接口 ===")
+    mcp = MCPCoordinator(async_model_caller, sync_tool_executor)
+    events = list(mcp.coordinate_stream(
+        [{'role': 'user', 'content': '现在几点？'}], [], {}, auto_parse=True
+    ))
+    complete = [e for e in events if e['type'] == 'tool_call_complete']
+    assert len(complete) == 1 and complete[0]['success']
+    assert events[-1]['type'] == 'done'
+    print("  ✓ 同步接口测试通过\n")
+
+
+def test_early_close_releases_model_stream():
+    """测试客户端提前断开时模型流被关闭"""
+    print("=== 测试3: 提前关闭 ===")
+    closed = []
+
+    def slow_model_caller(messages, tools, params):
+        try:
+            for i in range(100):
+                yield {'type': 'content', 'content': f'片段{i} '}
+        finally:
+            closed.append(True)
+
+    mcp = MCPCoordinator(slow_model_caller, sync_tool_executor)
+    stream = mcp.coordinate_stream([{'role': 'user', 'content': '你好'}], [], {})
+    for event in stream:
+        if event['type'] == 'content':
+            break
+    stream.close()
+    assert closed == [True], "模型流应在断开时关闭"
+    print("  ✓ 提前关闭测试通过\n")
+
+
+def test_disconnect_cancels_running_tool():
+    """测试工具执行期间发送 keepalive，断开后取消进行中的工具"""
+    print("=== 测试4: 断开时取消工具 ===")
+    cancelled = []
+
+    async def slow_tool_executor(tool_name, tool_args):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(tool_name)
+            raise
+
+    mcp = MCPCoordinator(async_model_caller, slow_tool_executor)
+    mcp.keepalive_interval = 0.05
+
+    async def run():
+        events = mcp.acoordinate_stream([{'role': 'user', 'content': '现在几点？'}], [], {}, auto_parse=True)
+        async for event in events:
+            if event['type'] == 'keepalive':
+                break
+        await events.aclose()
+        await asyncio.sleep(0)
+
+    asyncio.run(run())
+    assert cancelled == ['get_current_time'], "断开后应取消进行中的工具"
+    print("  ✓ 断开取消测试通过\n")
+
+
+def test_native_tool_calls():
+    """测试原生函数调用事件：无需 auto_parse，结果按函数调用协议回传"""
+    print("=== 测试5: 原生函数调用 ===")
+    seen_messages = []
+
+    async def native_model_caller(messages, tools, params):
+        seen_messages.append(list(messages))
+        if len(messages) == 1:
+            yield {'type': 'status', 'status': 'function_calling'}
+            yield {'type': 'tool_calls', 'format': 'openai', 'calls': [
+                {'id': 'call_abc', 'name': 'get_current_time', 'arguments': {'timezone': 'UTC'}}
+            ]}
+        else:
+            yield {'type': 'content', 'content': '现在是 14:30'}
+        yield {'type': 'done'}
+
+    mcp = MCPCoordinator(native_model_caller, sync_tool_executor)
+    events = list(mcp.coordinate_stream([{'role': 'user', 'content': '现在几点？'}], [], {}, auto_parse=False))
+
+    parsed = [e for e in events if e['type'] == 'tool_calls_parsed']
+    assert len(parsed) == 1 and parsed[0]['native']
+    assert any(e['type'] == 'tool_call_complete' for e in events)
+
+    second_turn = seen_messages[1]
+    assert second_turn[1]['tool_calls'][0]['id'] == 'call_abc'
+    assert second_turn[2] == {
+        'role': 'tool', 'tool_call_id': 'call_abc',
+        'content': '{"success":true,"result":{"time":"14:30"}}'
+    }
+    assert events[-1]['type'] == 'done'
+    print("  ✓ 原生函数调用测试通过\n")
+
+
+def test_eager_tool_dispatch():
+    """测试工具调用闭合后立即执行，不等模型输出结束"""
+    print("=== 测试6: 提前执行工具 ===")
+    order = []
+
+    async def streaming_model_caller(messages, tools, params):
+        if len(messages) > 1:
+            yield {'type': 'content', 'content': '现在是 14:30'}
+            yield {'type': 'done'}
+            return
+        yield {'type': 'content', 'content': '<tool_call>{"name": "get_current_time", '}
+        yield {'type': 'content', 'content': '"arguments": {}}</tool_call>'}
+        for _ in range(5):
+            await asyncio.sleep(0.01)
+        order.append('model_done')
+        yield {'type': 'content', 'content': '稍等'}
+        yield {'type': 'done'}
+
+    async def recording_tool_executor(tool_name, tool_args):
+        order.append('tool_start')
+        return {'success': True, 'result': {'time': '14:30'}}
+
+    mcp = MCPCoordinator(streaming_model_caller, recording_tool_executor)
+    events = list(mcp.coordinate_stream([{'role': 'user', 'content': '现在几点？'}], [], {}, auto_parse=True))
+
+    assert order == ['tool_start', 'model_done'], order
+    complete = [e for e in events if e['type'] == 'tool_call_complete']
+    assert len(complete) == 1, "同一个调用只执行一次"
+    assert events[-1]['type'] == 'done'
+    print("  ✓ 提前执行测试通过\n")
+
+
+def test_eager_dispatch_only_final_calls():
+    """测试 thinking 中的调用和被完整调用取代的函数调用不会提前执行"""
+    print("=== 测试7: 只提前执行最终的调用 ===")
+    executed = []
+
+    async def model_caller(messages, tools, params):
+        if len(messages) > 1:
+            yield {'type': 'content', 'content': '现在是 14:30'}
+            yield {'type': 'done'}
+            return
+        yield {'type': 'content', 'content': '<think>先试 get_current_time({"tz": "think"})'}
+        yield {'type': 'content', 'content': '</think>get_current_time({"tz": "local"}) 不对，'}
+        yield {'type': 'content', 'content': '<tool_call>{"name": "get_current_time", "arguments": {"tz": "UTC"}}</tool_call>'}
+        yield {'type': 'done'}
+
+    async def recording_tool_executor(tool_name, tool_args):
+        executed.append(tool_args)
+        return {'success': True, 'result': {'time': '14:30'}}
+
+    mcp = MCPCoordinator(model_caller, recording_tool_executor)
+    events = list(mcp.coordinate_stream([{'role': 'user', 'content': '现在几点？'}], [], {}, auto_parse=True))
+
+    assert executed == [{'tz': 'UTC'}], executed
+    assert len([e for e in events if e['type'] == 'tool_call_complete']) == 1
+    assert events[-1]['type'] == 'done'
+    print("  ✓ 只提前执行最终调用通过\n")
+
+
+def test_early_stop():
+    """测试 early_stop：收到完整调用后关闭模型流，并传入停止序列"""
+    print("=== 测试8: 提前结束模型输出 ===")
+    closed = []
+    seen_params = []
+
+    def long_model_caller(messages, tools, params):
+        seen_params.append(params)
+        if len(messages) > 1:
+            yield {'type': 'content', 'content': '现在是 14:30'}
+            yield {'type': 'done'}
+            return
+        try:
+            yield {'type': 'content', 'content': '<tool_call>{"name": "get_current_time", "arguments": {}}</tool_call>'}
+            for i in range(100):
+                yield {'type': 'content', 'content': f'多余内容{i}'}
+        finally:
+            closed.append(True)
+
+    mcp = MCPCoordinator(long_model_caller, sync_tool_executor)
+    events = list(mcp.coordinate_stream(
+        [{'role': 'user', 'content': '现在几点？'}], [], {}, auto_parse=True, early_stop=True
+    ))
+
+    assert closed == [True]
+    assert seen_params[0]['stop'] == ['</tool_call>']
+    content = ''.join(e['content'] for e in events if e['type'] == 'content')
+    assert '多余内容' not in content
+    assert sum(1 for e in events if e['type'] == 'tool_call_complete') == 1
+    print("  ✓ 提前结束测试通过\n")
+
+
+def test_parallel_tools():
+    """测试同一轮的多个工具并发执行，结果按原始顺序回传，单个工具的 max_parallel 生效"""
+    print("=== 测试9: 并发执行工具 ===")
+    reply = ''.join(
+        f'<tool_call>{{"name": "{name}", "arguments": {{"n": {n}}}}}</tool_call>'
+        for n, name in enumerate(['slow_api', 'slow_api', 'other_api'])
+    )
+    seen_messages = []
+
+    async def multi_model_caller(messages, tools, params):
+        seen_messages.append(list(messages))
+        yield {'type': 'content', 'content': '完成' if len(messages) > 1 else reply}
+        yield {'type': 'done'}
+
+    running = {'now': 0, 'peak': 0}
+
+    async def timed_tool_executor(tool_name, tool_args):
+        running['now'] += 1
+        running['peak'] = max(running['peak'], running['now'])
+        # 第一个调用最慢，验证结果仍按调用顺序排列
+        await asyncio.sleep(0.2 if tool_args['n'] == 0 else 0.05)
+        running['now'] -= 1
+        return {'success': True, 'result': tool_args['n']}
+
+    tools = [{'name': 'slow_api', 'max_parallel': 1}, {'name': 'other_api'}]
+    mcp = MCPCoordinator(multi_model_caller, timed_tool_executor)
+
+    async def collect():
+        return [event async for event in mcp.acoordinate_stream(
+            [{'role': 'user', 'content': '查询'}], tools, {}, auto_parse=True
+        )]
+
+    start = time.perf_counter()
+    events = asyncio.run(collect())
+    elapsed = time.perf_counter() - start
+
+    # slow_api 限制为 1 个并发：0.2 + 0.05；other_api 与之并行
+    assert 0.24 <= elapsed < 0.4, elapsed
+    assert running['peak'] == 2
+
+    starts = [e for e in events if e['type'] == 'tool_call_start']
+    completes = [e for e in events if e['type'] == 'tool_call_complete']
+    assert sorted(e['index'] for e in starts) == [0, 1, 2]
+    assert [e['index'] for e in completes] == [2, 0, 1], "完成事件按实际完成顺序发送"
+    for complete in completes:
+        start_pos = events.index(next(e for e in starts if e['id'] == complete['id']))
+        assert start_pos < events.index(complete)
+
+    results = [e for e in events if e['type'] == 'iteration_complete'][0]['tool_results']
+    assert [r['result']['result'] for r in results] == [0, 1, 2], "结果按原始调用顺序回传"
+    assert seen_messages[1][-1]['content'].index('"result":0') < seen_messages[1][-1]['content'].index('"result":2')
+
+    # 请求级并发限制为 1 时串行执行
+    running['peak'] = 0
+
+    async def collect_serial():
+        return [event async for event in mcp.acoordinate_stream(
+            [{'role': 'user', 'content': '查询'}], tools, {}, auto_parse=True, max_parallel_tools=1
+        )]
+
+    asyncio.run(collect_serial())
+    assert running['peak'] == 1
+    print(f"  ✓ 并发执行测试通过（耗时 {elapsed:.2f}s）\n")
+
+
+def main():
+    """运行所有测试"""
+    print("\n" + "="*60)
+    print("异步协调器测试")
+    print("="*60 + "\n")
+
+    test_async_coordinate()
+    test_sync_driver_with_async_caller()
+    test_early_close_releases_model_stream()
+    test_disconnect_cancels_running_tool()
+    test_native_tool_calls()
+    test_eager_tool_dispatch()
+    test_eager_dispatch_only_final_calls()
+    test_early_stop()
+    test_parallel_tools()
+
+    print("="*60)
+    print("✓ 所有测试通过")
+    print("="*60)
+
+
+if __name__ == '__main__':
+    main()
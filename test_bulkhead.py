@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+测试工具隔离舱
+验证按工具的并发上限、有限排队与快速拒绝、排队截止时间、剩余时间作为执行超时，以及慢工具不影响其他工具
+"""
+
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from bulkhead import ToolBulkheads
+
+
+def _slow(seconds, counter=None):
+    def execute(timeout):
+        if counter is not None:
+            with counter['lock']:
+                counter['now'] += 1
+                counter['max'] = max(counter['max'], counter['now'])
+        time.sleep(seconds)
+        if counter is not None:
+            with counter['lock']:
+                counter['now'] -= 1
+        return {'success': True, 'result': timeout}
+    return execute
+
+
+def test_concurrency_limit():
+    """测试同时执行的调用数不超过 max_concurrency，其余排队后依次执行"""
+    print("=== 测试1: 并发上限 ===")
+    bulkheads = ToolBulkheads()
+    config = {'name': 'inventory', 'max_concurrency': 2, 'max_queue': 10}
+    counter = {'lock': threading.Lock(), 'now': 0, 'max': 0}
+    with ThreadPoolExecutor(max_workers=6) as pool:
+        results = list(pool.map(lambda _: bulkheads.run('inventory', config, _slow(0.05, counter)), range(6)))
+    assert all(result['success'] for result in results)
+    assert counter['max'] == 2
+    stats = bulkheads.stats()['tools']['inventory']
+    assert stats['calls'] == 6 and stats['peak'] == 2 and stats['saturated'] == 4 and stats['active'] == 0
+    print("  ✓ 并发上限通过\n")
+
+
+def test_fast_rejection():
+    """测试排队已满时立即拒绝"""
+    print("=== 测试2: 快速拒绝 ===")
+    bulkheads = ToolBulkheads()
+    config = {'name': 'slow_api', 'max_concurrency': 1, 'max_queue': 1}
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        pool.submit(bulkheads.run, 'slow_api', config, _slow(0.3))
+        time.sleep(0.05)
+        pool.submit(bulkheads.run, 'slow_api', config, _slow(0.01))  # 排队
+        time.sleep(0.05)
+        start = time.perf_counter()
+        result = bulkheads.run('slow_api', config, _slow(0.01))
+        elapsed = time.perf_counter() - start
+    assert result == {'success': False, 'error': '工具 slow_api 繁忙（并发上限 1，排队已满），请稍后重试'}
+    assert elapsed < 0.05
+    stats = bulkheads.stats()
+    assert stats['rejected'] == 1 and stats['tools']['slow_api']['rejected'] == 1
+    print(f"  拒绝耗时 {elapsed * 1000:.2f}ms")
+    print("  ✓ 快速拒绝通过\n")
+
+
+def test_deadline():
+    """测试排队超过截止时间，以及剩余时间作为执行超时"""
+    print("=== 测试3: 截止时间 ===")
+    bulkheads = ToolBulkheads(timeout=5)
+    config = {'name': 'report', 'max_concurrency': 1, 'timeout': 0.1}
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        pool.submit(bulkheads.run, 'report', config, _slow(0.3))
+        time.sleep(0.02)
+        result = bulkheads.run('report', config, _slow(0.01))
+    assert result == {'success': False, 'error': '工具 report 排队超时（0.1s）'}
+    assert bulkheads.stats()['tools']['report']['timeouts'] == 1
+
+    # 执行函数拿到截止前的剩余时间，工具没有配置 timeout 时按默认截止时间计算
+    remaining = bulkheads.run('report', config, _slow(0))['result']
+    assert 0 < remaining <= 0.1
+    remaining = bulkheads.run('other', {'name': 'other'}, _slow(0))['result']
+    assert 4.9 < remaining <= 5
+    print("  ✓ 截止时间通过\n")
+
+
+def test_isolation():
+    """测试慢工具占满自己的隔离舱时，其他工具不受影响"""
+    print("=== 测试4: 工具隔离 ===")
+    bulkheads = ToolBulkheads()
+    slow = {'name': 'slow_api', 'max_concurrency': 2, 'max_queue': 0}
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        for _ in range(2):
+            pool.submit(bulkheads.run, 'slow_api', slow, _slow(0.3))
+        time.sleep(0.05)
+        assert bulkheads.run('slow_api', slow, _slow(0))['success'] is False
+        start = time.perf_counter()
+        result = bulkheads.run('calculate', {'name': 'calculate'}, _slow(0))
+        assert result['success'] and time.perf_counter() - start < 0.05
+    print("  ✓ 工具隔离通过\n")
+
+
+def test_async():
+    """测试异步版本排队时不阻塞事件循环"""
+    print("=== 测试5: 异步执行 ===")
+    bulkheads = ToolBulkheads()
+    config = {'name': 'api', 'max_concurrency': 1}
+
+    async def execute(timeout):
+        await asyncio.sleep(0.05)
+        return {'success': True, 'result': None}
+
+    async def run():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        task = asyncio.create_task(ticker())
+        results = await asyncio.gather(*(bulkheads.arun('api', config, execute) for _ in range(3)))
+        task.cancel()
+        return results, ticks
+
+    results, ticks = asyncio.run(run())
+    assert all(result['success'] for result in results)
+    assert bulkheads.stats()['tools']['api']['peak'] == 1
+    assert ticks >= 10, "排队期间事件循环仍在运行"
+    print("  ✓ 异步执行通过\n")
+
+
+def test_async_cancel():
+    """测试排队中的协程被取消、排队超时后不占用名额，也不占用线程"""
+    print("=== 测试6: 异步取消 ===")
+    bulkheads = ToolBulkheads()
+    config = {'name': 'api', 'max_concurrency': 1, 'timeout': 0.2}
+
+    async def execute(timeout):
+        await asyncio.sleep(0.05)
+        return {'success': True, 'result': None}
+
+    async def run():
+        running = asyncio.create_task(bulkheads.arun('api', config, execute))
+        await asyncio.sleep(0.01)
+        queued = [asyncio.create_task(bulkheads.arun('api', config, execute)) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        assert bulkheads.stats()['tools']['api']['waiting'] == 3
+        queued[0].cancel()
+        await running
+        queued[1].cancel()  # 名额已移交给它，可能已经开始执行
+        results = await asyncio.gather(*queued, return_exceptions=True)
+        assert isinstance(results[0], asyncio.CancelledError)
+        assert isinstance(results[1], asyncio.CancelledError) or results[1]['success']
+        assert results[2]['success']
+
+        # 归还名额后、移交生效前取消等待者
+        error, _ = await bulkheads.aacquire('api', config)
+        waiter = asyncio.create_task(bulkheads.arun('api', config, execute))
+        await asyncio.sleep(0.01)
+        bulkheads.release('api')
+        waiter.cancel()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            pass
+        assert error is None and bulkheads.stats()['tools']['api']['active'] == 0
+
+        # 排队超时
+        blocker = asyncio.create_task(bulkheads.arun('api', config, lambda timeout: asyncio.sleep(0.3, {'success': True})))
+        await asyncio.sleep(0.01)
+        result = await bulkheads.arun('api', config, execute)
+        assert result == {'success': False, 'error': '工具 api 排队超时（0.2s）'}
+        await blocker
+        return await bulkheads.arun('api', config, execute)
+
+    assert asyncio.run(run())['success']
+    stats = bulkheads.stats()['tools']['api']
+    assert stats['active'] == 0 and stats['waiting'] == 0 and stats['timeouts'] == 1
+    print("  ✓ 异步取消通过\n")
+
+
+def test_mixed_waiters():
+    """测试线程和协程在同一队列中排队，名额按顺序移交"""
+    print("=== 测试7: 线程与协程混合排队 ===")
+    bulkheads = ToolBulkheads()
+    config = {'name': 'api', 'max_concurrency': 1}
+    order = []
+
+    def record(name, seconds):
+        def execute(timeout):
+            order.append(name)
+            time.sleep(seconds)
+            return {'success': True, 'result': name}
+        return execute
+
+    async def arecord(timeout):
+        order.append('async')
+        return {'success': True, 'result': 'async'}
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        first = pool.submit(bulkheads.run, 'api', config, record('first', 0.1))
+        time.sleep(0.02)
+        loop_result = pool.submit(asyncio.run, bulkheads.arun('api', config, arecord))
+        time.sleep(0.02)
+        last = bulkheads.run('api', config, record('last', 0))
+        assert first.result()['success'] and loop_result.result()['success'] and last['success']
+    assert order == ['first', 'async', 'last']
+    assert bulkheads.stats()['tools']['api']['active'] == 0
+    print("  ✓ 混合排队通过\n")
+
+
+def main():
+    """运行所有测试"""
+    print("\n" + "="*60)
+    print("工具隔离舱测试")
+    print("="*60 + "\n")
+
+    test_concurrency_limit()
+    test_fast_rejection()
+    test_deadline()
+    test_isolation()
+    test_async()
+    test_async_cancel()
+    test_mixed_waiters()
+
+    print("="*60)
+    print("✓ 所有测试通过")
+    print("="*60)
+
+
+if __name__ == '__main__':
+    main()
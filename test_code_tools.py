@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+测试自定义代码工具的编译缓存
+验证代码对象按 (工具 id, 源码哈希) 复用、源码变化和重新注册后失效，以及编译错误只报告一次
+"""
+
+import time
+from code_tools import CodeToolCache, compile_code
+
+TOOL = {
+    'id': 'tool_1',
+    'name': 'sum_values',
+    'code': 'total = 0\nfor value in params["values"]:\n    total += value\nresult = {"sum": total}'
+}
+
+
+def test_compile_code():
+    """测试注册时的编译检查"""
+    print("=== 测试1: 编译检查 ===")
+    code, error = compile_code(TOOL['code'])
+    assert code is not None and error is None
+    code, error = compile_code('result = (1 +')
+    assert code is None and error.startswith('代码编译错误')
+    assert compile_code(None) == (None, '代码必须是字符串')
+    print(f"  错误信息: {error}")
+    print("  ✓ 编译检查通过\n")
+
+
+def test_cache_reuse():
+    """测试重复调用复用代码对象"""
+    print("=== 测试2: 代码对象复用 ===")
+    cache = CodeToolCache()
+    for _ in range(200):
+        result = cache.run(TOOL, {'values': [1, 2, 3]})
+    assert result == {'success': True, 'result': {'sum': 6}}
+    stats = cache.stats()
+    assert stats['misses'] == 1 and stats['hits'] == 199
+
+    # 配置字典被替换（注册表重新加载）但源码未变时仍命中
+    assert cache.get(dict(TOOL))[0] is cache.get(TOOL)[0]
+
+    start = time.perf_counter()
+    for _ in range(2000):
+        cache.run(TOOL, {'values': [1, 2, 3]})
+    cached = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(2000):
+        exec(TOOL['code'], {"__builtins__": {}}, {'params': {'values': [1, 2, 3]}, 'result': None})
+    uncached = time.perf_counter() - start
+    print(f"  2000 次调用: 缓存 {cached * 1000:.1f}ms，每次编译 {uncached * 1000:.1f}ms")
+    print("  ✓ 代码对象复用通过\n")
+
+
+def test_invalidation():
+    """测试源码变化和重新注册后使用新代码"""
+    print("=== 测试3: 失效 ===")
+    cache = CodeToolCache()
+    assert cache.run(TOOL, {'values': [1]})['result'] == {'sum': 1}
+
+    updated = dict(TOOL, code='result = {"sum": -1}')
+    assert cache.run(updated, {'values': [1]})['result'] == {'sum': -1}
+    assert cache.stats()['entries'] == 2
+
+    cache.invalidate('tool_1')
+    assert cache.stats()['entries'] == 0
+    cache.invalidate('missing')  # 不存在的工具不报错
+    print("  ✓ 失效通过\n")
+
+
+def test_compile_error_cached():
+    """测试存储中的错误代码只编译一次"""
+    print("=== 测试4: 编译错误缓存 ===")
+    cache = CodeToolCache()
+    broken = {'id': 'tool_2', 'name': 'broken', 'code': 'result = ('}
+    for _ in range(5):
+        result = cache.run(broken, {})
+    assert result['success'] is False and '代码编译错误' in result['error']
+    stats = cache.stats()
+    assert stats['misses'] == 1 and stats['compile_errors'] == 1 and stats['hits'] == 4
+    print("  ✓ 编译错误缓存通过\n")
+
+
+def test_lru():
+    """测试超过容量时淘汰最久未使用的条目"""
+    print("=== 测试5: LRU 淘汰 ===")
+    cache = CodeToolCache(max_entries=2)
+    tools = [{'id': f'tool_{i}', 'name': f't{i}', 'code': f'result = {i}'} for i in range(3)]
+    for tool in tools:
+        cache.run(tool, {})
+    assert cache.stats()['entries'] == 2
+    assert cache.run(tools[0], {})['result'] == 0
+    assert cache.stats()['misses'] == 4
+    print("  ✓ LRU 淘汰通过\n")
+
+
+def main():
+    """运行所有测试"""
+    print("\n" + "="*60)
+    print("自定义代码工具编译缓存测试")
+    print("="*60 + "\n")
+
+    test_compile_code()
+    test_cache_reuse()
+    test_invalidation()
+    test_compile_error_cached()
+    test_lru()
+
+    print("="*60)
+    print("✓ 所有测试通过")
+    print("="*60)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+测试模型/工具配置接口
+验证列表接口的 ETag 条件请求（命中时 304 且不返回响应体，写入后返回新的 ETag）、
+工具批量注册（校验错误、重名处理）、NDJSON 导出与重新导入，以及工具列表的分页 / 分类 / 搜索参数
+"""
+
+import os
+import json
+import tempfile
+
+import app as server
+from registry import ConfigRegistry
+
+
+def _client(tools=None, models=None):
+    """使用临时注册表的测试客户端"""
+    tmp_dir = tempfile.mkdtemp()
+    for name, items in (('tools', tools or []), ('models', models or [])):
+        with open(os.path.join(tmp_dir, f'{name}.json'), 'w', encoding='utf-8') as f:
+            json.dump(items, f, ensure_ascii=False)
+    server.tool_registry = ConfigRegistry(os.path.join(tmp_dir, 'tools.json'))
+    server.model_registry = ConfigRegistry(os.path.join(tmp_dir, 'models.json'))
+    return server.app.test_client()
+
+
+def _tool(name, **extra):
+    return dict({'name': name, 'description': f'{name} 的描述'}, **extra)
+
+
+def test_conditional_tools():
+    """测试工具列表的 ETag、304 和写入后的新 ETag"""
+    print("=== 测试1: 工具列表条件请求 ===")
+    client = _client()
+    response = client.get('/api/tools')
+    etag = response.headers['ETag']
+    assert response.status_code == 200 and etag
+    assert response.headers['Cache-Control'] == 'private, no-cache'
+    assert response.get_json() == {'success': True, 'tools': []}
+
+    response = client.get('/api/tools', headers={'If-None-Match': etag})
+    assert response.status_code == 304 and response.get_data() == b''
+    assert response.headers['ETag'] == etag
+
+    assert client.post('/api/tools/register', json=_tool('calculate')).get_json()['success']
+    response = client.get('/api/tools', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert [tool['name'] for tool in response.get_json()['tools']] == ['calculate']
+
+    # 分页查询的 ETag 与查询参数有关
+    page = client.get('/api/tools?limit=1')
+    other = client.get('/api/tools?limit=2')
+    assert page.headers['ETag'] != other.headers['ETag']
+    response = client.get('/api/tools?limit=1', headers={'If-None-Match': page.headers['ETag']})
+    assert response.status_code == 304 and response.get_data() == b''
+    print("  ✓ 工具列表条件请求通过\n")
+
+
+def test_conditional_models():
+    """测试模型列表的条件请求"""
+    print("=== 测试2: 模型列表条件请求 ===")
+    client = _client()
+    etag = client.get('/api/models').headers['ETag']
+    response = client.get('/api/models', headers={'If-None-Match': etag})
+    assert response.status_code == 304 and response.get_data() == b''
+
+    result = client.post('/api/models/register', json={'name': 'gpt', 'url': 'http://localhost:9/v1'}).get_json()
+    assert result['success'], result
+    response = client.get('/api/models', headers={'If-None-Match': etag})
+    assert response.status_code == 200 and response.headers['ETag'] != etag
+    assert [model['name'] for model in response.get_json()['models']] == ['gpt']
+    print("  ✓ 模型列表条件请求通过\n")
+
+
+def test_bulk_register():
+    """测试批量注册：逐项校验、批次内重名、已存在时跳过或覆盖"""
+    print("=== 测试3: 批量注册 ===")
+    client = _client([{'id': 'tool_1', 'name': 'calculate', 'description': '旧的描述', 'enabled': True}])
+    result = client.post('/api/tools/bulk', json={'tools': [
+        _tool('search_logs', category='ops'),
+        {'name': 'no_description'},
+        'not an object',
+        _tool('search_logs'),
+        _tool('calculate'),
+        _tool('broken_code', code='result = ('),
+    ]}).get_json()
+    assert result['success'] and result['created'] == 1 and result['replaced'] == 0
+    assert result['skipped'] == ['calculate']
+    assert [error['index'] for error in result['errors']] == [1, 2, 3, 5]
+    assert result['errors'][0]['error'] == '工具名称和描述不能为空'
+    assert result['errors'][1]['error'] == '工具定义必须是对象'
+    assert result['errors'][2]['error'] == '工具名称在本批次中重复: search_logs'
+    assert server.tool_registry.get_by_name('calculate')['description'] == '旧的描述'
+
+    # replace：保留原 id 和创建时间
+    result = client.post('/api/tools/bulk', json={'tools': [_tool('calculate')], 'on_conflict': 'replace'}).get_json()
+    assert result['success'] and result['replaced'] == 1 and result['created'] == 0
+    tool = server.tool_registry.get_by_name('calculate')
+    assert tool['id'] == 'tool_1' and tool['description'] == 'calculate 的描述' and 'updated_at' in tool
+
+    assert client.post('/api/tools/bulk', json={'tools': {}}).get_json() == {'success': False, 'error': 'tools 必须是数组'}
+    result = client.post('/api/tools/bulk', json={'tools': [], 'on_conflict': 'merge'}).get_json()
+    assert result == {'success': False, 'error': '不支持的 on_conflict: merge'}
+    assert len(server.tool_registry) == 2
+    print("  ✓ 批量注册通过\n")
+
+
+def test_export_round_trip():
+    """测试导出的 NDJSON 可以直接重新导入"""
+    print("=== 测试4: 导出与导入 ===")
+    client = _client()
+    tools = [_tool(f'tool_{i}', category='ops' if i % 2 else 'data', parameters={'type': 'object'}) for i in range(5)]
+    assert client.post('/api/tools/bulk', json={'tools': tools}).get_json()['created'] == 5
+
+    response = client.get('/api/tools/export')
+    assert response.mimetype == 'application/x-ndjson'
+    assert 'attachment' in response.headers['Content-Disposition']
+    lines = response.get_data(as_text=True).splitlines()
+    exported = [json.loads(line) for line in lines]
+    assert exported == server.tool_registry.all()
+
+    # 导入到新的注册表后内容一致；再次导入时全部跳过
+    client = _client()
+    body = '\n'.join(lines) + '\n'
+    result = client.post('/api/tools/bulk', data=body, content_type='application/x-ndjson').get_json()
+    assert result['success'] and result['created'] == 5 and not result['errors']
+    assert [(tool['name'], tool['category']) for tool in server.tool_registry.all()] == \
+        [(tool['name'], tool['category']) for tool in exported]
+    result = client.post('/api/tools/bulk?on_conflict=skip', data=body, content_type='application/x-ndjson').get_json()
+    assert result['created'] == 0 and len(result['skipped']) == 5
+    print("  ✓ 导出与导入通过\n")
+
+
+def test_paginated_query():
+    """测试 offset / limit / category / q 参数和总数"""
+    print("=== 测试5: 分页查询 ===")
+    client = _client()
+    tools = [_tool(f'report_{i}', category='ops' if i % 3 == 0 else 'data') for i in range(10)]
+    tools.append(_tool('search_logs', description='按关键字搜索应用日志', category='ops'))
+    client.post('/api/tools/bulk', json={'tools': tools})
+
+    data = client.get('/api/tools?offset=2&limit=3').get_json()
+    assert data['success'] and data['total'] == 11 and data['offset'] == 2 and data['limit'] == 3
+    assert [tool['name'] for tool in data['tools']] == ['report_2', 'report_3', 'report_4']
+    assert data['categories'] == ['data', 'ops']
+
+    data = client.get('/api/tools?category=ops&limit=2').get_json()
+    assert data['total'] == 5 and [tool['name'] for tool in data['tools']] == ['report_0', 'report_3']
+
+    data = client.get('/api/tools?q=日志').get_json()
+    assert data['total'] == 1 and data['tools'][0]['name'] == 'search_logs'
+    data = client.get('/api/tools?q=REPORT_1&category=data').get_json()
+    assert data['total'] == 1 and data['tools'][0]['name'] == 'report_1'
+
+    # 越界和非法参数
+    assert client.get('/api/tools?offset=50').get_json()['tools'] == []
+    assert client.get('/api/tools?limit=100000').get_json()['limit'] == server.TOOLS_PAGE_MAX_LIMIT
+    assert client.get('/api/tools?limit=x').get_json() == {'success': False, 'error': 'offset/limit 必须是整数'}
+    print("  ✓ 分页查询通过\n")
+
+
+def main():
+    """运行所有测试"""
+    print("\n" + "="*60)
+    print("配置接口测试")
+    print("="*60 + "\n")
+
+    test_conditional_tools()
+    test_conditional_models()
+    test_bulk_register()
+    test_export_round_trip()
+    test_paginated_query()
+
+    print("="*60)
+    print("✓ 所有测试通过")
+    print("="*60)
+
+
+if __name__ == '__main__':
+    main()
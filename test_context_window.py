@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+测试上下文窗口管理
+验证 token 估算、超出上下文窗口时的历史裁剪（保留系统提示词、固定消息和最近对话），以及工具消息成组保留
+"""
+
+from context_window import (
+    estimate_tokens, estimate_message_tokens, trim_messages, fit_context, MEDIA_TOKENS
+)
+
+
+def _history(turns):
+    messages = []
+    for i in range(turns):
+        messages.append({'role': 'user', 'content': f'第 {i} 个问题：' + '服务器状态' * 40})
+        messages.append({'role': 'assistant', 'content': f'第 {i} 个回答：' + '一切正常' * 40})
+    return messages
+
+
+def test_estimate():
+    """测试 token 估算"""
+    print("=== 测试1: token 估算 ===")
+    assert estimate_tokens('服务器状态') == 5
+    assert estimate_tokens('hello world!') == 3
+    assert estimate_tokens('') == 0
+
+    image = {'type': 'image_url', 'image_url': {'url': 'data:image/jpeg;base64,' + 'A' * 500000}}
+    message = {'role': 'user', 'content': [{'type': 'text', 'text': '这是什么'}, image]}
+    assert estimate_message_tokens(message) == 4 + MEDIA_TOKENS + 4, "图片按固定数量估算"
+    print("  ✓ token 估算通过\n")
+
+
+def test_no_trim_within_window():
+    """测试未超出窗口时消息不变"""
+    print("=== 测试2: 无需裁剪 ===")
+    messages = _history(3)
+    assert trim_messages(messages, 100000) == messages
+    pinned = [{'role': 'user', 'content': '记住：环境是生产', 'pinned': True}]
+    assert trim_messages(pinned, 100000) == [{'role': 'user', 'content': '记住：环境是生产'}], "pinned 标记不发给上游"
+    print("  ✓ 无需裁剪通过\n")
+
+
+def test_trim_keeps_system_pinned_and_latest():
+    """测试裁剪保留 system、pinned 和最近的消息"""
+    print("=== 测试3: 历史裁剪 ===")
+    messages = [{'role': 'system', 'content': '你是运维助手'}]
+    messages += _history(30)
+    messages[5]['pinned'] = True
+    messages.append({'role': 'user', 'content': '现在 CPU 使用率多少？'})
+
+    trimmed = trim_messages(messages, 2000)
+    total = sum(estimate_message_tokens(m) for m in trimmed)
+    assert total <= 2000, total
+    assert trimmed[0] == messages[0]
+    assert trimmed[-1] == messages[-1]
+    assert any(m['content'] == messages[5]['content'] and 'pinned' not in m for m in trimmed)
+    notices = [m for m in trimmed if '已省略' in str(m['content'])]
+    assert len(notices) == 1
+    # 最近的消息连续保留
+    assert trimmed[-2] == messages[-2] and trimmed[-3] == messages[-3]
+    print(f"  ✓ 历史裁剪通过（{len(messages)} → {len(trimmed)} 条）\n")
+
+
+def test_tool_messages_kept_together():
+    """测试工具调用和工具结果一起保留或一起省略"""
+    print("=== 测试4: 工具消息成组 ===")
+    messages = _history(10)
+    messages.append({'role': 'assistant', 'content': None, 'tool_calls': [
+        {'id': 'call_1', 'type': 'function', 'function': {'name': 'get_cpu', 'arguments': '{}'}}
+    ]})
+    messages.append({'role': 'tool', 'tool_call_id': 'call_1', 'content': '{"cpu":"35%"}' * 20})
+
+    trimmed = trim_messages(messages, 600)
+    assert trimmed[-1]['role'] == 'tool' and trimmed[-2].get('tool_calls'), "最新的工具调用和结果一起保留"
+    for index, message in enumerate(trimmed):
+        if message['role'] == 'tool':
+            assert trimmed[index - 1].get('tool_calls'), "工具结果前必须是对应的调用"
+    print("  ✓ 工具消息成组通过\n")
+
+
+def test_fit_context_budget():
+    """测试按模型配置计算预算：窗口 - 输出 - 系统提示词 - 工具定义"""
+    print("=== 测试5: 模型上下文窗口 ===")
+    messages = _history(20)
+    params = {'max_tokens': 1000}
+    small = fit_context({'context_window': 4000}, '你是运维助手', messages, [], params)
+    large = fit_context({'context_window': 200000}, '你是运维助手', messages, [], params)
+    assert len(small) < len(messages)
+    assert sum(estimate_message_tokens(m) for m in small) <= 3000
+    assert large == messages
+
+    tools = [{'name': 'get_cpu', 'description': '查询CPU' * 300, 'parameters': {}}]
+    with_tools = fit_context({'context_window': 4000}, '', messages, tools, params)
+    assert len(with_tools) < len(small), "工具定义占用预算"
+    print("  ✓ 模型上下文窗口通过\n")
+
+
+def main():
+    """运行所有测试"""
+    print("\n" + "="*60)
+    print("上下文窗口管理测试")
+    print("="*60 + "\n")
+
+    test_estimate()
+    test_no_trim_within_window()
+    test_trim_keeps_system_pinned_and_latest()
+    test_tool_messages_kept_together()
+    test_fit_context_budget()
+
+    print("="*60)
+    print("✓ 所有测试通过")
+    print("="*60)
+
+
+if __name__ == '__main__':
+    main()
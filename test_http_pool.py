@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+测试上游 HTTP 连接池
+验证同一上游的多次调用复用同一会话和 keep-alive 连接、连接池大小和统计来自配置（含环境变量），
+以及客户端断开时流式响应被关闭、连接归还连接池
+"""
+
+import os
+import sys
+import json
+import threading
+import subprocess
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import app as server
+from app import track_stream, call_model_stream
+from http_pool import UpstreamSessionPool, upstream_pool
+
+
+class _UpstreamHandler(BaseHTTPRequestHandler):
+    """记录每个请求使用的客户端端口；/stream 持续发送 SSE 直到客户端断开"""
+
+    protocol_version = 'HTTP/1.1'
+    client_ports = []
+    stream_closed = threading.Event()
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        self.client_ports.append(self.client_address[1])
+        if self.path.startswith('/stream'):
+            self._stream()
+            return
+        body = b'{"ok": true}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _stream(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        chunk = {'choices': [{'index': 0, 'delta': {'content': '片段'}}]}
+        try:
+            for _ in range(10000):
+                self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode('utf-8'))
+                self.wfile.flush()
+                threading.Event().wait(0.01)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            self.stream_closed.set()
+
+
+def _start_upstream():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), _UpstreamHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    _UpstreamHandler.client_ports = []
+    _UpstreamHandler.stream_closed = threading.Event()
+    return httpd, f"http://127.0.0.1:{httpd.server_address[1]}"
+
+
+def test_session_reused():
+    """测试同一上游复用会话和连接，不同上游使用不同会话"""
+    print("=== 测试1: 会话复用 ===")
+    httpd, base = _start_upstream()
+    try:
+        pool = UpstreamSessionPool(pool_maxsize=4)
+        session = pool.session_for(f'{base}/v1/chat/completions')
+        assert pool.session_for(f'{base}/other?x=1') is session
+        assert pool.session_for('http://127.0.0.1:9/v1') is not session
+        adapter = session.get_adapter(base)
+        assert session.get_adapter(base.replace('http://', 'https://')) is adapter
+
+        for _ in range(3):
+            response = pool.post(f'{base}/v1', json={'n': 1}, timeout=5)
+            assert response.json() == {'ok': True}
+        assert len(_UpstreamHandler.client_ports) == 3
+        assert len(set(_UpstreamHandler.client_ports)) == 1, "三次调用应复用同一条 keep-alive 连接"
+
+        stats = pool.stats()['upstreams'][base]
+        assert stats == {'in_use': 0, 'idle': 1, 'created': 1, 'requests': 3}, stats
+    finally:
+        httpd.shutdown()
+    print("  ✓ 会话复用通过\n")
+
+
+def test_pool_config():
+    """测试连接池大小、keep-alive 和统计来自配置"""
+    print("=== 测试2: 连接池配置 ===")
+    pool = UpstreamSessionPool(pool_maxsize=7, keep_alive=False)
+    session = pool.session_for('http://127.0.0.1:9/v1')
+    assert session.get_adapter('http://127.0.0.1:9')._pool_maxsize == 7
+    assert session.headers['Connection'] == 'close'
+    stats = pool.stats()
+    assert stats['pool_maxsize'] == 7 and stats['keep_alive'] is False and stats['http2'] is False
+    assert stats['upstreams']['http://127.0.0.1:9'] == {'in_use': 0, 'idle': 0, 'created': 0, 'requests': 0}
+
+    # 进程级共享实例从环境变量读取配置
+    env = dict(os.environ, UPSTREAM_POOL_SIZE='7', UPSTREAM_KEEPALIVE='0', UPSTREAM_ASYNC_MAX_CONNECTIONS='30')
+    code = (
+        "import json; from http_pool import upstream_pool, async_upstream; "
+        "print(json.dumps([upstream_pool.stats(), async_upstream.max_connections, async_upstream.keepalive_connections]))"
+    )
+    output = subprocess.run(
+        [sys.executable, '-c', code], env=env, capture_output=True, text=True, check=True,
+        cwd=os.path.dirname(os.path.abspath(__file__))
+    ).stdout
+    stats, max_connections, keepalive_connections = json.loads(output)
+    assert stats == {'pool_maxsize': 7, 'keep_alive': False, 'http2': False, 'upstreams': {}}
+    assert max_connections == 30 and keepalive_connections == 7
+
+    # /api/stats 报告共享连接池的状态
+    data = server.app.test_client().get('/api/stats').get_json()
+    assert data['upstream_pool']['pool_maxsize'] == upstream_pool.pool_maxsize
+    print("  ✓ 连接池配置通过\n")
+
+
+def test_stream_released_on_disconnect():
+    """测试客户端断开时流式响应被关闭，连接池的 in_use 计数归还"""
+    print("=== 测试3: 断开时释放流式响应 ===")
+    httpd, base = _start_upstream()
+    try:
+        model = {'id': 'model_1', 'name': 'gpt', 'url': f'{base}/stream/v1', 'api_key': 'k', 'model_type': 'openai'}
+        messages = [{'role': 'user', 'content': '你好'}]
+        stream = track_stream(call_model_stream(model, messages, [], {}))
+        events = [next(stream) for _ in range(3)]
+        assert events[-1] == {'type': 'content', 'content': '片段'}, events
+        assert upstream_pool.stats()['upstreams'][base]['in_use'] == 1
+
+        stream.close()  # WSGI 服务器在客户端断开时关闭响应迭代器
+        assert upstream_pool.stats()['upstreams'][base]['in_use'] == 0
+        assert _UpstreamHandler.stream_closed.wait(5), "上游连接应被关闭"
+    finally:
+        httpd.shutdown()
+    print("  ✓ 断开时释放流式响应通过\n")
+
+
+def main():
+    """运行所有测试"""
+    print("\n" + "="*60)
+    print("上游连接池测试")
+    print("="*60 + "\n")
+
+    test_session_reused()
+    test_pool_config()
+    test_stream_released_on_disconnect()
+
+    print("="*60)
+    print("✓ 所有测试通过")
+    print("="*60)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+测试MCP循环检测和预算
+验证重复调用复用结果并提醒模型、连续重复时提前结束，以及按请求设置的迭代轮数和 token 预算
+"""
+
+from mcp import MCPCoordinator, REPEATED_CALL_NOTE
+from context_window import estimate_tokens
+
+REPEAT_CALL = '<tool_call>{"name": "search_web", "arguments": {"q": "天气", "n": 3}}</tool_call>'
+# 同一调用，参数键顺序不同
+REPEAT_CALL_REORDERED = '<tool_call>{"name": "search_web", "arguments": {"n": 3, "q": "天气"}}</tool_call>'
+
+
+def _run(model_caller, tool_executor, **options):
+    mcp = MCPCoordinator(model_caller, tool_executor)
+    return list(mcp.coordinate_stream([{'role': 'user', 'content': '今天天气怎么样？'}], [], {}, True, **options))
+
+
+def test_repeated_calls_terminate_early():
+    """测试模型反复发起相同调用：复用结果并提醒，连续重复时提前结束"""
+    print("=== 测试1: 重复调用 ===")
+    executions = []
+    seen_messages = []
+
+    def looping_model(messages, tools, params):
+        seen_messages.append(list(messages))
+        yield {'type': 'content', 'content': REPEAT_CALL if len(messages) % 2 else REPEAT_CALL_REORDERED}
+        yield {'type': 'done'}
+
+    def tool_executor(tool_name, tool_args):
+        executions.append(tool_name)
+        return {'success': True, 'result': '晴'}
+
+    events = _run(looping_model, tool_executor)
+    types = [e['type'] for e in events]
+
+    assert executions == ['search_web'], "相同调用只执行一次"
+    assert len(seen_messages) == 3, "第三轮判定为循环，不再调用模型"
+    assert 'loop_detected' in types and types[-1] == 'done'
+    assert 'max_iterations_reached' not in types
+
+    repeated = [e for e in events if e['type'] == 'tool_call_complete' and e.get('repeated')]
+    assert len(repeated) == 2 and all(e['cached'] for e in repeated)
+    assert REPEATED_CALL_NOTE in seen_messages[2][-1]['content'], "第二轮的结果中应提醒模型"
+    print("  ✓ 重复调用测试通过\n")
+
+
+def test_failed_call_can_retry():
+    """测试失败的调用再次发起时正常执行"""
+    print("=== 测试2: 失败重试 ===")
+    executions = []
+
+    def retry_model(messages, tools, params):
+        yield {'type': 'content', 'content': REPEAT_CALL if len(messages) < 5 else '晴'}
+        yield {'type': 'done'}
+
+    def flaky_tool(tool_name, tool_args):
+        executions.append(tool_name)
+        if len(executions) == 1:
+            return {'success': False, 'error': '超时'}
+        return {'success': True, 'result': '晴'}
+
+    events = _run(retry_model, flaky_tool)
+    assert len(executions) == 2
+    assert 'loop_detected' not in [e['type'] for e in events]
+    assert events[-1]['type'] == 'done'
+    print("  ✓ 失败重试测试通过\n")
+
+
+def test_request_iteration_limit():
+    """测试按请求设置的最大迭代轮数"""
+    print("=== 测试3: 迭代轮数 ===")
+    calls = []
+
+    def counting_model(messages, tools, params):
+        calls.append(len(messages))
+        # 每轮参数不同，不会被判定为循环
+        yield {'type': 'content', 'content': f'<tool_call>{{"name": "step", "arguments": {{"i": {len(calls)}}}}}</tool_call>'}
+        yield {'type': 'done'}
+
+    events = _run(counting_model, lambda name, args: {'success': True, 'result': args['i']}, max_iterations=3)
+    assert len(calls) == 3
+    reached = [e for e in events if e['type'] == 'max_iterations_reached']
+    assert len(reached) == 1 and reached[0]['max_iterations'] == 3
+
+    # 最后一轮正常结束时不应再发送 max_iterations_reached
+    def answer_on_third(messages, tools, params):
+        yield {'type': 'content', 'content': REPEAT_CALL if len(messages) == 1 else (
+            '<tool_call>{"name": "other", "arguments": {}}</tool_call>' if len(messages) == 3 else '晴')}
+        yield {'type': 'done'}
+
+    events = _run(answer_on_third, lambda name, args: {'success': True, 'result': 1}, max_iterations=3)
+    types = [e['type'] for e in events]
+    assert 'max_iterations_reached' not in types and types.count('done') == 1
+    print("  ✓ 迭代轮数测试通过\n")
+
+
+def test_token_budget():
+    """测试 token 预算用尽后不再发起新一轮模型调用"""
+    print("=== 测试4: token 预算 ===")
+    assert estimate_tokens('天气') == 2
+    assert estimate_tokens('a' * 40) == 10
+
+    calls = []
+
+    def verbose_model(messages, tools, params):
+        calls.append(1)
+        yield {'type': 'content', 'content': '很长的分析' * 200}
+        yield {'type': 'content', 'content': f'<tool_call>{{"name": "step", "arguments": {{"i": {len(calls)}}}}}</tool_call>'}
+        yield {'type': 'done'}
+
+    events = _run(verbose_model, lambda name, args: {'success': True, 'result': 1}, token_budget=1500)
+    exceeded = [e for e in events if e['type'] == 'budget_exceeded']
+    assert len(calls) == 2, calls
+    assert len(exceeded) == 1 and exceeded[0]['tokens_used'] >= 1500
+    assert events[-1]['type'] == 'done'
+    print("  ✓ token 预算测试通过\n")
+
+
+def main():
+    """运行所有测试"""
+    print("\n" + "="*60)
+    print("MCP循环检测和预算测试")
+    print("="*60 + "\n")
+
+    test_repeated_calls_terminate_early()
+    test_failed_call_can_retry()
+    test_request_iteration_limit()
+    test_token_budget()
+
+    print("="*60)
+    print("✓ 所有测试通过")
+    print("="*60)
+
+
+if __name__ == '__main__':
+    main()
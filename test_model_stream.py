@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+测试上游流式响应解析
+验证 OpenAI delta.tool_calls 和 Claude tool_use / input_json_delta 的参数片段按索引累积，
+结束时输出带 format 的 tool_calls 事件，以及 call_model_stream 对真实 SSE 响应的处理
+"""
+
+import json
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from app import ModelStreamParser, call_model_stream
+
+
+def _sse(data):
+    return f"data: {json.dumps(data, ensure_ascii=False)}"
+
+
+def _openai_delta(**delta):
+    return _sse({'choices': [{'index': 0, 'delta': delta}]})
+
+
+def _tool_fragment(index, arguments=None, call_id=None, name=None):
+    function = {}
+    if name is not None:
+        function['name'] = name
+    if arguments is not None:
+        function['arguments'] = arguments
+    fragment = {'index': index, 'function': function}
+    if call_id is not None:
+        fragment.update(id=call_id, type='function')
+    return fragment
+
+
+# 两个调用的参数片段交错到达，id 和名称只在第一个片段中出现
+OPENAI_LINES = [
+    _openai_delta(role='assistant', content=''),
+    _openai_delta(content='我来查一下'),
+    _openai_delta(tool_calls=[_tool_fragment(0, '', 'call_a', 'get_weather')]),
+    _openai_delta(tool_calls=[_tool_fragment(0, '{"ci')]),
+    _openai_delta(tool_calls=[_tool_fragment(1, '', 'call_b', 'calculate')]),
+    _openai_delta(tool_calls=[_tool_fragment(0, 'ty": "北')]),
+    _openai_delta(tool_calls=[_tool_fragment(1, '{"expr": "1+')]),
+    _openai_delta(tool_calls=[_tool_fragment(0, '京"}')]),
+    _openai_delta(tool_calls=[_tool_fragment(1, '1"}')]),
+    _sse({'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'tool_calls'}]}),
+    '',
+    'data: [DONE]',
+]
+
+CLAUDE_LINES = [
+    'event: message_start',
+    _sse({'type': 'message_start', 'message': {'id': 'msg_1', 'role': 'assistant'}}),
+    _sse({'type': 'content_block_start', 'index': 0, 'content_block': {'type': 'text', 'text': ''}}),
+    _sse({'type': 'content_block_delta', 'index': 0, 'delta': {'type': 'text_delta', 'text': '好的'}}),
+    _sse({'type': 'content_block_stop', 'index': 0}),
+    _sse({'type': 'content_block_start', 'index': 1,
+          'content_block': {'type': 'tool_use', 'id': 'toolu_1', 'name': 'get_weather', 'input': {}}}),
+    _sse({'type': 'content_block_delta', 'index': 1, 'delta': {'type': 'input_json_delta', 'partial_json': ''}}),
+    _sse({'type': 'content_block_delta', 'index': 1, 'delta': {'type': 'input_json_delta', 'partial_json': '{"city":'}}),
+    _sse({'type': 'content_block_delta', 'index': 1, 'delta': {'type': 'input_json_delta', 'partial_json': ' "上海"}'}}),
+    _sse({'type': 'content_block_stop', 'index': 1}),
+    _sse({'type': 'content_block_start', 'index': 2,
+          'content_block': {'type': 'tool_use', 'id': 'toolu_2', 'name': 'get_time', 'input': {}}}),
+    _sse({'type': 'content_block_stop', 'index': 2}),
+    _sse({'type': 'message_delta', 'delta': {'stop_reason': 'tool_use'}}),
+    _sse({'type': 'message_stop'}),
+]
+
+
+def _parse(model_type, lines):
+    parser = ModelStreamParser({'model_type': model_type})
+    events = []
+    for line in lines:
+        events.extend(parser.feed(line))
+        if parser.finished:
+            break
+    return parser, events + parser.finish()
+
+
+def test_openai_fragments():
+    """测试 OpenAI 流中按 index 交错到达的参数片段"""
+    print("=== 测试1: OpenAI 工具调用片段 ===")
+    parser, events = _parse('openai', [line.encode('utf-8') for line in OPENAI_LINES])
+    assert parser.finished
+    assert [e for e in events if e['type'] == 'content'] == [{'type': 'content', 'content': '我来查一下'}]
+    statuses = [e['status'] for e in events if e['type'] == 'status']
+    assert statuses == ['answering', 'function_calling'], statuses
+    assert events[-2] == {
+        'type': 'tool_calls',
+        'format': 'openai',
+        'calls': [
+            {'id': 'call_a', 'name': 'get_weather', 'arguments': {'city': '北京'}},
+            {'id': 'call_b', 'name': 'calculate', 'arguments': {'expr': '1+1'}},
+        ]
+    }
+    assert events[-1] == {'type': 'done'}
+    print("  ✓ OpenAI 工具调用片段通过\n")
+
+
+def test_claude_fragments():
+    """测试 Claude 流中 tool_use 块和 input_json_delta 片段"""
+    print("=== 测试2: Claude 工具调用片段 ===")
+    parser, events = _parse('claude', CLAUDE_LINES)
+    assert parser.finished
+    assert [e['content'] for e in events if e['type'] == 'content'] == ['好的']
+    tool_calls = [e for e in events if e['type'] == 'tool_calls']
+    assert tool_calls == [{
+        'type': 'tool_calls',
+        'format': 'claude',
+        'calls': [
+            {'id': 'toolu_1', 'name': 'get_weather', 'arguments': {'city': '上海'}},
+            {'id': 'toolu_2', 'name': 'get_time', 'arguments': {}},
+        ]
+    }]
+    assert events[-1] == {'type': 'done'}
+    print("  ✓ Claude 工具调用片段通过\n")
+
+
+def test_invalid_arguments():
+    """测试参数片段拼接后不是 JSON 对象时的处理"""
+    print("=== 测试3: 无效参数 ===")
+    _, events = _parse('openai', [
+        _openai_delta(tool_calls=[_tool_fragment(0, '{"city": ', 'call_a', 'get_weather')]),
+        _openai_delta(tool_calls=[_tool_fragment(1, '[1, 2]', 'call_b', 'sum')]),
+        'data: [DONE]',
+    ])
+    calls = [e for e in events if e['type'] == 'tool_calls'][0]['calls']
+    assert calls[0]['arguments'] == {} and calls[1]['arguments'] == {'value': [1, 2]}
+
+    # 没有工具调用时只有内容和完成事件
+    _, events = _parse('openai', [_openai_delta(content='你好'), 'data: [DONE]'])
+    assert [e['type'] for e in events] == ['status', 'content', 'done']
+    print("  ✓ 无效参数通过\n")
+
+
+class _SSEHandler(BaseHTTPRequestHandler):
+    """按行分块发送预先准备的 SSE 数据"""
+
+    lines = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.end_headers()
+        for line in self.lines:
+            self.wfile.write(f"{line}\n\n".encode('utf-8'))
+            self.wfile.flush()
+        self.close_connection = True
+
+
+def test_call_model_stream():
+    """测试 call_model_stream 从真实 SSE 响应中组装工具调用"""
+    print("=== 测试4: 流式调用 ===")
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), _SSEHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{httpd.server_address[1]}"
+    messages = [{'role': 'user', 'content': '北京天气怎么样？'}]
+    try:
+        for model_type, lines, url, fmt in (
+            ('openai', OPENAI_LINES, f'{base}/v1', 'openai'),
+            ('claude', CLAUDE_LINES, f'{base}/v1/messages', 'claude'),
+        ):
+            _SSEHandler.lines = lines
+            model = {'id': f'model_{model_type}', 'name': model_type, 'url': url, 'api_key': 'k', 'model_type': model_type}
+            events = list(call_model_stream(model, messages, [], {}))
+            assert events[0] == {'type': 'status', 'status': 'thinking'}
+            tool_calls = [e for e in events if e['type'] == 'tool_calls']
+            assert len(tool_calls) == 1 and tool_calls[0]['format'] == fmt, events
+            assert [call['name'] for call in tool_calls[0]['calls']][0] == 'get_weather'
+            assert events[-1] == {'type': 'done'}
+    finally:
+        httpd.shutdown()
+    print("  ✓ 流式调用通过\n")
+
+
+def main():
+    """运行所有测试"""
+    print("\n" + "="*60)
+    print("上游流式响应解析测试")
+    print("="*60 + "\n")
+
+    test_openai_fragments()
+    test_claude_fragments()
+    test_invalid_arguments()
+    test_call_model_stream()
+
+    print("="*60)
+    print("✓ 所有测试通过")
+    print("="*60)
+
+
+if __name__ == '__main__':
+    main()
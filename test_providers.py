@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+测试模型服务商适配层
+验证各服务商的端点、认证头、工具定义格式和响应解析，以及按模型配置/工具集合的编译缓存
+"""
+
+from providers import get_adapter, CompiledModel, RequestCompiler
+
+TOOLS = [
+    {'name': 'get_time', 'description': '当前时间', 'parameters': {'type': 'object', 'properties': {}}},
+    {'name': 'calculate', 'description': '计算', 'parameters': {'type': 'object', 'properties': {'expr': {'type': 'string'}}}}
+]
+
+
+def test_adapters():
+    """测试各服务商的静态请求部分"""
+    print("=== 测试1: 服务商适配 ===")
+    openai = CompiledModel({'url': 'https://api.openai.com/v1/', 'api_key': 'sk-x', 'model_type': 'openai'})
+    assert openai.url == 'https://api.openai.com/v1/chat/completions'
+    assert openai.headers == {'Content-Type': 'application/json', 'Authorization': 'Bearer sk-x'}
+    assert openai.model_name == 'gpt-3.5-turbo'
+
+    claude = CompiledModel({'url': 'https://api.anthropic.com/v1/messages', 'api_key': 'k',
+                            'model_type': 'claude', 'actual_model_name': 'claude-sonnet'})
+    assert claude.url == 'https://api.anthropic.com/v1/messages'
+    assert claude.headers['x-api-key'] == 'k' and claude.headers['anthropic-version'] == '2023-06-01'
+    assert claude.model_name == 'claude-sonnet'
+    assert claude.adapter.stop_field == 'stop_sequences'
+
+    custom = CompiledModel({'url': 'http://local:8000/generate', 'model_type': 'custom'})
+    assert custom.url == 'http://local:8000/generate' and custom.model_name == 'default'
+    assert custom.headers == {'Content-Type': 'application/json'}
+
+    assert get_adapter('openai').tool_schema(TOOLS[0])['function']['name'] == 'get_time'
+    assert get_adapter('claude').tool_schema(TOOLS[1])['input_schema'] == TOOLS[1]['parameters']
+    print("  ✓ 服务商适配通过\n")
+
+
+def test_parse_response():
+    """测试非流式响应解析"""
+    print("=== 测试2: 响应解析 ===")
+    content, calls = get_adapter('openai').parse_response(
+        {'choices': [{'message': {'content': '你好', 'tool_calls': [{'id': 'c1'}]}}]}
+    )
+    assert content == '你好' and calls == [{'id': 'c1'}]
+
+    content, calls = get_adapter('claude').parse_response({'content': [
+        {'type': 'text', 'text': '查一下'},
+        {'type': 'tool_use', 'id': 't1', 'name': 'get_time', 'input': {}}
+    ]})
+    assert content == '查一下' and calls[0]['id'] == 't1'
+    print("  ✓ 响应解析通过\n")
+
+
+def test_compile_cache():
+    """测试模型配置和工具集合只编译一次，配置变化后重新编译"""
+    print("=== 测试3: 编译缓存 ===")
+    compiler = RequestCompiler()
+    model = {'id': 'm1', 'url': 'https://api.openai.com/v1', 'api_key': 'sk-x', 'model_type': 'openai'}
+
+    assert compiler.compile(model) is compiler.compile(model)
+    first = compiler.tools(model, TOOLS)
+    assert compiler.tools(model, TOOLS) is first, "同一工具集合返回同一个列表"
+    assert compiler.tools(model, TOOLS[:1]) is not first
+
+    # 注册表更新后配置是新的字典
+    updated = dict(model, api_key='sk-y')
+    assert compiler.compile(updated).headers['Authorization'] == 'Bearer sk-y'
+
+    claude = dict(model, model_type='claude')
+    assert 'input_schema' in compiler.tools(claude, TOOLS)[0], "不同服务商的工具格式分别缓存"
+
+    stats = compiler.stats()
+    assert stats['hits'] > 0 and stats['models'] == 3
+    print("  ✓ 编译缓存通过\n")
+
+
+def main():
+    """运行所有测试"""
+    print("\n" + "="*60)
+    print("模型服务商适配层测试")
+    print("="*60 + "\n")
+
+    test_adapters()
+    test_parse_response()
+    test_compile_cache()
+
+    print("="*60)
+    print("✓ 所有测试通过")
+    print("="*60)
+
+
+if __name__ == '__main__':
+    main()
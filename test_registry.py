@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+测试配置注册表
+验证索引查询、变更检测和写入后的缓存一致性
+"""
+
+import os
+import json
+import tempfile
+import threading
+
+from registry import ConfigRegistry, SQLiteConfigStore, create_registry
+
+
+def _make_registry(items):
+    tmp_dir = tempfile.mkdtemp()
+    path = os.path.join(tmp_dir, 'tools.json')
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(items, f, ensure_ascii=False)
+    return ConfigRegistry(path), path
+
+
+def test_lookup_by_id_and_name():
+    """测试按 id / name 查询"""
+    print("=== 测试1: 索引查询 ===")
+    registry, _ = _make_registry([
+        {'id': 'tool_1', 'name': 'calculate', 'enabled': True},
+        {'id': 'tool_2', 'name': 'search_web', 'enabled': False},
+    ])
+
+    assert registry.get('tool_2')['name'] == 'search_web'
+    assert registry.get_by_name('calculate')['id'] == 'tool_1'
+    assert registry.get('missing') is None
+    assert len(registry) == 2
+
+    # 批量查询保持注册顺序，忽略重复和不存在的 id
+    assert [item['id'] for item in registry.get_many(['tool_2', 'missing', 'tool_1', 'tool_2'])] == ['tool_1', 'tool_2']
+    print("  ✓ 索引查询测试通过\n")
+
+
+def test_reload_only_on_change():
+    """测试文件未变化时不重新加载，变化后自动加载"""
+    print("=== 测试2: 变更检测 ===")
+    registry, path = _make_registry([{'id': 'tool_1', 'name': 'calculate'}])
+
+    registry.all()
+    version = registry.version
+    registry.all()
+    registry.get('tool_1')
+    assert registry.version == version, "文件未变化时不应重新加载"
+
+    # 模拟其他进程修改了配置文件
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump([
+            {'id': 'tool_1', 'name': 'calculate'},
+            {'id': 'tool_9', 'name': 'external_tool_with_longer_name'},
+        ], f)
+
+    assert registry.get_by_name('external_tool_with_longer_name') is not None
+    assert registry.version > version
+    print("  ✓ 变更检测测试通过\n")
+
+
+def test_write_operations():
+    """测试写入后缓存和文件保持一致"""
+    print("=== 测试3: 写入操作 ===")
+    registry, path = _make_registry([])
+    etag = registry.etag
+    assert registry.etag == etag, "未修改时 ETag 应保持不变"
+
+    assert registry.add({'id': 'tool_1', 'name': 'calculate', 'enabled': True})
+    assert registry.get_by_name('calculate') is not None
+    assert registry.etag != etag, "修改后 ETag 应变化"
+
+    updated = registry.update('tool_1', {'enabled': False})
+    assert updated['enabled'] is False
+    assert registry.update('missing', {'enabled': False}) is None
+
+    with open(path, 'r', encoding='utf-8') as f:
+        assert json.load(f)[0]['enabled'] is False
+
+    assert registry.remove('tool_1')
+    assert registry.get('tool_1') is None
+    assert len(ConfigRegistry(path)) == 0
+    print("  ✓ 写入操作测试通过\n")
+
+
+def test_bulk_write_and_query():
+    """测试批量写入、分类索引和分页查询"""
+    print("=== 测试4: 批量写入和分页查询 ===")
+    registry, _ = _make_registry([{'id': 'tool_0', 'name': 'calculate', 'description': '计算'}])
+
+    tools = [
+        {'id': f'tool_{i}', 'name': f'inventory_{i}', 'description': f'库存查询 {i}',
+         'category': 'ops' if i % 2 else 'db'}
+        for i in range(1, 101)
+    ]
+    assert registry.put_many(tools)
+    assert len(registry) == 101
+
+    # 已存在的 id 原位替换
+    assert registry.put_many([{'id': 'tool_0', 'name': 'calculate', 'description': '新描述'}])
+    assert registry.all()[0]['description'] == '新描述'
+    assert len(registry) == 101
+
+    page, total = registry.query(category='ops', offset=10, limit=5)
+    assert total == 50 and len(page) == 5
+    assert all(tool['category'] == 'ops' for tool in page)
+
+    page, total = registry.query(q='INVENTORY_1', limit=100)
+    assert total == 12, "inventory_1, inventory_10~19, inventory_100"
+    assert registry.categories() == ['db', 'ops']
+    print("  ✓ 批量写入和分页查询测试通过\n")
+
+
+def test_sqlite_backend():
+    """测试 SQLite 后端：迁移、行级写入和跨实例版本同步"""
+    print("=== 测试5: SQLite 后端 ===")
+    tmp_dir = tempfile.mkdtemp()
+    json_path = os.path.join(tmp_dir, 'tools.json')
+    db_path = os.path.join(tmp_dir, 'registry.db')
+    with open(json_path, 'w', encoding='utf-8') as f:
+        json.dump([{'id': 'tool_1', 'name': 'calculate', 'enabled': True}], f)
+
+    # 两个注册表实例模拟两个 worker
+    worker_a = create_registry('tools', json_path, 'sqlite', db_path)
+    worker_b = create_registry('tools', json_path, 'sqlite', db_path)
+    assert worker_a.get_by_name('calculate') is not None, "应从 JSON 迁移"
+    assert len(worker_b) == 1, "迁移只应执行一次"
+
+    assert worker_a.add({'id': 'tool_2', 'name': 'search_web', 'enabled': True})
+    assert worker_b.get_by_name('search_web') is not None, "其他 worker 应看到新版本"
+
+    worker_b.update('tool_1', {'enabled': False})
+    assert worker_a.get('tool_1')['enabled'] is False
+
+    assert not worker_a.add({'id': 'tool_3', 'name': 'calculate'}), "名称重复应写入失败"
+    assert worker_a.remove('tool_2')
+    assert worker_b.get('tool_2') is None
+    assert [t['id'] for t in worker_b.all()] == ['tool_1']
+
+    assert worker_a.put_many([
+        {'id': 'tool_1', 'name': 'calculate', 'enabled': True},
+        {'id': 'tool_4', 'name': 'get_current_time'},
+    ])
+    assert [t['id'] for t in worker_b.all()] == ['tool_1', 'tool_4']
+    assert worker_b.get('tool_1')['enabled'] is True
+
+    store = SQLiteConfigStore(db_path, 'tools')
+    assert store.signature() == worker_a.store.signature()
+    print("  ✓ SQLite 后端测试通过\n")
+
+
+def test_concurrent_reads_during_writes():
+    """测试写入重建索引时并发读取不会混用新旧索引"""
+    print("=== 测试6: 并发读写 ===")
+    items = [{'id': f'tool_{i}', 'name': f'tool_{i}'} for i in range(50)]
+    registry, _ = _make_registry(items)
+    wanted = [f'tool_{i}' for i in range(0, 50, 3)]
+    errors = []
+    stop = threading.Event()
+
+    def reader():
+        while not stop.is_set():
+            try:
+                for item in registry.get_many(wanted):
+                    assert item['id'] in wanted, item
+            except Exception as e:  # 记录后由主线程断言
+                errors.append(e)
+                return
+
+    threads = [threading.Thread(target=reader) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for i in range(40):
+        registry.remove(f'tool_{i % 50}')
+        registry.add({'id': f'tool_{i % 50}', 'name': f'tool_{i % 50}'})
+    stop.set()
+    for thread in threads:
+        thread.join()
+    assert not errors, errors
+    assert len(registry) == 50
+    print("  ✓ 并发读写测试通过\n")
+
+
+def main():
+    """运行所有测试"""
+    print("\n" + "="*60)
+    print("配置注册表测试")
+    print("="*60 + "\n")
+
+    test_lookup_by_id_and_name()
+    test_reload_only_on_change()
+    test_write_operations()
+    test_bulk_write_and_query()
+    test_sqlite_backend()
+    test_concurrent_reads_during_writes()
+
+    print("="*60)
+    print("✓ 所有测试通过")
+    print("="*60)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+测试模型请求体编码
+验证拼接的请求体与直接编码等价、历史消息的编码被复用、新对象重新编码，以及按字节数淘汰
+"""
+
+import json
+import time
+from request_body import MessageEncodingCache, encode_request_body
+
+IMAGE = 'data:image/jpeg;base64,' + 'A' * (4 * 1024 * 1024)
+# 同一工具集合复用同一个列表（见 providers.RequestCompiler）
+TOOLS = [{'type': 'function', 'function': {'name': 'get_time', 'description': '当前时间', 'parameters': {}}}]
+
+
+def _request(messages):
+    return {
+        'messages': messages,
+        'temperature': 0.7,
+        'max_tokens': 2000,
+        'stream': True,
+        'model': 'gpt-4o',
+        'tools': TOOLS
+    }
+
+
+def test_body_equivalent():
+    """测试拼接的请求体与直接编码等价"""
+    print("=== 测试1: 请求体等价 ===")
+    cache = MessageEncodingCache()
+    messages = [
+        {'role': 'system', 'content': '你是助手'},
+        {'role': 'user', 'content': [{'type': 'text', 'text': '这是什么？"引号"\n换行'},
+                                     {'type': 'image_url', 'image_url': {'url': 'data:image/jpeg;base64,AAAA'}}]},
+        {'role': 'assistant', 'content': None, 'tool_calls': [{'id': 'c1', 'type': 'function',
+                                                               'function': {'name': 'f', 'arguments': '{}'}}]},
+        {'role': 'tool', 'tool_call_id': 'c1', 'content': '{"a":1}'}
+    ]
+    request_data = _request(messages)
+    body = encode_request_body(request_data, cache)
+    assert json.loads(body.decode('utf-8')) == request_data
+    assert json.loads(encode_request_body({'messages': []}, cache)) == {'messages': []}
+    assert json.loads(encode_request_body({'model': 'x'}, cache)) == {'model': 'x'}
+    print("  ✓ 请求体等价通过\n")
+
+
+def test_history_reused_across_iterations():
+    """测试模拟 MCP 多轮迭代：历史消息只编码一次"""
+    print("=== 测试2: 多轮迭代复用 ===")
+    cache = MessageEncodingCache()
+    messages = [{'role': 'user', 'content': [{'type': 'text', 'text': '看图'},
+                                             {'type': 'image_url', 'image_url': {'url': IMAGE}}]}]
+    start = time.perf_counter()
+    for iteration in range(10):
+        body = encode_request_body(_request(messages), cache)
+        messages = messages + [
+            {'role': 'assistant', 'content': f'第 {iteration} 轮'},
+            {'role': 'user', 'content': f'工具结果 {iteration}'}
+        ]
+    elapsed = time.perf_counter() - start
+
+    stats = cache.stats()
+    assert stats['misses'] == 1 + 2 * 9 + 1, "每条消息和工具定义列表只编码一次"
+    assert stats['hits'] + stats['misses'] == sum(1 + 2 * i for i in range(10)) + 10
+    assert stats['saved_bytes'] > 9 * len(IMAGE)
+    assert json.loads(body)['messages'][0]['content'][1]['image_url']['url'] == IMAGE
+    print(f"  10 轮编码 4MB 图片历史: {elapsed * 1000:.1f}ms")
+    print("  ✓ 多轮迭代复用通过\n")
+
+
+def test_new_object_reencoded():
+    """测试内容相同但对象不同的消息重新编码，不会误用其他消息的编码"""
+    print("=== 测试3: 按对象缓存 ===")
+    cache = MessageEncodingCache()
+    first = {'role': 'user', 'content': '你好'}
+    cache.encode(first)
+    second = dict(first, content='再见')
+    assert json.loads(cache.encode(second))['content'] == '再见'
+    assert cache.stats()['misses'] == 2
+    print("  ✓ 按对象缓存通过\n")
+
+
+def test_byte_limit():
+    """测试缓存按总字节数淘汰"""
+    print("=== 测试4: 字节数上限 ===")
+    cache = MessageEncodingCache(max_bytes=1000)
+    messages = [{'role': 'user', 'content': 'x' * 300} for _ in range(5)]
+    for message in messages:
+        cache.encode(message)
+    stats = cache.stats()
+    assert stats['bytes'] <= 1000 and stats['entries'] == 3
+
+    huge = {'role': 'user', 'content': 'x' * 5000}
+    assert json.loads(cache.encode(huge))['content'] == huge['content']
+    assert cache.stats()['entries'] == 3, "超过上限的消息不缓存"
+    print("  ✓ 字节数上限通过\n")
+
+
+def main():
+    """运行所有测试"""
+    print("\n" + "="*60)
+    print("模型请求体编码测试")
+    print("="*60 + "\n")
+
+    test_body_equivalent()
+    test_history_reused_across_iterations()
+    test_new_object_reencoded()
+    test_byte_limit()
+
+    print("="*60)
+    print("✓ 所有测试通过")
+    print("="*60)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+测试代码工具沙箱进程池
+验证结果通过进程间连接返回、超时/CPU/内存超限的处理、进程回收重建，以及 CPU 密集的工具在多个进程中并行执行
+"""
+
+import time
+import threading
+from sandbox import SandboxPool
+
+ADD_ONE = {'id': 'tool_1', 'name': 'add_one', 'code': 'result = {"value": params["x"] + 1}'}
+BUSY = {'id': 'tool_2', 'name': 'busy', 'code': 'total = 0\ni = 0\nwhile i < 1000000:\n    total += i\n    i += 1\nresult = total'}
+
+
+def test_run():
+    """测试正常执行和代码错误"""
+    print("=== 测试1: 执行 ===")
+    pool = SandboxPool(workers=1, timeout=5)
+    try:
+        assert pool.run(ADD_ONE, {'x': 1}) == {'success': True, 'result': {'value': 2}}
+        assert pool.run(ADD_ONE, {'x': 41})['result'] == {'value': 42}
+        result = pool.run({'id': 'tool_3', 'name': 'div', 'code': 'result = 1 / 0'}, {})
+        assert result == {'success': False, 'error': '代码执行错误: division by zero'}
+        result = pool.run({'id': 'tool_4', 'name': 'bad', 'code': 'result = ('}, {})
+        assert result['success'] is False and '代码编译错误' in result['error']
+        assert pool.stats()['crashes'] == 0
+    finally:
+        pool.close()
+    print("  ✓ 执行通过\n")
+
+
+def test_limits():
+    """测试墙钟超时、CPU 时间和内存限制"""
+    print("=== 测试2: 资源限制 ===")
+    pool = SandboxPool(workers=1, cpu_seconds=1, memory_mb=256, timeout=5)
+    try:
+        result = pool.run({'id': 't', 'name': 'spin', 'timeout': 0.5, 'code': 'while True:\n    pass'}, {})
+        assert result == {'success': False, 'error': '代码执行超时（0.5s）'}
+
+        # 调用方给出的时间上限（隔离舱剩余时间）小于工具配置时以它为准
+        result = pool.run({'id': 't', 'name': 'spin', 'timeout': 2, 'code': 'while True:\n    pass'}, {}, timeout=0.3)
+        assert result == {'success': False, 'error': '代码执行超时（0.3s）'}
+
+        result = pool.run({'id': 'c', 'name': 'cpu', 'code': 'while True:\n    pass'}, {})
+        assert 'CPU 时间限制' in result['error'], result
+
+        result = pool.run({'id': 'm', 'name': 'mem', 'code': 'result = "a" * (1024 * 1024 * 1024)'}, {})
+        assert '内存限制' in result['error'], result
+
+        # 出错的进程已被替换，后续调用正常
+        assert pool.run(ADD_ONE, {'x': 1})['success'] is True
+        stats = pool.stats()
+        assert stats['timeouts'] == 2 and stats['crashes'] == 1 and stats['workers'] == 1
+    finally:
+        pool.close()
+    print("  ✓ 资源限制通过\n")
+
+
+def test_recycle():
+    """测试进程执行 max_calls 次后回收重建"""
+    print("=== 测试3: 进程回收 ===")
+    pool = SandboxPool(workers=1, max_calls=3)
+    try:
+        for i in range(7):
+            assert pool.run(ADD_ONE, {'x': i})['result'] == {'value': i + 1}
+        assert pool.stats()['recycled'] == 2
+    finally:
+        pool.close()
+    print("  ✓ 进程回收通过\n")
+
+
+def test_parallel():
+    """测试 CPU 密集的工具在多个进程中并行执行"""
+    print("=== 测试4: 并行执行 ===")
+    pool = SandboxPool(workers=2, timeout=30)
+    try:
+        pool.run(ADD_ONE, {'x': 0})  # 启动进程池
+        start = time.perf_counter()
+        pool.run(BUSY, {})
+        single = time.perf_counter() - start
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(pool.run(BUSY, {}))) for _ in range(2)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        parallel = time.perf_counter() - start
+        assert all(result['success'] for result in results)
+        print(f"  单次 {single * 1000:.0f}ms，两个并发调用 {parallel * 1000:.0f}ms")
+    finally:
+        pool.close()
+    print("  ✓ 并行执行通过\n")
+
+
+def main():
+    """运行所有测试"""
+    print("\n" + "="*60)
+    print("代码工具沙箱进程池测试")
+    print("="*60 + "\n")
+
+    test_run()
+    test_limits()
+    test_recycle()
+    test_parallel()
+
+    print("="*60)
+    print("✓ 所有测试通过")
+    print("="*60)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+测试生产环境启动配置
+验证从环境变量生成的 gunicorn 配置：同步模式的 gthread worker 和线程数、异步模式的 uvicorn worker，
+停止/重启时的排空设置（graceful_timeout、uvicorn 的 timeout_graceful_shutdown），以及命令行参数优先于环境变量
+"""
+
+import os
+from contextlib import contextmanager
+
+import serve
+
+SERVE_ENV = ('BIND', 'HOST', 'PORT', 'WEB_WORKERS', 'WEB_THREADS', 'GRACEFUL_TIMEOUT', 'SERVE_MODE')
+
+
+@contextmanager
+def _env(**values):
+    """临时设置启动相关的环境变量，未指定的变量被清除"""
+    saved = {name: os.environ.get(name) for name in SERVE_ENV}
+    for name in SERVE_ENV:
+        os.environ.pop(name, None)
+    os.environ.update(values)
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def test_threaded_from_env():
+    """测试同步模式从环境变量生成的配置"""
+    print("=== 测试1: 同步模式配置 ===")
+    with _env(HOST='127.0.0.1', PORT='8080', WEB_WORKERS='3', WEB_THREADS='48', GRACEFUL_TIMEOUT='90'):
+        options = serve.gunicorn_options(serve.parse_args([]))
+    assert options['bind'] == '127.0.0.1:8080'
+    assert options['workers'] == 3
+    assert options['worker_class'] == 'gthread' and options['threads'] == 48
+    assert options['graceful_timeout'] == 90
+    assert options['preload_app'] is True and options['reload'] is False
+    assert options['keepalive'] == 5
+    assert callable(options['worker_int']) and callable(options['on_starting'])
+
+    # BIND 优先于 HOST/PORT，命令行参数优先于环境变量
+    with _env(BIND='unix:/tmp/agent.sock', GRACEFUL_TIMEOUT='90'):
+        options = serve.gunicorn_options(serve.parse_args(['--graceful-timeout', '15', '--reload']))
+    assert options['bind'] == 'unix:/tmp/agent.sock'
+    assert options['graceful_timeout'] == 15
+    assert options['preload_app'] is False and options['reload'] is True
+    print("  ✓ 同步模式配置通过\n")
+
+
+def test_asgi_from_env():
+    """测试 SERVE_MODE=asgi 时使用 uvicorn worker，且停止时等待同样的排空时间"""
+    print("=== 测试2: 异步模式配置 ===")
+    with _env(SERVE_MODE='asgi', WEB_WORKERS='2', GRACEFUL_TIMEOUT='45'):
+        args = serve.parse_args([])
+    assert args.asgi is True
+    try:
+        options = serve.gunicorn_options(args)
+    except ImportError:
+        print("  ⚠️ 未安装 uvicorn，跳过\n")
+        return
+    worker_class = options['worker_class']
+    assert worker_class.__name__ == 'DrainingUvicornWorker'
+    assert worker_class.CONFIG_KWARGS['timeout_graceful_shutdown'] == 45
+    assert options['graceful_timeout'] == 45 and options['workers'] == 2
+    assert 'threads' not in options
+    print("  ✓ 异步模式配置通过\n")
+
+
+def test_gunicorn_config():
+    """测试配置被 gunicorn 接受并生效"""
+    print("=== 测试3: gunicorn 配置加载 ===")
+    if serve.BaseApplication is None:
+        print("  ⚠️ 未安装 gunicorn，跳过\n")
+        return
+    with _env(PORT='8081', WEB_WORKERS='4', WEB_THREADS='16', GRACEFUL_TIMEOUT='30'):
+        application = serve.ServerApplication('app:app', serve.gunicorn_options(serve.parse_args([])))
+    cfg = application.cfg
+    assert cfg.bind == ['0.0.0.0:8081']
+    assert cfg.workers == 4 and cfg.threads == 16
+    assert cfg.worker_class_str == 'gthread'
+    assert cfg.graceful_timeout == 30 and cfg.keepalive == 5
+    assert cfg.preload_app is True
+    print("  ✓ gunicorn 配置加载通过\n")
+
+
+def main():
+    """运行所有测试"""
+    print("\n" + "="*60)
+    print("启动配置测试")
+    print("="*60 + "\n")
+
+    test_threaded_from_env()
+    test_asgi_from_env()
+    test_gunicorn_config()
+
+    print("="*60)
+    print("✓ 所有测试通过")
+    print("="*60)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+测试 SSE 流统计
+验证 track_stream 在正常完成、客户端断开（GeneratorExit）和生成出错时的计数，
+断开时内层生成器被立即关闭，以及 /api/stats 报告的流统计
+"""
+
+import app as server
+from app import track_stream, stream_stats
+
+
+def _inner(state, count=3, fail_at=None):
+    """模拟 SSE 生成器，记录是否被关闭"""
+    try:
+        for i in range(count):
+            if i == fail_at:
+                raise RuntimeError('上游连接中断')
+            yield f"data: {i}\n\n"
+    finally:
+        state['closed'] = True
+
+
+def _delta(before):
+    after = stream_stats.snapshot()
+    return {key: after[key] - before[key] for key in after}
+
+
+def test_completed():
+    """测试正常结束的流"""
+    print("=== 测试1: 正常完成 ===")
+    before = stream_stats.snapshot()
+    state = {}
+    chunks = list(track_stream(_inner(state)))
+    assert len(chunks) == 3 and state['closed']
+    assert _delta(before) == {'active': 0, 'completed': 1, 'cancelled': 0, 'errored': 0}
+    print("  ✓ 正常完成通过\n")
+
+
+def test_client_disconnect():
+    """测试客户端断开：关闭外层生成器时内层生成器立即关闭，计为取消"""
+    print("=== 测试2: 客户端断开 ===")
+    before = stream_stats.snapshot()
+    state = {}
+    stream = track_stream(_inner(state, count=100))
+    assert next(stream) == "data: 0\n\n"
+    assert _delta(before)['active'] == 1
+    stream.close()  # WSGI 服务器在客户端断开时关闭响应迭代器
+    assert state['closed'], "内层生成器应随之关闭（释放上游连接）"
+    assert _delta(before) == {'active': 0, 'completed': 0, 'cancelled': 1, 'errored': 0}
+    print("  ✓ 客户端断开通过\n")
+
+
+def test_errored():
+    """测试生成过程中出错的流不计为取消"""
+    print("=== 测试3: 生成出错 ===")
+    before = stream_stats.snapshot()
+    state = {}
+    stream = track_stream(_inner(state, fail_at=1))
+    assert next(stream) == "data: 0\n\n"
+    try:
+        next(stream)
+        raise AssertionError("异常应继续向上抛出")
+    except RuntimeError:
+        pass
+    assert state['closed']
+    assert _delta(before) == {'active': 0, 'completed': 0, 'cancelled': 0, 'errored': 1}
+    print("  ✓ 生成出错通过\n")
+
+
+def test_stats_endpoint():
+    """测试 /api/stats 报告流统计"""
+    print("=== 测试4: 运行状态接口 ===")
+    list(track_stream(_inner({})))
+    data = server.app.test_client().get('/api/stats').get_json()
+    assert data['success'] is True
+    assert data['streams'] == stream_stats.snapshot()
+    assert data['streams']['completed'] >= 1 and data['streams']['active'] == 0
+    print("  ✓ 运行状态接口通过\n")
+
+
+def main():
+    """运行所有测试"""
+    print("\n" + "="*60)
+    print("SSE 流统计测试")
+    print("="*60 + "\n")
+
+    test_completed()
+    test_client_disconnect()
+    test_errored()
+    test_stats_endpoint()
+
+    print("="*60)
+    print("✓ 所有测试通过")
+    print("="*60)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+测试工具执行接口
+验证批量执行的结果按请求顺序返回、单个调用失败不影响整批、SSE 模式的逐个结果事件和汇总事件、无效批次的拒绝，
+以及单个工具执行接口与对话中的工具调用共用隔离舱和结果缓存
+"""
+
+import os
+import json
+import tempfile
+
+os.environ.setdefault('CODE_TOOL_WORKERS', '0')  # 代码工具在请求线程中执行，测试不启动进程池
+
+import app as server
+from registry import ConfigRegistry
+from bulkhead import tool_bulkheads
+from tool_cache import tool_cache
+
+TOOLS = [
+    {'id': 'tool_1', 'name': 'slow_sum', 'description': '慢速求和', 'enabled': True,
+     'code': 'total = 0\ni = 0\nwhile i < 300000:\n    total += i\n    i += 1\nresult = total'},
+    {'id': 'tool_2', 'name': 'echo', 'description': '回显参数', 'enabled': True,
+     'code': 'result = params'},
+    {'id': 'tool_3', 'name': 'broken', 'description': '运行时出错', 'enabled': True,
+     'code': 'result = 1 / 0'},
+    {'id': 'tool_4', 'name': 'cached_echo', 'description': '带结果缓存的回显', 'enabled': True,
+     'code': 'result = params', 'cache_ttl': 60},
+]
+
+
+def _client():
+    """使用临时注册表的测试客户端"""
+    path = os.path.join(tempfile.mkdtemp(), 'tools.json')
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(TOOLS, f, ensure_ascii=False)
+    server.tool_registry = ConfigRegistry(path)
+    return server.app.test_client()
+
+
+def _events(response):
+    """解析 SSE 响应中的事件"""
+    return [
+        json.loads(line[6:])
+        for line in response.get_data(as_text=True).splitlines()
+        if line.startswith('data: ')
+    ]
+
+
+def test_results_in_request_order():
+    """测试结果顺序与请求中的 calls 一致"""
+    print("=== 测试1: 结果顺序 ===")
+    client = _client()
+    calls = [
+        {'tool_name': 'slow_sum', 'parameters': {}},
+        {'tool_name': 'echo', 'parameters': {'n': 1}},
+        {'tool_name': 'echo', 'parameters': {'n': 2}},
+    ]
+    data = client.post('/api/tools/execute/batch', json={'calls': calls}).get_json()
+    assert data['success'] is True
+    assert [item['index'] for item in data['results']] == [0, 1, 2]
+    assert [item['tool_name'] for item in data['results']] == ['slow_sum', 'echo', 'echo']
+    assert data['results'][0]['result'] == sum(range(300000))
+    assert data['results'][2]['result'] == {'n': 2}
+    assert all('elapsed' in item for item in data['results'])
+    print("  ✓ 结果顺序测试通过\n")
+
+
+def test_failed_call_does_not_abort_batch():
+    """测试单个调用失败时返回错误项，其余调用正常完成"""
+    print("=== 测试2: 单个调用失败 ===")
+    client = _client()
+    calls = [
+        {'tool_name': 'broken', 'parameters': {}},
+        {'tool_name': 'missing_tool', 'parameters': {}},
+        {'parameters': {}},
+        {'tool_name': 'echo', 'parameters': {'ok': True}},
+    ]
+    data = client.post('/api/tools/execute/batch', json={'calls': calls}).get_json()
+    assert data['success'] is True
+    results = data['results']
+    assert results[0]['success'] is False and 'division by zero' in results[0]['error']
+    assert results[1] == dict(results[1], success=False, error='工具 missing_tool 未注册')
+    assert results[2]['success'] is False and results[2]['error'] == '工具名称不能为空'
+    assert results[3]['success'] is True and results[3]['result'] == {'ok': True}
+    print("  ✓ 单个调用失败测试通过\n")
+
+
+def test_stream_events():
+    """测试 SSE 模式：每个调用一个 tool_result 事件，最后是 done 汇总事件"""
+    print("=== 测试3: 流式结果 ===")
+    client = _client()
+    calls = [
+        {'tool_name': 'slow_sum', 'parameters': {}},
+        {'tool_name': 'echo', 'parameters': {'n': 1}},
+        {'tool_name': 'broken', 'parameters': {}},
+    ]
+    response = client.post('/api/tools/execute/batch', json={'calls': calls, 'stream': True})
+    assert response.mimetype == 'text/event-stream'
+    events = _events(response)
+    results = [event for event in events if event['type'] == 'tool_result']
+    assert sorted(event['index'] for event in results) == [0, 1, 2]
+    by_index = {event['index']: event for event in results}
+    assert by_index[1]['result'] == {'n': 1}
+    assert by_index[2]['success'] is False
+    assert events[-1]['type'] == 'done' and events[-1]['count'] == 3 and 'elapsed' in events[-1]
+    print("  ✓ 流式结果测试通过\n")
+
+
+def test_invalid_batches_rejected():
+    """测试空批次、格式错误和超过上限的批次被拒绝"""
+    print("=== 测试4: 无效批次 ===")
+    client = _client()
+    for body in ({}, {'calls': []}, {'calls': {'tool_name': 'echo'}}):
+        data = client.post('/api/tools/execute/batch', json=body).get_json()
+        assert data == {'success': False, 'error': 'calls 必须是非空数组'}
+
+    calls = [{'tool_name': 'echo', 'parameters': {}}] * (server.TOOL_BATCH_MAX_CALLS + 1)
+    data = client.post('/api/tools/execute/batch', json={'calls': calls, 'stream': True}).get_json()
+    assert data == {'success': False, 'error': f'单次最多执行 {server.TOOL_BATCH_MAX_CALLS} 个工具调用'}
+    print("  ✓ 无效批次测试通过\n")
+
+
+def test_single_execute_shared_path():
+    """测试单个工具执行接口经过隔离舱和结果缓存"""
+    print("=== 测试5: 单个工具执行 ===")
+    client = _client()
+    tool_cache.clear()
+    calls = tool_bulkheads.stats()['tools'].get('cached_echo', {}).get('calls', 0)
+    for _ in range(2):
+        data = client.post('/api/tools/execute', json={'tool_name': 'cached_echo', 'parameters': {'n': 1}}).get_json()
+        assert data['success'] is True and data['result'] == {'n': 1}
+    assert tool_bulkheads.stats()['tools']['cached_echo']['calls'] == calls + 1, "第二次调用命中结果缓存"
+
+    data = client.post('/api/tools/execute', json={'tool_name': 'missing_tool'}).get_json()
+    assert data == {'success': False, 'error': '工具 missing_tool 未注册'}
+    data = client.post('/api/tools/execute', json={'parameters': {}}).get_json()
+    assert data == {'success': False, 'error': '工具名称不能为空'}
+    print("  ✓ 单个工具执行测试通过\n")
+
+
+def main():
+    """运行所有测试"""
+    print("\n" + "="*60)
+    print("工具执行接口测试")
+    print("="*60 + "\n")
+
+    test_results_in_request_order()
+    test_failed_call_does_not_abort_batch()
+    test_stream_events()
+    test_invalid_batches_rejected()
+    test_single_execute_shared_path()
+
+    print("="*60)
+    print("✓ 所有测试通过")
+    print("="*60)
+
+
+if __name__ == '__main__':
+    main()
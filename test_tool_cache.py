@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+测试工具结果缓存
+验证规范化参数、TTL、LRU 淘汰、失败结果不缓存、并发相同调用只执行一次，以及 MCP 事件中的缓存标记
+"""
+
+import time
+import threading
+from tool_cache import ToolResultCache, canonical_arguments
+from mcp import MCPCoordinator
+
+
+def _counting_executor(calls, result=None, delay=0):
+    def execute():
+        calls.append(1)
+        if delay:
+            time.sleep(delay)
+        return result or {'success': True, 'result': len(calls)}
+    return execute
+
+
+def test_canonical_keys():
+    """测试参数键顺序不同的调用命中同一缓存"""
+    print("=== 测试1: 规范化参数 ===")
+    assert canonical_arguments({'b': 1, 'a': {'y': 2, 'x': 1}}) == canonical_arguments({'a': {'x': 1, 'y': 2}, 'b': 1})
+
+    cache = ToolResultCache()
+    calls = []
+    first = cache.get_or_execute('search_web', {'q': '天气', 'n': 3}, 60, _counting_executor(calls))
+    second = cache.get_or_execute('search_web', {'n': 3, 'q': '天气'}, 60, _counting_executor(calls))
+    assert len(calls) == 1
+    assert 'cached' not in first and second['cached'] is True
+    assert second['result'] == first['result']
+
+    cache.get_or_execute('search_web', {'q': '新闻', 'n': 3}, 60, _counting_executor(calls))
+    assert len(calls) == 2, "参数不同不应命中"
+    print("  ✓ 规范化参数通过\n")
+
+
+def test_ttl_and_lru():
+    """测试 TTL 过期和 LRU 淘汰"""
+    print("=== 测试2: TTL 与 LRU ===")
+    cache = ToolResultCache(max_entries=2)
+    calls = []
+    cache.get_or_execute('t', {'i': 1}, 0.05, _counting_executor(calls))
+    time.sleep(0.08)
+    cache.get_or_execute('t', {'i': 1}, 0.05, _counting_executor(calls))
+    assert len(calls) == 2, "过期后应重新执行"
+
+    cache.get_or_execute('t', {'i': 2}, 60, _counting_executor(calls))
+    cache.get_or_execute('t', {'i': 1}, 60, _counting_executor(calls))  # 命中，变为最近使用
+    cache.get_or_execute('t', {'i': 3}, 60, _counting_executor(calls))  # 淘汰 i=2
+    assert cache.stats()['entries'] == 2 and cache.stats()['evictions'] == 1
+
+    count = len(calls)
+    cache.get_or_execute('t', {'i': 1}, 60, _counting_executor(calls))
+    assert len(calls) == count
+    cache.get_or_execute('t', {'i': 2}, 60, _counting_executor(calls))
+    assert len(calls) == count + 1
+    print("  ✓ TTL 与 LRU 通过\n")
+
+
+def test_failures_not_cached():
+    """测试失败结果不会被缓存"""
+    print("=== 测试3: 失败不缓存 ===")
+    cache = ToolResultCache()
+    calls = []
+    failure = {'success': False, 'error': 'HTTP 500'}
+    cache.get_or_execute('api', {}, 60, _counting_executor(calls, failure))
+    cache.get_or_execute('api', {}, 60, _counting_executor(calls, failure))
+    assert len(calls) == 2
+    print("  ✓ 失败不缓存通过\n")
+
+
+def test_single_flight():
+    """测试并发的相同调用只执行一次"""
+    print("=== 测试4: 并发去重 ===")
+    cache = ToolResultCache()
+    calls = []
+    results = []
+
+    def worker():
+        results.append(cache.get_or_execute('slow', {'q': 1}, 60, _counting_executor(calls, delay=0.1)))
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert len(results) == 8 and all(r['result'] == 1 for r in results)
+    assert sum(1 for r in results if r.get('cached')) == 7
+    assert cache.stats()['shared'] == 7 and cache.stats()['in_flight'] == 0
+    print("  ✓ 并发去重通过\n")
+
+
+def test_cached_flag_in_mcp_event():
+    """测试缓存命中体现在 tool_call_complete 事件中，且不回传给模型"""
+    print("=== 测试5: MCP 事件 ===")
+    cache = ToolResultCache()
+    calls = []
+    seen_messages = []
+    reply = ('<tool_call>{"name": "search_web", "arguments": {"q": "a"}}</tool_call>'
+             '<tool_call>{"name": "search_web", "arguments": {"q": "a"}}</tool_call>')
+
+    def model_caller(messages, tools, params):
+        seen_messages.append(list(messages))
+        yield {'type': 'content', 'content': '完成' if len(messages) > 1 else reply}
+        yield {'type': 'done'}
+
+    def tool_executor(tool_name, tool_args):
+        return cache.get_or_execute(tool_name, tool_args, 60, _counting_executor(calls, delay=0.05))
+
+    mcp = MCPCoordinator(model_caller, tool_executor)
+    events = list(mcp.coordinate_stream([{'role': 'user', 'content': '搜索'}], [], {}, auto_parse=True))
+
+    completes = [e for e in events if e['type'] == 'tool_call_complete']
+    assert len(calls) == 1
+    assert sorted(e['cached'] for e in completes) == [False, True]
+    assert 'cached' not in seen_messages[1][-1]['content']
+    print("  ✓ MCP 事件通过\n")
+
+
+def main():
+    """运行所有测试"""
+    print("\n" + "="*60)
+    print("工具结果缓存测试")
+    print("="*60 + "\n")
+
+    test_canonical_keys()
+    test_ttl_and_lru()
+    test_failures_not_cached()
+    test_single_flight()
+    test_cached_flag_in_mcp_event()
+
+    print("="*60)
+    print("✓ 所有测试通过")
+    print("="*60)
+
+
+if __name__ == '__main__':
+    main()
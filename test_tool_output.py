@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+测试工具结果编码
+验证紧凑编码、结构化截断、服务端分页存储，以及 MCP 中自动提供的分页工具
+"""
+
+import json
+from tool_output import (
+    ResultStore, encode_result, truncate_value, compact_json, RESULT_PAGE_TOOL
+)
+from mcp import MCPCoordinator
+from context_window import estimate_tokens
+
+BIG_RESULT = {
+    'success': True,
+    'result': {
+        'total': 500,
+        'items': [{'id': i, 'title': f'第 {i} 条新闻', 'body': '内容' * 200} for i in range(500)]
+    }
+}
+
+
+def test_small_result_compact():
+    """测试小结果只做紧凑编码"""
+    print("=== 测试1: 紧凑编码 ===")
+    text, truncated = encode_result({'success': True, 'result': {'a': [1, 2]}}, 100, estimate_tokens)
+    assert text == '{"success":true,"result":{"a":[1,2]}}'
+    assert not truncated
+
+    # 没有 result 字段的结果整体截断
+    text, truncated = encode_result(list(range(5000)), 200, estimate_tokens)
+    assert truncated and estimate_tokens(text) < 300
+    print("  ✓ 紧凑编码通过\n")
+
+
+def test_structured_truncation():
+    """测试结构化截断：数组保留首尾、长字符串保留首尾，满足预算"""
+    print("=== 测试2: 结构化截断 ===")
+    for budget in (2000, 500, 100):
+        value, truncated = truncate_value(BIG_RESULT['result'], budget, estimate_tokens)
+        assert truncated
+        assert estimate_tokens(compact_json(value)) <= budget, budget
+        print(f"  预算 {budget}: {estimate_tokens(compact_json(value))} tokens")
+
+    value, _ = truncate_value(BIG_RESULT['result'], 2000, estimate_tokens)
+    assert value['total'] == 500
+    assert value['items'][0]['id'] == 0 and value['items'][-1]['id'] == 499
+    assert any(isinstance(item, str) and '省略' in item for item in value['items'])
+    print("  ✓ 结构化截断通过\n")
+
+
+def test_store_paging():
+    """测试截断结果保存在服务端，按页读取后可还原完整内容"""
+    print("=== 测试3: 分页读取 ===")
+    store = ResultStore()
+    text, truncated = encode_result(BIG_RESULT, 1000, estimate_tokens, store)
+    encoded = json.loads(text)
+    assert truncated and encoded['success'] is True
+    assert estimate_tokens(text) < 1500
+    handle, pages = encoded['truncated']['handle'], encoded['truncated']['pages']
+
+    content = ''
+    for page in range(1, pages + 1):
+        result = store.read(handle, page)
+        assert result['success'] and result['result']['pages'] == pages
+        content += result['result']['content']
+    assert json.loads(content) == BIG_RESULT['result']
+
+    assert not store.read(handle, pages + 1)['success']
+    assert not store.read('res_missing')['success']
+
+    small = ResultStore(max_entries=1)
+    first = small.put(['a'])
+    small.put(['b'])
+    assert not small.read(first)['success'], "超出容量时淘汰最早的结果"
+    print(f"  ✓ 分页读取通过（{pages} 页）\n")
+
+
+def test_mcp_paging_tool():
+    """测试 MCP 回传截断结果，并在后续轮次提供分页工具"""
+    print("=== 测试4: MCP 分页工具 ===")
+    seen_tools = []
+    seen_messages = []
+
+    def model_caller(messages, tools, params):
+        seen_tools.append([tool['name'] for tool in tools])
+        seen_messages.append(list(messages))
+        if len(messages) == 1:
+            content = '<tool_call>{"name": "search_news", "arguments": {}}</tool_call>'
+        elif len(messages) == 3:
+            handle = json.loads(messages[-1]['content'].split('结果：\n', 1)[1])['truncated']['handle']
+            content = f'<tool_call>{{"name": "{RESULT_PAGE_TOOL}", "arguments": {{"handle": "{handle}", "page": 2}}}}</tool_call>'
+        else:
+            content = '共 500 条新闻'
+        yield {'type': 'content', 'content': content}
+        yield {'type': 'done'}
+
+    executed = []
+
+    def tool_executor(tool_name, tool_args):
+        executed.append(tool_name)
+        return BIG_RESULT
+
+    tools = [{'name': 'search_news', 'description': '搜索新闻', 'max_result_tokens': 800}]
+    mcp = MCPCoordinator(model_caller, tool_executor)
+    events = list(mcp.coordinate_stream([{'role': 'user', 'content': '今天的新闻'}], tools, {}, True))
+
+    assert executed == ['search_news'], "分页工具由协调器提供，不交给工具执行函数"
+    assert seen_tools[0] == ['search_news']
+    assert seen_tools[1] == ['search_news', RESULT_PAGE_TOOL]
+    assert estimate_tokens(seen_messages[1][-1]['content']) < 1200
+    page = [e for e in events if e['type'] == 'tool_call_complete' and e['name'] == RESULT_PAGE_TOOL]
+    assert page and page[0]['success'] and page[0]['result']['result']['page'] == 2
+    assert events[-1]['type'] == 'done'
+    print("  ✓ MCP 分页工具通过\n")
+
+
+def main():
+    """运行所有测试"""
+    print("\n" + "="*60)
+    print("工具结果编码测试")
+    print("="*60 + "\n")
+
+    test_small_result_compact()
+    test_structured_truncation()
+    test_store_paging()
+    test_mcp_paging_tool()
+
+    print("="*60)
+    print("✓ 所有测试通过")
+    print("="*60)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+测试模型输出扫描器
+验证各种工具调用格式、截断补全、内容清理，以及超长异常输出下的线性耗时
+"""
+
+import time
+from tool_parser import scan_model_output, complete_json, match_brace, StreamingToolScanner
+
+
+def _names(content):
+    return [call['name'] for call in scan_model_output(content)['tool_calls']]
+
+
+def test_complete_formats():
+    """测试完整格式"""
+    print("=== 测试1: 完整格式 ===")
+    result = scan_model_output('<tool_call>{"name":"get_time","arguments":{"tz":"UTC"}}</tool_call>')
+    assert result['tool_calls'] == [{'name': 'get_time', 'arguments': {'tz': 'UTC'}}]
+
+    result = scan_model_output('<tool_call name="calculate" arguments=\'{"expr":"2+3"}\'/>')
+    assert result['tool_calls'] == [{'name': 'calculate', 'arguments': {'expr': '2+3'}}]
+
+    result = scan_model_output('<think>需要查时间</think>get_current_time({"timezone":"Asia/Shanghai"})')
+    assert result['tool_calls'] == [{'name': 'get_current_time', 'arguments': {'timezone': 'Asia/Shanghai'}}]
+
+    # 参数中包含括号和引号
+    result = scan_model_output('calculate({"expr": "f(\\"}\\") + {1}"})')
+    assert result['tool_calls'] == [{'name': 'calculate', 'arguments': {'expr': 'f("}") + {1}'}}]
+    print("  ✓ 完整格式解析通过\n")
+
+
+def test_truncated_formats():
+    """测试未封闭/截断的调用"""
+    print("=== 测试2: 截断补全 ===")
+    assert _names('<tool_call>{"name":"get_time"') == ['get_time']
+    result = scan_model_output('<tool_call>{"name":"calculate","arguments":{"expr":"2+3"')
+    assert result['tool_calls'] == [{'name': 'calculate', 'arguments': {'expr': '2+3'}}]
+    assert _names('<tool_call name="get_data"') == ['get_data']
+    assert scan_model_output('process_data({"key":"value"')['tool_calls'] == [
+        {'name': 'process_data', 'arguments': {'key': 'value'}}
+    ]
+    assert _names('<tool_call>{"name":"web_search","argu') == ['web_search']
+    # 被截断的工具名不会被当成调用
+    assert _names('<tool_call>{"name":"web_se') == []
+
+    assert complete_json('{"a": 1,') == {'a': 1}
+    assert complete_json('{"a": [1, 2') == {'a': [1, 2]}
+    assert complete_json('{"a": {"b": "x') == {'a': {}}
+    print("  ✓ 截断补全通过\n")
+
+
+def test_edge_cases():
+    """测试边缘情况"""
+    print("=== 测试3: 边缘情况 ===")
+    assert _names('现在是14:30') == []
+    assert _names('<tool_call>not json</tool_call>') == []
+    assert _names('<tool_call>{"name":"a"}</tool_call><tool_call>{"name":"b"}</tool_call>') == ['a', 'b']
+    assert _names('<tool_call>{"name":"tool1"}</tool_call><tool_call>{"name":"tool1') == ['tool1']
+    # thinking 中的函数调用不执行
+    assert _names('<think>可以调用 get_time({"tz":"UTC"})</think>不需要工具') == []
+    # 未结束的 thinking 中也不执行
+    assert _names('<think>可以调用 get_time({"tz":"UTC"})') == []
+    # 标签 JSON 内部的函数调用文本不会被重复识别
+    assert _names('<tool_call>{"name":"run","arguments":{"code":"f({\\"a\\":1})"}}</tool_call>') == ['run']
+    assert match_brace('{"a": "}"}', 0) == 9
+    assert match_brace('{"a": {', 0) == -1
+    print("  ✓ 边缘情况通过\n")
+
+
+def test_clean_and_thinking():
+    """测试内容清理和 thinking 提取"""
+    print("=== 测试4: 内容清理 ===")
+    result = scan_model_output('<think>思考1</think>现在是14:30<think>思考2</think>')
+    assert result['thinking'] == '思考1\n思考2'
+    assert result['text'] == '现在是14:30'
+
+    result = scan_model_output('现在是14:30，距离8点还有<tool_call>{"name":"calculate"}</tool_call>5.5小时')
+    assert result['text'] == '现在是14:30，距离8点还有5.5小时'
+
+    result = scan_model_output('<think>思考</think>get_current_time({"tz":"UTC"})现在是14:30')
+    assert result['text'] == '现在是14:30'
+
+    result = scan_model_output('答案是<tool_call name="calculate" arguments=\'{"expr":"2+3"}\'/>5')
+    assert result['text'] == '答案是5'
+    print("  ✓ 内容清理通过\n")
+
+
+def test_streaming_prefixes():
+    """测试流式输出：闭合标签出现前即可识别"""
+    print("=== 测试5: 流式识别 ===")
+    full = '<tool_call>{"name":"get_time","arguments":{"tz":"UTC"}}</tool_call>'
+    found_at = None
+    for i in range(1, len(full) + 1):
+        if _names(full[:i]) == ['get_time']:
+            found_at = i
+            break
+    assert found_at is not None and found_at < len(full)
+    print(f"  ✓ 在第 {found_at}/{len(full)} 个字符时识别出工具调用\n")
+
+
+def _feed(content, size):
+    """按固定大小切块输入增量扫描器，返回所有提前识别的调用"""
+    scanner = StreamingToolScanner()
+    calls = []
+    for i in range(0, len(content), size):
+        calls.extend(scanner.feed(content[i:i + size]))
+    return calls
+
+
+def test_incremental_scanner():
+    """测试增量扫描：任意切块方式下，完整的 <tool_call> 在闭合时立即返回，其余格式留给完整扫描"""
+    print("=== 测试6: 增量扫描 ===")
+    content = ('先查时间<tool_call>{"name":"get_time","arguments":{"tz":"UTC"}}</tool_call>再计算'
+               '<tool_call>{"name":"calculate","arguments":{"expr":"1+1"}}</tool_call>')
+    for size in (1, 3, 7, len(content)):
+        assert _feed(content, size) == scan_model_output(content)['tool_calls'], size
+
+    # 函数调用、属性标签和未封闭的调用不提前返回
+    for content in (
+        'get_time({"tz": "x)}\\""}) 结果',
+        '<tool_call name="calculate" arguments=\'{"expr":"3>2"}\'/>后续内容',
+        '<tool_call>{"name":"get_time","arguments":{}}',
+    ):
+        assert scan_model_output(content)['tool_calls'], content
+        for size in (1, 3, len(content)):
+            assert _feed(content, size) == [], (size, content)
+
+    # 闭合标签到达时立即返回，不等后续内容
+    scanner = StreamingToolScanner()
+    assert scanner.feed('<tool_call>{"name":"get_time"}') == []
+    assert scanner.feed('</tool_') == []
+    assert scanner.feed('call>') == [{'name': 'get_time', 'arguments': {}}]
+    assert scanner.feed('好的') == []
+    print("  ✓ 增量扫描通过\n")
+
+
+def test_incremental_scanner_thinking():
+    """测试 thinking 中的调用不提前返回，thinking 之后的完整调用正常返回"""
+    print("=== 测试7: 增量扫描跳过 thinking ===")
+    content = ('<think>可以用 get_time({"a":1})，或者 <tool_call>{"name":"calculate","arguments":{}}</tool_call></think>'
+               '<tool_call>{"name":"get_time","arguments":{"tz":"UTC"}}</tool_call>')
+    expected = [{'name': 'get_time', 'arguments': {'tz': 'UTC'}}]
+    assert scan_model_output(content)['tool_calls'] == expected
+    for size in (1, 3, 7, len(content)):
+        assert _feed(content, size) == expected, size
+
+    # thinking 尚未结束时其中的内容都不是调用
+    assert _feed('<think><tool_call>{"name":"get_time"}</tool_call>', 5) == []
+    print("  ✓ 跳过 thinking 通过\n")
+
+
+def test_incremental_scanner_superseded():
+    """测试被同名完整调用取代的函数调用不会提前返回"""
+    print("=== 测试8: 增量扫描与完整扫描一致 ===")
+    content = ('先试试 get_time({"tz": "local"}) 不对，应该这样：'
+               '<tool_call>{"name":"get_time","arguments":{"tz":"UTC"}}</tool_call>')
+    expected = [{'name': 'get_time', 'arguments': {'tz': 'UTC'}}]
+    assert scan_model_output(content)['tool_calls'] == expected
+    for size in (1, 4, len(content)):
+        assert _feed(content, size) == expected, size
+    print("  ✓ 取代的调用不提前返回\n")
+
+
+def test_incremental_scanner_linear_time():
+    """测试增量扫描的耗时与输出长度成线性关系（已扫描的内容不会重复扫描）"""
+    print("=== 测试9: 增量扫描耗时 ===")
+    size = 400 * 1024
+    inputs = {
+        '普通文本': 'x' * size,
+        '未闭合的 tool_call': '<tool_call>{"name":"f","arguments":{"text":"' + 'x' * size,
+        '未结束的 thinking': '<think>' + 'get_time({"a":1}) ' * (size // 18),
+        '大量调用': '<tool_call>{"name":"f"}</tool_call>' * (size // 34),
+    }
+    for label, content in inputs.items():
+        start = time.perf_counter()
+        _feed(content, 16)
+        elapsed = time.perf_counter() - start
+        print(f"  {label}: {len(content) // 1024}KB, {elapsed * 1000:.1f}ms")
+        assert elapsed < 1.0, f"{label} 耗时过长: {elapsed:.2f}s"
+    print("  ✓ 增量扫描耗时通过\n")
+
+
+def test_adversarial_linear_time():
+    """测试 200KB 异常输出的耗时（正则回溯实现会卡住）"""
+    print("=== 测试10: 异常输出耗时 ===")
+    size = 200 * 1024
+    inputs = {
+        '未闭合的函数调用': 'a({' * (size // 3),
+        '嵌套左括号': 'call({' + '{' * size,
+        '重复的 tool_call': '<tool_call>' * (size // 11),
+        '重复的属性标签': '<tool_call name="x"' * (size // 19),
+        '超长单词': 'a' * size + '({}',
+        '未闭合的字符串': 'fn({"' + 'x' * size,
+        '大量引号': 'fn({' + '"\\"' * (size // 3),
+        '未结束的 thinking': '<think>' + 'get_time({"a":1}) ' * (size // 18),
+        '大量 thinking 标签': '<think></think>f({})' * (size // 19),
+    }
+    for label, content in inputs.items():
+        start = time.perf_counter()
+        scan_model_output(content)
+        elapsed = time.perf_counter() - start
+        print(f"  {label}: {len(content) // 1024}KB, {elapsed * 1000:.1f}ms")
+        assert elapsed < 1.0, f"{label} 耗时过长: {elapsed:.2f}s"
+    print("  ✓ 耗时测试通过\n")
+
+
+def main():
+    """运行所有测试"""
+    print("\n" + "="*60)
+    print("模型输出扫描器测试")
+    print("="*60 + "\n")
+
+    test_complete_formats()
+    test_truncated_formats()
+    test_edge_cases()
+    test_clean_and_thinking()
+    test_streaming_prefixes()
+    test_incremental_scanner()
+    test_incremental_scanner_thinking()
+    test_incremental_scanner_superseded()
+    test_incremental_scanner_linear_time()
+    test_adversarial_linear_time()
+
+    print("="*60)
+    print("✓ 所有测试通过")
+    print("="*60)
+
+
+if __name__ == '__main__':
+    main()
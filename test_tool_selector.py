@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+测试工具相关性筛选
+验证分词、BM25 排序、调用次数加权、与注册表的增量同步（重新加载后不重建未变化的工具），以及筛选报告中的工具定义缩减量
+"""
+
+import time
+import copy
+from tool_selector import ToolSelector, tokenize, query_text
+
+
+def _tools(count):
+    tools = [
+        {'name': 'get_server_status', 'description': '查询服务器的运行状态、CPU 和内存使用率',
+         'parameters': {'type': 'object', 'properties': {'host': {'type': 'string', 'description': '服务器主机名'}}}},
+        {'name': 'restart_service', 'description': '重启指定的服务',
+         'parameters': {'type': 'object', 'properties': {'service': {'type': 'string', 'description': '服务名称'}}}},
+        {'name': 'search_logs', 'description': '按关键字搜索应用日志',
+         'parameters': {'type': 'object', 'properties': {'keyword': {'type': 'string', 'description': '关键字'}}}},
+        {'name': 'get_weather', 'description': 'Get the current weather for a city',
+         'parameters': {'type': 'object', 'properties': {'city': {'type': 'string', 'description': 'City name'}}}},
+    ]
+    for i in range(count - len(tools)):
+        tools.append({'name': f'report_{i}', 'description': f'生成第 {i} 类业务报表，按部门汇总销售数据',
+                      'parameters': {'type': 'object', 'properties': {'month': {'type': 'string', 'description': '月份'}}}})
+    return tools
+
+
+def test_tokenize():
+    """测试分词"""
+    print("=== 测试1: 分词 ===")
+    assert tokenize('getServerStatus') == ['get', 'server', 'status']
+    assert tokenize('cpu_usage') == ['cpu', 'usage']
+    assert tokenize('服务器') == ['服', '务', '器', '服务', '务器']
+    assert query_text([
+        {'role': 'user', 'content': '旧问题'},
+        {'role': 'assistant', 'content': '回答'},
+        {'role': 'user', 'content': [{'type': 'text', 'text': '新问题'}, {'type': 'image_url', 'image_url': {}}]}
+    ]) == '新问题'
+    print("  ✓ 分词通过\n")
+
+
+def test_rank_and_select():
+    """测试按相关性选出前 top_k 个工具并报告缩减量"""
+    print("=== 测试2: 排序与筛选 ===")
+    selector = ToolSelector()
+    tools = _tools(300)
+    selector.sync(tools, version=1)
+
+    ranked = selector.rank('web-01 服务器的 CPU 使用率是多少？', tools)
+    assert ranked[0][1]['name'] == 'get_server_status'
+    assert selector.rank('what is the weather in Paris', tools)[0][1]['name'] == 'get_weather'
+    assert selector.rank('帮我搜索一下日志里的报错', tools)[0][1]['name'] == 'search_logs'
+
+    start = time.perf_counter()
+    selected, report = selector.select('重启 nginx 服务', tools, 5)
+    elapsed = time.perf_counter() - start
+    assert len(selected) == 5 and 'restart_service' in report['selected']
+    assert report['total'] == 300
+    assert report['selected_schema_tokens'] < report['schema_tokens'] / 20
+    assert report['saved_tokens'] == report['schema_tokens'] - report['selected_schema_tokens']
+    print(f"  300 个工具筛选耗时 {elapsed * 1000:.1f}ms，工具定义约 {report['schema_tokens']} → {report['selected_schema_tokens']} tokens")
+
+    # 工具数量不超过 top_k 时不筛选
+    assert selector.select('任意问题', tools[:3], 5) == (tools[:3], None)
+    print("  ✓ 排序与筛选通过\n")
+
+
+def test_usage_weight():
+    """测试相关性相近时常用工具优先"""
+    print("=== 测试3: 调用次数加权 ===")
+    selector = ToolSelector()
+    tools = _tools(10)
+    selector.sync(tools, version=1)
+    assert selector.rank('生成报表', tools)[0][1]['name'] == 'report_0'
+    for _ in range(20):
+        selector.record_usage('report_4')
+    assert selector.rank('生成报表', tools)[0][1]['name'] == 'report_4'
+    print("  ✓ 调用次数加权通过\n")
+
+
+def test_incremental_sync():
+    """测试注册、修改、删除工具后索引增量更新"""
+    print("=== 测试4: 增量同步 ===")
+    selector = ToolSelector()
+    tools = _tools(20)
+    selector.sync(tools, version=1)
+    assert selector.stats()['indexed'] == 20
+
+    # 版本未变化时跳过
+    selector.sync([], version=1)
+    assert selector.stats()['indexed'] == 20
+
+    new_tool = {'name': 'query_database', 'description': '执行只读 SQL 查询数据库', 'parameters': {}}
+    tools = [tool for tool in tools if tool['name'] != 'get_weather'] + [new_tool]
+    tools[0] = dict(tools[0], description='检查磁盘空间')  # 更新后是新的配置字典
+    selector.sync(tools, version=2)
+    assert selector.stats()['indexed'] == 20
+    assert selector.rank('查询数据库里的订单', tools)[0][1]['name'] == 'query_database'
+    assert selector.rank('磁盘空间还剩多少', tools)[0][1]['name'] == 'get_server_status'
+    assert all(tool['name'] != 'get_weather' for _, tool in selector.rank('weather', tools))
+
+    # 删除后文档频率与重新建立的索引一致，不留下计数为 0 的词
+    fresh = ToolSelector()
+    fresh.sync(tools, version=1)
+    assert selector._df == fresh._df and all(count > 0 for count in selector._df.values())
+    print("  ✓ 增量同步通过\n")
+
+
+def test_reload_does_not_reindex():
+    """测试注册表重新加载（配置字典都是新对象）后只重建定义有变化的工具"""
+    print("=== 测试5: 重新加载后的同步 ===")
+    selector = ToolSelector()
+    tools = _tools(3000)
+    selector.sync(tools, version=1)
+    builds = selector.stats()['index_builds']
+
+    # 启用/禁用不改变工具定义，不需要重建索引
+    reloaded = copy.deepcopy(tools)
+    reloaded[10]['enabled'] = False
+    start = time.perf_counter()
+    selector.sync(reloaded, version=2)
+    selector.select('重启 nginx 服务', reloaded, 5)
+    elapsed = time.perf_counter() - start
+    assert selector.stats()['index_builds'] == builds
+
+    reloaded = copy.deepcopy(reloaded)
+    reloaded[3]['description'] = '查询城市天气预报'
+    selector.sync(reloaded, version=3)
+    assert selector.stats()['index_builds'] == builds + 1
+    assert selector.rank('天气预报', reloaded)[0][1]['name'] == 'get_weather'
+    print(f"  3000 个工具重新加载后同步并筛选耗时 {elapsed * 1000:.1f}ms")
+    assert elapsed < 0.5, f"重新加载后同步耗时过长: {elapsed:.2f}s"
+    print("  ✓ 重新加载后的同步通过\n")
+
+
+def main():
+    """运行所有测试"""
+    print("\n" + "="*60)
+    print("工具相关性筛选测试")
+    print("="*60 + "\n")
+
+    test_tokenize()
+    test_rank_and_select()
+    test_usage_weight()
+    test_incremental_sync()
+    test_reload_does_not_reindex()
+
+    print("="*60)
+    print("✓ 所有测试通过")
+    print("="*60)
+
+
+if __name__ == '__main__':
+    main()
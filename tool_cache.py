@@ -0,0 +1,124 @@
+"""
+工具结果缓存
+按 (工具名, 规范化参数) 缓存成功的工具结果，同一查询在多轮对话、多个用户之间复用，
+并发的相同调用只执行一次（single-flight）
+"""
+
+import os
+import json
+import time
+import threading
+import logging
+from collections import OrderedDict
+from typing import Callable, Dict, Tuple
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+
+def canonical_arguments(arguments) -> str:
+    """参数的规范化 JSON（键排序、无多余空白），键顺序或格式不同的相同参数得到相同结果"""
+    return json.dumps(arguments, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+
+
+class _Flight:
+    """进行中的一次工具执行，相同调用等待它的结果"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+
+class ToolResultCache:
+    """
+    工具结果缓存
+
+    - 只有工具配置了 cache_ttl（秒）时才启用，TTL 按工具分别设置
+    - 超过 max_entries 时淘汰最久未使用的结果（LRU）
+    - 只缓存 success 为 True 的结果，失败结果不会被复用
+    - 命中缓存或复用了并发调用的结果时，返回结果带 cached: True
+    """
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: 'OrderedDict[Tuple[str, str], Tuple[float, Dict]]' = OrderedDict()
+        self._flights: Dict[Tuple[str, str], _Flight] = {}
+        self._hits = 0
+        self._misses = 0
+        self._shared = 0
+        self._evictions = 0
+
+    def get_or_execute(self, tool_name: str, arguments, ttl: float, execute: Callable[[], Dict]) -> Dict:
+        """
+        返回缓存的结果，没有时执行 execute() 并缓存
+
+        Args:
+            tool_name: 工具名称
+            arguments: 工具参数
+            ttl: 结果有效期（秒）
+            execute: 实际执行工具的函数
+        """
+        key = (tool_name, canonical_arguments(arguments))
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self._hits += 1
+                    logger.info(f"   ♻️ 命中工具结果缓存: {tool_name}")
+                    return dict(entry[1], cached=True)
+                del self._entries[key]
+
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self._misses += 1
+            else:
+                self._shared += 1
+
+        if not leader:
+            # 相同调用正在执行，等待它的结果
+            logger.info(f"   ♻️ 等待进行中的相同工具调用: {tool_name}")
+            flight.done.wait()
+            return dict(flight.result, cached=True)
+
+        result = {'success': False, 'error': '工具执行异常'}
+        try:
+            result = execute()
+        finally:
+            with self._lock:
+                if isinstance(result, dict) and result.get('success'):
+                    self._entries[key] = (time.monotonic() + float(ttl), result)
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+                        self._evictions += 1
+                del self._flights[key]
+            flight.result = result
+            flight.done.set()
+        return result
+
+    def clear(self):
+        """清空缓存（不影响进行中的调用）"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        """缓存统计，用于监控"""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self._hits,
+                'misses': self._misses,
+                'shared': self._shared,
+                'evictions': self._evictions,
+                'in_flight': len(self._flights)
+            }
+
+
+# 全局共享的工具结果缓存
+tool_cache = ToolResultCache(max_entries=int(os.environ.get('TOOL_CACHE_SIZE', '1024')))
@@ -0,0 +1,200 @@
+"""
+工具结果编码
+按预算把工具结果编码为回传给模型的紧凑 JSON：超出预算时结构化截断（数组保留首尾元素、长字符串保留首尾、
+过深的对象只列出键），完整结果保存在服务端，模型通过自动提供的分页工具按页读取
+"""
+
+import os
+import json
+import time
+import uuid
+import threading
+import logging
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 自动提供给模型的分页工具
+RESULT_PAGE_TOOL = 'read_tool_result'
+RESULT_PAGE_TOOL_DEFINITION = {
+    'name': RESULT_PAGE_TOOL,
+    'description': '读取被截断的工具结果的完整内容。工具结果过长时只返回了摘要和 handle，用此工具按页读取原始 JSON。',
+    'parameters': {
+        'type': 'object',
+        'properties': {
+            'handle': {'type': 'string', 'description': '截断结果中的 handle'},
+            'page': {'type': 'integer', 'description': '页码，从 1 开始', 'default': 1}
+        },
+        'required': ['handle']
+    }
+}
+
+# 结构化截断的档位：(数组保留的首尾元素数, 字符串保留的字符数, 展开的对象层数)，逐档收紧直到满足预算
+_TRUNCATE_LEVELS = [
+    (20, 2000, 8),
+    (8, 500, 4),
+    (3, 160, 3),
+    (2, 100, 3),
+    (1, 60, 3),
+    (1, 60, 2),
+    (1, 20, 1),
+]
+
+
+def compact_json(value: Any) -> str:
+    """紧凑 JSON（无缩进、无多余空白）"""
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'), default=str)
+
+
+def _shrink(value: Any, items: int, chars: int, depth: int) -> Any:
+    """按档位截断：数组保留首尾 items 个元素，字符串保留首尾共 chars 个字符，超过 depth 层的容器只保留概要"""
+    if isinstance(value, str):
+        if len(value) <= chars:
+            return value
+        half = max(1, chars // 2)
+        return f"{value[:half]}…（省略 {len(value) - 2 * half} 字符）…{value[-half:]}"
+    if isinstance(value, dict):
+        if depth <= 0:
+            keys = list(value)
+            summary = {'_keys': keys[:20]}
+            if len(keys) > 20:
+                summary['_more_keys'] = len(keys) - 20
+            return summary
+        return {key: _shrink(item, items, chars, depth - 1) for key, item in value.items()}
+    if isinstance(value, list):
+        if depth <= 0:
+            return {'_items': len(value)}
+        if len(value) <= 2 * items + 1:
+            return [_shrink(item, items, chars, depth - 1) for item in value]
+        head = [_shrink(item, items, chars, depth - 1) for item in value[:items]]
+        tail = [_shrink(item, items, chars, depth - 1) for item in value[-items:]]
+        return head + [f"…（省略 {len(value) - 2 * items} 项）…"] + tail
+    return value
+
+
+def truncate_value(value: Any, max_tokens: int, count_tokens: Callable[[str], int]) -> Tuple[Any, bool]:
+    """
+    结构化截断，使紧凑 JSON 不超过 max_tokens
+
+    Returns:
+        (截断后的值, 是否截断)
+    """
+    if count_tokens(compact_json(value)) <= max_tokens:
+        return value, False
+    for items, chars, depth in _TRUNCATE_LEVELS:
+        shrunk = _shrink(value, items, chars, depth)
+        if count_tokens(compact_json(shrunk)) <= max_tokens:
+            return shrunk, True
+    # 最紧的档位仍超出（如对象键极多）：退化为文本预览
+    text = compact_json(value)
+    return _shrink(text, 0, max(20, max_tokens), 0), True
+
+
+def split_pages(text: str, page_tokens: int, count_tokens: Callable[[str], int]) -> List[str]:
+    """把文本按约 page_tokens 的大小分页"""
+    total = max(1, count_tokens(text))
+    page_chars = max(1, len(text) * max(1, page_tokens) // total)
+    return [text[i:i + page_chars] for i in range(0, len(text), page_chars)] or ['']
+
+
+class ResultStore:
+    """
+    被截断的工具结果的服务端存储
+
+    完整结果按页保存，模型通过 handle 和页码读取；超过 max_entries 时淘汰最久未使用的结果，
+    超过 ttl 秒未读取的结果过期
+    """
+
+    def __init__(self, max_entries: int = 256, ttl: float = 1800):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: 'OrderedDict[str, Tuple[float, List[str]]]' = OrderedDict()
+        self._reads = 0
+        self._misses = 0
+
+    def put(self, pages: List[str]) -> str:
+        """保存分页后的结果，返回 handle"""
+        handle = f'res_{uuid.uuid4().hex[:12]}'
+        with self._lock:
+            self._entries[handle] = (time.monotonic() + self.ttl, pages)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return handle
+
+    def read(self, handle: str, page: int = 1) -> Dict:
+        """读取一页结果"""
+        with self._lock:
+            entry = self._entries.get(handle)
+            if entry is None or entry[0] <= time.monotonic():
+                self._entries.pop(handle, None)
+                self._misses += 1
+                return {'success': False, 'error': f'结果不存在或已过期: {handle}'}
+            pages = entry[1]
+            self._entries[handle] = (time.monotonic() + self.ttl, pages)
+            self._entries.move_to_end(handle)
+            self._reads += 1
+
+        if page < 1 or page > len(pages):
+            return {'success': False, 'error': f'页码超出范围: {page}（共 {len(pages)} 页）'}
+        return {
+            'success': True,
+            'result': {
+                'handle': handle,
+                'page': page,
+                'pages': len(pages),
+                'content': pages[page - 1]
+            }
+        }
+
+    def stats(self) -> Dict:
+        """存储统计，用于监控"""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'reads': self._reads,
+                'misses': self._misses
+            }
+
+
+def encode_result(result: Dict, max_tokens: int, count_tokens: Callable[[str], int],
+                  store: Optional[ResultStore] = None) -> Tuple[str, bool]:
+    """
+    把工具结果编码为回传给模型的文本
+
+    只截断 result 字段，success / error / note 等字段保持原样（没有 result 字段时截断整个结果）；
+    截断时完整结果存入 store，编码中附带 handle 和页数，模型可调用 read_tool_result 按页读取
+
+    Returns:
+        (编码后的文本, 是否截断)
+    """
+    text = compact_json(result)
+    if count_tokens(text) <= max_tokens:
+        return text, False
+
+    wrapped = isinstance(result, dict) and 'result' in result
+    value = result['result'] if wrapped else result
+    full = compact_json(value)
+    shrunk, _ = truncate_value(value, max_tokens, count_tokens)
+    encoded = dict(result, result=shrunk) if wrapped else {'result': shrunk}
+    if store is not None:
+        pages = split_pages(full, max_tokens, count_tokens)
+        encoded['truncated'] = {
+            'handle': store.put(pages),
+            'pages': len(pages),
+            'hint': f'结果过长已截断，可调用 {RESULT_PAGE_TOOL} 按页读取完整内容'
+        }
+        logger.info(f"   ✂️ 工具结果过长（约 {count_tokens(full)} tokens），已截断并保存为 {len(pages)} 页")
+    else:
+        encoded['truncated'] = True
+    return compact_json(encoded), True
+
+
+# 全局共享的截断结果存储
+result_store = ResultStore(
+    max_entries=int(os.environ.get('TOOL_RESULT_STORE_SIZE', '256')),
+    ttl=float(os.environ.get('TOOL_RESULT_STORE_TTL', '1800'))
+)
@@ -0,0 +1,355 @@
+"""
+模型输出扫描器
+单次线性扫描识别 <think>、<tool_call>（完整 / 未封闭 / 属性格式）和 fn({...}) 函数调用，
+同时得到清理后的文本、thinking 内容和工具调用列表；即使是很长的异常输出也不会出现回溯卡死
+"""
+
+import re
+import json
+from typing import Dict, List, Optional
+
+THINK_OPEN = '<think>'
+THINK_CLOSE = '</think>'
+TOOL_CALL_OPEN = '<tool_call'
+TOOL_CALL_CLOSE = '</tool_call>'
+
+# 特殊标记：thinking 标签、tool_call 标签、函数调用 name( {
+# 函数名要求前面不是标识符字符，保证每个单词只被尝试一次
+_TOKEN = re.compile(r'<think>|</think>|<tool_call|(?<![A-Za-z0-9_])([A-Za-z_][A-Za-z0-9_]*)\s*\(\s*\{')
+# 增量扫描只识别 thinking 和完整的 <tool_call>
+_EAGER_TOKEN = re.compile(r'<think>|<tool_call>')
+_JSON_SPECIAL = re.compile(r'[{}\[\]"\\,]')
+_ATTR_NAME = re.compile(r'\s+name="([^"]+)"')
+_ATTR_ARGUMENTS = re.compile(r'\s+arguments=([\'"])')
+_SPACES = re.compile(r'\s*')
+
+_CLOSERS = {'{': '}', '[': ']'}
+
+
+class BraceMatcher:
+    """
+    从 '{' 开始查找配对的 '}'（识别 JSON 字符串和转义）
+
+    扫描状态会被保留，流式输入时追加内容后从上次停下的位置继续
+    """
+
+    def __init__(self, start: int):
+        self.pos = start
+        self.depth = 0
+        self.in_string = False
+        self.skip = -1
+
+    def scan(self, text: str) -> int:
+        """返回配对 '}' 的下标，尚未闭合时返回 -1"""
+        for m in _JSON_SPECIAL.finditer(text, self.pos):
+            pos = m.start()
+            if pos == self.skip:
+                continue
+            char = m.group(0)
+            if self.in_string:
+                if char == '\\':
+                    self.skip = pos + 1
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char == '{':
+                self.depth += 1
+            elif char == '}':
+                self.depth -= 1
+                if self.depth == 0:
+                    self.pos = pos + 1
+                    return pos
+        self.pos = len(text)
+        return -1
+
+
+def match_brace(text: str, start: int) -> int:
+    """
+    从 text[start] 的 '{' 开始查找配对的 '}'
+
+    Returns:
+        配对 '}' 的下标，没有闭合时返回 -1
+    """
+    return BraceMatcher(start).scan(text)
+
+
+def complete_json(fragment: str) -> Optional[Dict]:
+    """
+    补全被截断的 JSON 对象（流式输出中断时常见）
+
+    先直接补齐未闭合的括号；不行则丢弃最后一个不完整的成员（如被截断的键 "argu）再补齐。
+    被截断的字符串值不会被补全，避免得到错误的工具名
+    """
+    fragment = fragment.strip()
+    if not fragment.startswith('{'):
+        return None
+
+    stack = []  # [(开括号, 当前成员起始位置)]
+    in_string = False
+    skip = -1
+    for m in _JSON_SPECIAL.finditer(fragment):
+        pos = m.start()
+        if pos == skip:
+            continue
+        char = m.group(0)
+        if in_string:
+            if char == '\\':
+                skip = pos + 1
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in '{[':
+            stack.append((char, pos + 1))
+        elif char in '}]':
+            if stack:
+                stack.pop()
+            if not stack:
+                # 对象已完整，后面的内容忽略
+                fragment = fragment[:pos + 1]
+                break
+        elif char == ',' and stack:
+            stack[-1] = (stack[-1][0], pos)
+
+    closers = ''.join(_CLOSERS[opener] for opener, _ in reversed(stack))
+    candidates = []
+    if not in_string:
+        candidates.append(fragment + closers)
+    if stack:
+        candidates.append(fragment[:stack[-1][1]].rstrip().rstrip(',') + closers)
+
+    for candidate in candidates:
+        try:
+            data = json.loads(candidate)
+        except (json.JSONDecodeError, RecursionError):
+            # 嵌套过深的异常输出直接放弃
+            continue
+        if isinstance(data, dict):
+            return data
+    return None
+
+
+def _load_call(text: str) -> Optional[Dict]:
+    """解析 {"name": ..., "arguments": {...}} 格式的调用"""
+    try:
+        data = json.loads(text.strip())
+    except json.JSONDecodeError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def _parse_arguments(text: str) -> Dict:
+    try:
+        args = json.loads(text) if text else {}
+    except json.JSONDecodeError:
+        return {}
+    return args if isinstance(args, dict) else {}
+
+
+def _scan_attribute_tag(content: str, pos: int):
+    """
+    解析属性格式 <tool_call name="..." arguments='...'/>（pos 指向 '<tool_call' 之后）
+
+    Returns:
+        (name, arguments, end, closed)：end 为标签结束位置，未封闭时为 len(content)；不是工具调用标签时返回 None
+    """
+    m = _ATTR_NAME.match(content, pos)
+    if not m:
+        return None
+    name, pos = m.group(1), m.end()
+
+    args_text = ''
+    m = _ATTR_ARGUMENTS.match(content, pos)
+    if m:
+        quote = m.group(1)
+        close = content.find(quote, m.end())
+        if close == -1:
+            # 参数未写完
+            return name, _parse_arguments(content[m.end():]), len(content), False
+        args_text, pos = content[m.end():close], close + 1
+
+    pos = _SPACES.match(content, pos).end()
+    if content.startswith('/>', pos):
+        return name, _parse_arguments(args_text), pos + 2, True
+    if content.startswith('>', pos):
+        return name, _parse_arguments(args_text), pos + 1, True
+    if pos >= len(content):
+        return name, _parse_arguments(args_text), len(content), False
+    return None
+
+
+def scan_model_output(content: str) -> Dict:
+    """
+    扫描模型输出
+
+    Returns:
+        {'text': 清理后的文本, 'thinking': thinking 内容, 'tool_calls': [{'name', 'arguments'}]}
+
+    规则与原正则实现保持一致：
+    - 只提取已闭合的 <think>，多个之间用换行连接
+    - 完整的 <tool_call>{json}</tool_call> 全部保留；其他格式按工具名去重
+    - fn({...}) 只在最后一个 </think> 之后识别
+    - 末尾未封闭的 <tool_call> / fn({ 会尝试补全 JSON
+    """
+    text_parts = []
+    thinking_parts = []
+    calls = []  # [(name, arguments, strict)]
+    last_think_end = content.rfind(THINK_CLOSE)
+    call_area_start = last_think_end + len(THINK_CLOSE) if last_think_end != -1 else 0
+
+    pos = 0
+    length = len(content)
+    while pos < length:
+        m = _TOKEN.search(content, pos)
+        if not m:
+            break
+        start, token = m.start(), m.group(0)
+
+        if token == THINK_OPEN:
+            end = content.find(THINK_CLOSE, m.end())
+            if end == -1:
+                # thinking 尚未结束：保留原文，其中的内容不当作工具调用
+                break
+            text_parts.append(content[pos:start])
+            thinking_parts.append(content[m.end():end])
+            pos = end + len(THINK_CLOSE)
+            continue
+
+        if token == THINK_CLOSE:
+            text_parts.append(content[pos:m.end()])
+            pos = m.end()
+            continue
+
+        if token == TOOL_CALL_OPEN:
+            if content.startswith('>', m.end()):
+                body_start = m.end() + 1
+                end = content.find(TOOL_CALL_CLOSE, body_start)
+                if end == -1:
+                    # 未封闭的 <tool_call>：尝试补全
+                    data = complete_json(content[body_start:])
+                    if data and data.get('name'):
+                        calls.append((data['name'], data.get('arguments', {}), False))
+                        text_parts.append(content[pos:start])
+                        pos = length
+                    break
+                data = _load_call(content[body_start:end])
+                if data and 'name' in data:
+                    calls.append((data['name'], data.get('arguments', {}), True))
+                text_parts.append(content[pos:start])
+                pos = end + len(TOOL_CALL_CLOSE)
+                continue
+
+            tag = _scan_attribute_tag(content, m.end())
+            if tag is None:
+                text_parts.append(content[pos:m.end()])
+                pos = m.end()
+                continue
+            name, arguments, end, _ = tag
+            calls.append((name, arguments, False))
+            text_parts.append(content[pos:start])
+            pos = end
+            continue
+
+        # 函数调用 name({...})
+        if start < call_area_start:
+            text_parts.append(content[pos:m.end()])
+            pos = m.end()
+            continue
+
+        name = m.group(1)
+        brace_start = m.end() - 1
+        brace_end = match_brace(content, brace_start)
+        if brace_end == -1:
+            # 未封闭的函数调用：之后的内容都属于这段 JSON
+            if name.islower() or '_' in name:
+                arguments = complete_json(content[brace_start:])
+                if arguments is not None:
+                    calls.append((name, arguments, False))
+                    text_parts.append(content[pos:start])
+                    pos = length
+            break
+
+        after = _SPACES.match(content, brace_end + 1).end()
+        if content.startswith(')', after):
+            try:
+                arguments = json.loads(content[brace_start:brace_end + 1])
+                calls.append((name, arguments, False))
+            except json.JSONDecodeError:
+                pass
+            text_parts.append(content[pos:start])
+            pos = after + 1
+        else:
+            text_parts.append(content[pos:brace_end + 1])
+            pos = brace_end + 1
+
+    text_parts.append(content[pos:])
+
+    # 完整的 <tool_call> 全部保留，其余格式按工具名去重
+    strict_names = {name for name, _, strict in calls if strict}
+    seen = set()
+    tool_calls = []
+    for name, arguments, strict in calls:
+        if not strict and (name in strict_names or name in seen):
+            continue
+        seen.add(name)
+        tool_calls.append({'name': name, 'arguments': arguments})
+
+    return {
+        'text': ''.join(text_parts).strip(),
+        'thinking': '\n'.join(thinking_parts),
+        'tool_calls': tool_calls
+    }
+
+
+class StreamingToolScanner:
+    """
+    增量工具调用扫描器
+
+    逐块输入模型输出，完整的 <tool_call>{json}</tool_call> 一闭合就立即返回，
+    不必等待整段输出结束，调用方可以在模型继续输出时先执行工具。
+    只提前返回 thinking 之外的完整 <tool_call>：其他格式（fn({...})、属性标签、未封闭的调用）
+    是否有效取决于之后的内容（如后面出现的 </think> 或同名的完整调用），仍由输出结束后的 scan_model_output 识别。
+    已扫描过的内容不再保留，每块输入只处理一次
+    """
+
+    # 标记可能被切在两个块之间，末尾保留不足一个标记长度的字符等下一块再扫描
+    TAIL = len(TOOL_CALL_OPEN)
+
+    def __init__(self):
+        self.buffer = ''    # 尚未扫描完的内容
+        self.mode = 'text'  # text / think / tool_call
+        self.body = []      # 未闭合的 <tool_call> 中已收到的 JSON
+
+    def feed(self, chunk: str) -> List[Dict]:
+        """输入一块模型输出，返回这块内容中新闭合的工具调用"""
+        buffer = self.buffer + chunk
+        pos = 0
+        calls = []
+        while True:
+            if self.mode == 'text':
+                m = _EAGER_TOKEN.search(buffer, pos)
+                if not m:
+                    pos = max(pos, len(buffer) - self.TAIL)
+                    break
+                self.mode = 'think' if m.group(0) == THINK_OPEN else 'tool_call'
+                pos = m.end()
+                continue
+
+            close = THINK_CLOSE if self.mode == 'think' else TOOL_CALL_CLOSE
+            end = buffer.find(close, pos)
+            if end == -1:
+                keep = max(len(buffer) - len(close) + 1, pos)
+                if self.mode == 'tool_call':
+                    self.body.append(buffer[pos:keep])
+                pos = keep
+                break
+            if self.mode == 'tool_call':
+                data = _load_call(''.join(self.body) + buffer[pos:end])
+                self.body = []
+                if data and 'name' in data:
+                    calls.append({'name': data['name'], 'arguments': data.get('arguments', {})})
+            self.mode = 'text'
+            pos = end + len(close)
+        self.buffer = buffer[pos:]
+        return calls
@@ -0,0 +1,240 @@
+"""
+工具相关性筛选
+工具很多时只把与当前问题相关的工具定义发给模型：对工具名称、描述和参数说明建立本地 BM25 索引
+（注册/删除工具时增量更新），结合各工具的调用次数排序，取前 top_k 个
+"""
+
+import os
+import re
+import json
+import math
+import threading
+import logging
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from context_window import estimate_tokens
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 未在请求中设置 tool_top_k 时的默认值（0 表示不筛选）
+DEFAULT_TOP_K = int(os.environ.get('TOOL_SELECT_TOP_K', '0'))
+
+_WORD = re.compile(r'[a-z0-9]+|[\u2e80-\u9fff\uac00-\ud7af]+')
+_CAMEL = re.compile(r'([a-z0-9])([A-Z])')
+
+
+def tokenize(text: str) -> List[str]:
+    """分词：英文按单词（拆分 snake_case / camelCase），中日韩文字按单字和相邻两字"""
+    terms = []
+    for word in _WORD.findall(_CAMEL.sub(r'\1 \2', text or '').lower()):
+        if word[0] < '\u2e80':
+            terms.append(word)
+            continue
+        terms.extend(word)
+        terms.extend(word[i:i + 2] for i in range(len(word) - 1))
+    return terms
+
+
+def _parameter_text(schema) -> str:
+    """参数定义中的名称和说明"""
+    parts = []
+    if isinstance(schema, dict):
+        for name, prop in (schema.get('properties') or {}).items():
+            parts.append(name)
+            if isinstance(prop, dict):
+                parts.append(str(prop.get('description', '')))
+                parts.append(_parameter_text(prop))
+    return ' '.join(part for part in parts if part)
+
+
+def tool_document(tool: Dict) -> str:
+    """工具的检索文本：名称、描述和参数说明"""
+    return f"{tool.get('name', '')} {tool.get('description', '')} {_parameter_text(tool.get('parameters'))}"
+
+
+def tool_signature(tool: Dict) -> str:
+    """工具定义（名称、描述、参数）的紧凑 JSON，用于判断索引是否需要更新和估算定义 token 数"""
+    return json.dumps(
+        {'name': tool['name'], 'description': tool.get('description', ''), 'parameters': tool.get('parameters', {})},
+        ensure_ascii=False, separators=(',', ':'), sort_keys=True
+    )
+
+
+def query_text(messages: List[Dict]) -> str:
+    """最新一条用户消息的文本（多模态消息只取文字部分）"""
+    for message in reversed(messages):
+        if message.get('role') != 'user':
+            continue
+        content = message.get('content')
+        if isinstance(content, str):
+            return content
+        if isinstance(content, list):
+            return ' '.join(part.get('text', '') for part in content if isinstance(part, dict) and part.get('type') == 'text')
+    return ''
+
+
+class ToolSelector:
+    """
+    工具相关性筛选器
+
+    - BM25 索引按工具名称保存，sync() 按工具定义的内容与注册表对比，只增删有变化的工具
+      （注册表重新加载后配置字典都是新对象，不能按对象判断是否修改）
+    - 排序分数 = BM25 + usage_weight * log(1 + 调用次数)，常用工具在相关性相近时优先
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75, usage_weight: float = 0.5):
+        self.k1 = k1
+        self.b = b
+        self.usage_weight = usage_weight
+        self._lock = threading.Lock()
+        self._docs: Dict[str, Tuple[str, Counter, int, int]] = {}  # 名称 -> (定义签名, 词频, 文档长度, 定义 token 数)
+        self._df: Counter = Counter()
+        self._total_length = 0
+        self._usage: Counter = Counter()
+        self._version = None
+        self._selections = 0
+        self._saved_tokens = 0
+        self._indexed_docs = 0  # 建立（或重建）索引的次数
+
+    # ==================== 索引 ====================
+
+    def add(self, tool: Dict):
+        """加入（或替换）一个工具"""
+        self._add(tool, tool_signature(tool))
+
+    def _add(self, tool: Dict, signature: str):
+        terms = Counter(tokenize(tool_document(tool)))
+        length = sum(terms.values())
+        schema_tokens = estimate_tokens(signature)
+        with self._lock:
+            self._remove(tool['name'])
+            self._docs[tool['name']] = (signature, terms, length, schema_tokens)
+            self._indexed_docs += 1
+            self._df.update(terms.keys())
+            self._total_length += length
+
+    def remove(self, name: str):
+        """移除一个工具"""
+        with self._lock:
+            self._remove(name)
+
+    def _remove(self, name: str):
+        doc = self._docs.pop(name, None)
+        if doc is None:
+            return
+        df = self._df
+        for term in doc[1]:
+            if df[term] <= 1:
+                del df[term]
+            else:
+                df[term] -= 1
+        self._total_length -= doc[2]
+
+    def sync(self, tools: List[Dict], version=None):
+        """
+        与注册表同步：只处理新增、修改（定义签名变化）和删除的工具
+
+        Args:
+            tools: 注册表中的全部工具
+            version: 注册表版本，与上次相同时直接跳过
+        """
+        if version is not None and version == self._version:
+            return
+        current = {tool['name']: tool for tool in tools if tool.get('name')}
+        changed = self._changed(current.values())
+        removed = [name for name in list(self._docs) if name not in current]
+        for name in removed:
+            self.remove(name)
+        for tool, signature in changed:
+            self._add(tool, signature)
+        self._version = version
+        if changed or removed:
+            logger.debug(f"🔎 工具索引已更新: +{len(changed)} -{len(removed)}（共 {len(self._docs)} 个）")
+
+    def _changed(self, tools) -> List[Tuple[Dict, str]]:
+        """签名与索引中不同（或尚未索引）的工具及其新签名"""
+        changed = []
+        for tool in tools:
+            signature = tool_signature(tool)
+            doc = self._docs.get(tool['name'])
+            if doc is None or doc[0] != signature:
+                changed.append((tool, signature))
+        return changed
+
+    def record_usage(self, name: str):
+        """记录一次工具调用"""
+        with self._lock:
+            self._usage[name] += 1
+
+    # ==================== 排序 ====================
+
+    def rank(self, query: str, candidates: List[Dict]) -> List[Tuple[float, Dict]]:
+        """按相关性对候选工具排序（未建立索引的候选工具按需加入）"""
+        for tool, signature in self._changed(candidates):
+            self._add(tool, signature)
+
+        terms = Counter(tokenize(query))
+        with self._lock:
+            count = max(1, len(self._docs))
+            average_length = self._total_length / count or 1
+            scored = []
+            for position, tool in enumerate(candidates):
+                _, doc_terms, length, _ = self._docs[tool['name']]
+                score = 0.0
+                for term in terms:
+                    frequency = doc_terms.get(term)
+                    if not frequency:
+                        continue
+                    df = self._df[term]
+                    idf = math.log(1 + (count - df + 0.5) / (df + 0.5))
+                    score += idf * frequency * (self.k1 + 1) / (
+                        frequency + self.k1 * (1 - self.b + self.b * length / average_length)
+                    )
+                score += self.usage_weight * math.log1p(self._usage[tool['name']])
+                scored.append((score, -position, tool))
+        scored.sort(key=lambda item: (item[0], item[1]), reverse=True)
+        return [(score, tool) for score, _, tool in scored]
+
+    def select(self, query: str, candidates: List[Dict], top_k: int) -> Tuple[List[Dict], Optional[Dict]]:
+        """
+        取最相关的 top_k 个工具（保持候选中的原始顺序）
+
+        Returns:
+            (选中的工具, 筛选报告)；不需要筛选时报告为 None
+        """
+        if top_k <= 0 or len(candidates) <= top_k:
+            return candidates, None
+
+        chosen = {id(tool) for _, tool in self.rank(query, candidates)[:top_k]}
+        selected = [tool for tool in candidates if id(tool) in chosen]
+        with self._lock:
+            schema_tokens = sum(self._docs[tool['name']][3] for tool in candidates)
+            selected_tokens = sum(self._docs[tool['name']][3] for tool in selected)
+            self._selections += 1
+            self._saved_tokens += schema_tokens - selected_tokens
+        report = {
+            'selected': [tool['name'] for tool in selected],
+            'total': len(candidates),
+            'schema_tokens': schema_tokens,
+            'selected_schema_tokens': selected_tokens,
+            'saved_tokens': schema_tokens - selected_tokens
+        }
+        logger.info(f"   🔎 工具筛选: {len(selected)}/{len(candidates)} 个，工具定义约 {schema_tokens} → {selected_tokens} tokens")
+        return selected, report
+
+    def stats(self) -> Dict:
+        """筛选统计，用于监控"""
+        with self._lock:
+            return {
+                'indexed': len(self._docs),
+                'index_builds': self._indexed_docs,
+                'selections': self._selections,
+                'saved_tokens': self._saved_tokens,
+                'top_used': self._usage.most_common(10)
+            }
+
+
+# 全局共享的工具筛选器
+tool_selector = ToolSelector()